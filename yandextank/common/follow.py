@@ -0,0 +1,130 @@
+'''
+Follow files that are being appended to, like tail -f does
+'''
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import time
+
+logger = logging.getLogger(__name__)
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_NONBLOCK = os.O_NONBLOCK
+
+
+class InotifyWatch(object):
+    """
+    Wait for modifications of a file using Linux inotify
+    """
+
+    def __init__(self, filename):
+        libc_name = ctypes.util.find_library('c')
+        if not libc_name:
+            raise OSError("libc not found")
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError("inotify is not supported")
+        self.fd = libc.inotify_init1(IN_NONBLOCK)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        if libc.inotify_add_watch(self.fd, filename.encode('utf-8'),
+                                  IN_MODIFY | IN_CLOSE_WRITE) < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, os.strerror(err))
+
+    def wait(self, timeout):
+        """
+        Block until the file is modified or timeout expires,
+        return True if it was modified
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return False
+        try:
+            while os.read(self.fd, 4096):
+                pass
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+        return True
+
+    def close(self):
+        os.close(self.fd)
+
+
+class SleepWatch(object):
+    """
+    Fallback for systems without inotify: sleep for the whole timeout
+    """
+
+    def wait(self, timeout):
+        time.sleep(timeout)
+        return False
+
+    def close(self):
+        pass
+
+
+def watch(filename):
+    try:
+        return InotifyWatch(filename)
+    except (OSError, AttributeError) as e:
+        logger.debug("Can't watch %s with inotify, will poll it: %s",
+                     filename, e)
+        return SleepWatch()
+
+
+class FileFollower(object):
+    """
+    Wrapper for a file that is being appended to. read() and readline()
+    return whatever is available right away. wait_for_data() blocks until
+    the file is modified or a timeout expires. The timeout starts at
+    min_wait and doubles up to max_wait while there is no new data, so
+    an idle file costs little CPU and an active one is read without delay.
+    """
+
+    def __init__(self, filename, mode='r', min_wait=0.01, max_wait=1.0):
+        self.filename = filename
+        self.file = open(filename, mode)
+        self.watch = watch(filename)
+        self.min_wait = min_wait
+        self.max_wait = max_wait
+        self.timeout = min_wait
+
+    def _got(self, data):
+        if data:
+            self.timeout = self.min_wait
+        else:
+            # python 2 files keep stdio EOF set, so appended data would
+            # never be read without a seek
+            self.file.seek(0, os.SEEK_CUR)
+        return data
+
+    def read(self, size=-1):
+        return self._got(self.file.read(size))
+
+    def readinto(self, buf):
+        return self._got(self.file.readinto(buf))
+
+    def readline(self):
+        return self._got(self.file.readline())
+
+    def wait_for_data(self):
+        if not self.watch.wait(self.timeout):
+            self.timeout = min(self.timeout * 2, self.max_wait)
+
+    def tell(self):
+        return self.file.tell()
+
+    def seek(self, offset, whence=0):
+        return self.file.seek(offset, whence)
+
+    def close(self):
+        self.file.close()
+        self.watch.close()
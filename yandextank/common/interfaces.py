@@ -103,7 +103,13 @@ class MonitoringDataListener(object):
 
 class AggregateResultListener(object):
     """ Listener interface
-    parent class for Aggregate results listeners"""
+    parent class for Aggregate results listeners
+
+    Listeners are notified from threads of their own, so a slow one
+    doesn't hold up others. Cheap listeners that must react at once
+    set aggregator_fast_path and are notified from the core thread."""
+
+    aggregator_fast_path = False
 
     def on_aggregated_data(self, data, stats):
         """
@@ -122,6 +128,9 @@ class AbstractInfoWidget(object):
     ''' InfoWidgets interface
     parent class for all InfoWidgets'''
 
+    # widgets only update counters when notified about aggregated data
+    aggregator_fast_path = True
+
     def __init__(self):
         LOG = logging.getLogger(__name__)
 
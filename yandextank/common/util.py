@@ -2,7 +2,9 @@
 Common utilities
 '''
 import os
+import queue as q
 import threading as th
+import time
 import http.client
 import logging
 import errno
@@ -21,23 +23,48 @@ logger = logging.getLogger(__name__)
 
 class Drain(th.Thread):
     """
-    Drain a generator to a destination that answers to put(), in a thread
+    Drain a generator to a queue, in a thread. When the queue is bounded
+    and full, the drain blocks, so the generator is not asked for more
+    items until the consumer catches up. blocked_time is the total time
+    spent waiting for the queue.
     """
 
-    def __init__(self, source, destination):
+    def __init__(self, source, destination, check_period=0.1):
         super(Drain, self).__init__()
         self.source = source
         self.destination = destination
+        self.check_period = check_period
+        self.blocked_time = 0.0
         self._finished = th.Event()
         self._interrupted = th.Event()
 
+    def _put(self, item):
+        try:
+            self.destination.put_nowait(item)
+            return
+        except q.Full:
+            pass
+        start = time.time()
+        try:
+            while not self._interrupted.is_set():
+                try:
+                    self.destination.put(item, timeout=self.check_period)
+                    return
+                except q.Full:
+                    pass
+        finally:
+            self.blocked_time += time.time() - start
+
     def run(self):
         for item in self.source:
-            self.destination.put(item)
+            self._put(item)
             if self._interrupted.is_set():
                 break
         self._finished.set()
 
+    def is_finished(self):
+        return self._finished.is_set()
+
     def wait(self, timeout=None):
         self._finished.wait(timeout=timeout)
 
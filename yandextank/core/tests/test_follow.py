@@ -0,0 +1,50 @@
+import threading
+import time
+
+from yandextank.common.follow import FileFollower, SleepWatch
+
+
+class TestFileFollower(object):
+    def test_read_appended(self, tmpdir):
+        path = tmpdir.join('phout.txt')
+        path.write('first\n')
+        follower = FileFollower(str(path))
+        assert follower.read() == 'first\n'
+        assert follower.read() == ''
+        with path.open('a') as f:
+            f.write('second\n')
+        assert follower.read() == 'second\n'
+        follower.close()
+
+    def test_wakes_on_append(self, tmpdir):
+        path = tmpdir.join('phout.txt')
+        path.write('')
+        follower = FileFollower(str(path), min_wait=5, max_wait=5)
+
+        def append():
+            time.sleep(0.1)
+            with path.open('a') as f:
+                f.write('data\n')
+
+        writer = threading.Thread(target=append)
+        writer.start()
+        start = time.time()
+        follower.wait_for_data()
+        writer.join()
+        if not isinstance(follower.watch, SleepWatch):
+            assert time.time() - start < 1
+        assert follower.read() == 'data\n'
+        follower.close()
+
+    def test_backoff(self, tmpdir):
+        path = tmpdir.join('phout.txt')
+        path.write('')
+        follower = FileFollower(str(path), min_wait=0.01, max_wait=0.04)
+        for _ in range(4):
+            follower.wait_for_data()
+        assert follower.timeout == 0.04
+        with path.open('a') as f:
+            f.write('data\n')
+        follower.read()
+        assert follower.timeout == 0.01
+        follower.close()
@@ -34,3 +34,21 @@ class TestDrain(object):
         drain.start()
         drain.wait()
         assert destination.qsize() == 1000000
+
+    def test_back_pressure(self):
+        """
+        Test drain waits for a bounded destination and can be
+        interrupted while waiting
+        """
+        source = range(100)
+        destination = Queue(maxsize=5)
+        drain = Drain(source, destination, check_period=0.01)
+        drain.start()
+        drain.wait(0.2)
+        assert not drain.is_finished()
+        assert destination.qsize() == 5
+        destination.get()
+        drain.close()
+        drain.join(1)
+        assert not drain.is_alive()
+        assert drain.blocked_time > 0
@@ -1,8 +1,12 @@
 # -*- coding: UTF-8 -*-
 import logging
 import numpy as np
+import pandas as pd
 import time
-from collections import Counter
+from itertools import chain
+
+from .histogram import BinLayout, Histogram, HistogramLayout
+from .limiter import TagLimiter
 
 logger = logging.getLogger(__name__)
 
@@ -26,48 +30,122 @@ phantom_config = {
 }
 
 
+# distinct integers are counted with bincount when they span less
+MAX_BINCOUNT_SPAN = 1 << 16
+
+DEFAULT_PERCENTILES = [50, 75, 80, 85, 90, 95, 98, 99, 100]
+
+# times distribution bins in microseconds, either edges or
+# [start, stop, step] ranges of evenly spaced edges
+BIN_LAYOUTS = {
+    "default": [
+        0, 1000, 2000, 3000, 4000, 5000, 6000, 7000, 8000, 9000,
+        10000, 20000, 30000, 40000, 50000, 60000, 70000, 80000, 90000,
+        100000, 150000, 200000, 250000, 300000, 350000, 400000, 450000,
+        500000, 600000, 650000, 700000, 750000, 800000, 850000, 900000,
+        950000, 1000000, 1500000, 2000000, 2500000, 3000000, 3500000,
+        4000000, 4500000, 5000000, 5500000, 6000000, 6500000, 7000000,
+        7500000, 8000000, 8500000, 9000000, 9500000, 10000000, 11000000,
+        12000000, 13000000, 14000000, 15000000, 20000000, 25000000,
+        30000000, 35000000, 40000000, 45000000, 50000000, 55000000,
+        60000000,
+    ],
+    "verbose": [
+        [0, 5000, 10],  # 10µs accuracy
+        [5000, 10000, 100],  # 100µs accuracy
+        [10000, 500000, 1000],  # 1ms accuracy
+        [500000, 3000000, 5000],  # 5ms accuracy
+        [3000000, 10000000, 10000],  # 10ms accuracy
+        [10000000, 30000000, 50000],  # 50ms accuracy
+        [30000000, 120000000, 100000],  # 100ms accuracy
+        [120000000, 301000000, 1000000],  # 1s accuracy
+    ],
+}
+
+
+def bin_edges(bins):
+    """
+    Edges array for a BIN_LAYOUTS name or a layout definition
+    """
+    if not isinstance(bins, list):
+        if bins not in BIN_LAYOUTS:
+            raise ValueError("Unknown bin layout: %s" % bins)
+        bins = BIN_LAYOUTS[bins]
+    return np.concatenate([
+        np.arange(*edge) if isinstance(edge, list) else [edge]
+        for edge in bins
+    ]).astype(np.int64)
+
+
+def factorize(tags):
+    """
+    pd.factorize of a tag column, tags as an object array. Categorical
+    tags are factorized by their integer codes.
+    """
+    codes, uniques = pd.factorize(tags)
+    return codes, np.asarray(uniques, dtype=object)
+
+
 class Worker(object):
     """
     Aggregate Pandas dataframe or dict with numpy ndarrays in it
+
+    'hist' and 'q' are derived from a log-linear histogram that is built
+    once per column. 'hdr' exposes this histogram itself, so consumers can
+    merge seconds or tags without access to raw samples.
+
+    Besides aggregating a single frame, Worker computes mergeable states
+    for many groups of rows at once (partials), merges them (merge) and
+    renders them to the same output format (render). Code counts are kept
+    in states as arrays of distinct codes and their counts and are only
+    turned into dicts when rendered.
+
+    A column is configured with a list of aggregates or with a dict:
+    {"aggregates": [...], "percentiles": [...], "bins": name or edges},
+    bins being a BIN_LAYOUTS name or a layout definition.
     """
 
-    def __init__(self, config, verbose_histogram):
-        if verbose_histogram:
-            bins = np.linspace(0, 4990, 500)  # 10µs accuracy
-            bins = np.append(bins,
-                             np.linspace(5000, 9900, 50))  # 100µs accuracy
-            bins = np.append(bins,
-                             np.linspace(10, 499, 490) * 1000)  # 1ms accuracy
-            bins = np.append(bins, np.linspace(500, 2995, 500) *
-                             1000)  # 5ms accuracy
-            bins = np.append(bins, np.linspace(3000, 9990, 700) *
-                             1000)  # 10ms accuracy
-            bins = np.append(bins, np.linspace(10000, 29950, 400) *
-                             1000)  # 50ms accuracy
-            bins = np.append(bins, np.linspace(30000, 119900, 900) *
-                             1000)  # 100ms accuracy
-            bins = np.append(bins, np.linspace(120, 300, 181) *
-                             1000000)  # 1s accuracy
-        else:
-            # yapf: disable
-            bins = np.array([
-                0, 1, 2, 3, 4, 5, 6, 7, 8, 9,
-                10, 20, 30, 40, 50, 60, 70, 80, 90,
-                100, 150, 200, 250, 300, 350, 400, 450,
-                500, 600, 650, 700, 750, 800, 850, 900, 950,
-                1000, 1500, 2000, 2500, 3000, 3500, 4000, 4500,
-                5000, 5500, 6000, 6500, 7000, 7500, 8000, 8500, 9000, 9500, 10000, 11000,
-                12000, 13000, 14000, 15000, 20000, 25000, 30000, 35000, 40000, 45000, 50000,
-                55000, 60000,
-            ]) * 1000
-            # yapf: enable
-
-        self.bins = bins
-        self.percentiles = np.array([50, 75, 80, 85, 90, 95, 98, 99, 100])
-        self.config = config
-        self.aggregators = {
+    # state fields an aggregate is rendered from
+    requirements = {
+        "hist": ("histogram", ),
+        "q": ("histogram", ),
+        "hdr": ("histogram", ),
+        "mean": ("total", "len"),
+        "total": ("total", ),
+        "min": ("min", ),
+        "max": ("max", ),
+        "count": ("count", ),
+        "len": ("len", ),
+    }
+
+    def __init__(self, config, verbose_histogram, relative_error=None):
+        if relative_error is None:
+            relative_error = 0.001 if verbose_histogram else 0.01
+        self.layout = HistogramLayout(relative_error)
+        default_bins = 'verbose' if verbose_histogram else 'default'
+        self.config = {}
+        self.percentiles = {}
+        self.bins = {}
+        compiled = {}
+        for key, column in config.items():
+            if not isinstance(column, dict):
+                column = {"aggregates": column}
+            self.config[key] = column["aggregates"]
+            self.percentiles[key] = np.array(
+                column.get("percentiles", DEFAULT_PERCENTILES))
+            bins = column.get("bins", default_bins)
+            if isinstance(bins, list):
+                self.bins[key] = BinLayout(bin_edges(bins), self.layout)
+            else:
+                if bins not in compiled:
+                    compiled[bins] = BinLayout(bin_edges(bins), self.layout)
+                self.bins[key] = compiled[bins]
+        self.histogram_aggregators = {
             "hist": self._histogram,
             "q": self._quantiles,
+            "hdr": self._hdr,
+        }
+        self.aggregators = {
             "mean": self._mean,
             "total": self._total,
             "min": self._min,
@@ -75,15 +153,44 @@ class Worker(object):
             "count": self._count,
             "len": self._len,
         }
+        self.renderers = {
+            "hist": lambda key, state: self._histogram(
+                key, state["histogram"]),
+            "q": lambda key, state: self._quantiles(key, state["histogram"]),
+            "hdr": lambda key, state: self._hdr(key, state["histogram"]),
+            "mean": lambda key, state: float(state["total"]) / state["len"],
+            "total": lambda key, state: state["total"],
+            "min": lambda key, state: state["min"],
+            "max": lambda key, state: state["max"],
+            "count": lambda key, state: self._render_counts(state["count"]),
+            "len": lambda key, state: state["len"],
+        }
+        self.mergers = {
+            "histogram": lambda states: Histogram.merged(self.layout, states),
+            "total": sum,
+            "min": min,
+            "max": max,
+            "count": self._merge_counts,
+            "len": sum,
+        }
+        self.fields = {
+            key: set(chain(*(self.requirements[aggregate]
+                             for aggregate in aggregates)))
+            for key, aggregates in self.config.items()
+        }
 
-    def _histogram(self, series):
-        data, bins = np.histogram(series, bins=self.bins)
+    def _histogram(self, key, histogram):
+        bins = self.bins[key]
+        data = bins.count(histogram)
         mask = data > 0
         return {
             "data": [e.item() for e in data[mask]],
-            "bins": [e.item() for e in bins[1:][mask]],
+            "bins": [e.item() for e in bins.edges[1:][mask]],
         }
 
+    def _hdr(self, key, histogram):
+        return histogram.to_dict()
+
     def _mean(self, series):
         return series.mean().item()
 
@@ -97,28 +204,181 @@ class Worker(object):
         return series.min().item()
 
     def _count(self, series):
-        return {str(k): v for k, v in dict(Counter(series)).items()}
+        return self._render_counts(self._counts(np.asarray(series)))
+
+    @staticmethod
+    def _render_counts(counts):
+        values, counts = counts
+        return dict(zip([str(v) for v in values.tolist()], counts.tolist()))
+
+    @staticmethod
+    def _counts(values):
+        """
+        (distinct values, their counts), with bincount for
+        integers from a small range
+        """
+        if not len(values):
+            return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+        if values.dtype.kind in 'iu':
+            low = values.min()
+            if values.max() - low < MAX_BINCOUNT_SPAN:
+                counts = np.bincount(values - low)
+                present = np.flatnonzero(counts)
+                return present + low, counts[present]
+        return np.unique(values, return_counts=True)
 
     def _len(self, series):
         return len(series)
 
-    def _quantiles(self, series):
+    def _quantiles(self, key, histogram):
         return {
-            "q": list(self.percentiles),
-            "value": list(np.percentile(series, self.percentiles)),
+            "q": list(self.percentiles[key]),
+            "value": list(histogram.quantiles(self.percentiles[key])),
         }
 
+    def _aggregate_column(self, key, series, aggregates):
+        result = {}
+        histogram = None
+        for aggregate in aggregates:
+            if aggregate in self.histogram_aggregators:
+                if histogram is None:
+                    histogram = Histogram.from_values(self.layout, series)
+                result[aggregate] = self.histogram_aggregators[aggregate](
+                    key, histogram)
+            else:
+                result[aggregate] = self.aggregators[aggregate](series)
+        return result
+
     def aggregate(self, data):
+        return {
+            key: self._aggregate_column(key, data[key], self.config[key])
+            for key in self.config
+        }
+
+    @staticmethod
+    def _merge_counts(states):
+        values, inverse = np.unique(
+            np.concatenate([values for values, _ in states]),
+            return_inverse=True)
+        counts = np.bincount(
+            inverse.ravel(),
+            weights=np.concatenate([counts for _, counts in states]),
+            minlength=len(values))
+        return values, counts.astype(np.int64)
+
+    def _grouped_histograms(self, values, codes, bounds, mins, maxs):
+        size = self.layout.size
+        keys, counts = np.unique(codes * size + self.layout.index(values),
+                                 return_counts=True)
+        splits = np.searchsorted(keys // size, bounds)
+        index = keys % size
+        return [
+            Histogram(self.layout, index[start:end], counts[start:end],
+                      min_value, max_value)
+            for start, end, min_value, max_value in zip(
+                splits[:-1], splits[1:], mins, maxs)
+        ]
+
+    @staticmethod
+    def _grouped_counts(values, codes, bounds):
+        """
+        (distinct values, their counts) for every group. Codes are small
+        integers, so they are counted without hashing
+        """
+        if values.dtype.kind in 'iu' and \
+                values.max() - values.min() < MAX_BINCOUNT_SPAN:
+            low = values.min()
+            value_codes = values - low
+            span = int(values.max() - low) + 1
+            uniques = None
+        else:
+            value_codes, uniques = pd.factorize(values)
+            span = len(uniques)
+        keys = codes * span + value_codes
+        if len(bounds) * span < MAX_BINCOUNT_SPAN:
+            counts = np.bincount(keys)
+            keys = np.flatnonzero(counts)
+            counts = counts[keys]
+        else:
+            keys, counts = np.unique(keys, return_counts=True)
+        splits = np.searchsorted(keys // span, bounds)
+        if uniques is None:
+            values = keys % span + low
+        else:
+            values = np.asarray(uniques)[keys % span]
+        return [
+            (values[start:end], counts[start:end])
+            for start, end in zip(splits[:-1], splits[1:])
+        ]
+
+    def partials(self, data, codes, groups):
+        """
+        Mergeable states for every group of rows, computed in one
+        vectorized pass over each column. codes holds a group number
+        from range(groups) for each row, every group should have rows.
+        """
+        codes = np.asarray(codes, dtype=np.int64)
+        order = np.argsort(codes, kind='mergesort')
+        codes = codes[order]
+        sizes = np.bincount(codes, minlength=groups)
+        starts = np.cumsum(sizes) - sizes
+        bounds = np.arange(groups + 1)
+        states = [{key: {} for key in self.config} for _ in range(groups)]
+        for key, fields in self.fields.items():
+            values = np.asarray(data[key])[order]
+            columns = {}
+            if "len" in fields:
+                columns["len"] = sizes.tolist()
+            if "total" in fields:
+                columns["total"] = np.add.reduceat(values, starts).tolist()
+            if fields & {"min", "max", "histogram"}:
+                mins = np.minimum.reduceat(values, starts).tolist()
+                maxs = np.maximum.reduceat(values, starts).tolist()
+                columns["min"] = mins
+                columns["max"] = maxs
+            if "histogram" in fields:
+                columns["histogram"] = self._grouped_histograms(
+                    values, codes, bounds, mins, maxs)
+            if "count" in fields:
+                columns["count"] = self._grouped_counts(values, codes, bounds)
+            for field, column in columns.items():
+                if field in fields:
+                    for state, value in zip(states, column):
+                        state[key][field] = value
+        return states
+
+    def merge(self, states):
+        """
+        Merge states produced by partials into one
+        """
         return {
             key: {
-                aggregate: self.aggregators.get(aggregate)(data[key])
-                for aggregate in self.config[key]
+                field: self.mergers[field]([state[key][field]
+                                            for state in states])
+                for field in fields
             }
-            for key in self.config
+            for key, fields in self.fields.items()
+        }
+
+    def render(self, state):
+        """
+        Render a state to the same output format aggregate has
+        """
+        return {
+            key: {
+                aggregate: self.renderers[aggregate](key, state[key])
+                for aggregate in aggregates
+            }
+            for key, aggregates in self.config.items()
         }
 
 
 class DataPoller(object):
+    """
+    Poll source for chunks, sleeping poll_period after each poll. Sources
+    that wait for new data themselves should be polled with zero period.
+    """
+
     def __init__(self, source, poll_period):
         self.poll_period = poll_period
         self.source = source
@@ -130,24 +390,173 @@ class DataPoller(object):
             time.sleep(self.poll_period)
 
 
+class Cumulative(object):
+    """
+    Whole-test aggregation states for overall and every tag, updated by
+    merging per-second states into them. Only tags that were updated
+    since the previous render are rendered again.
+    """
+
+    def __init__(self, worker):
+        self.worker = worker
+        self.overall = None
+        self.tagged = {}
+        self.rendered = {}
+        self.updated = set()
+
+    def _merge(self, cumulative, state):
+        if cumulative is None:
+            return state
+        return self.worker.merge([cumulative, state])
+
+    def update(self, overall, tagged):
+        if overall is not None:
+            self.overall = self._merge(self.overall, overall)
+        for tag, state in tagged.items():
+            self.tagged[tag] = self._merge(self.tagged.get(tag), state)
+            self.updated.add(tag)
+
+    def update_rendered(self, rendered):
+        """
+        Take tags that are accumulated and rendered elsewhere
+        """
+        self.rendered.update(rendered)
+
+    def render_updated(self):
+        """
+        Render tags updated since the previous call
+        """
+        updated = {
+            tag: self.worker.render(self.tagged[tag])
+            for tag in self.updated
+        }
+        self.rendered.update(updated)
+        self.updated = set()
+        return updated
+
+    def render(self):
+        self.render_updated()
+        return {
+            "overall": self.worker.render(self.overall)
+            if self.overall is not None else {},
+            "tagged": dict(self.rendered),
+        }
+
+
 class Aggregator(object):
-    def __init__(self, source, config, verbose_histogram):
-        self.worker = Worker(config, verbose_histogram)
+    """
+    Aggregate every second for all tags in one grouped pass, overall
+    results are merged from per-tag states. Samples without a tag are
+    aggregated as a separate group that only contributes to overall.
+
+    Every result also carries whole-test aggregates for overall and each
+    tag under the 'cumulative' key. Results for late samples the chopper
+    passed as amendments are flagged with 'amendment': True.
+
+    With max_tags, only the most frequent tags are aggregated on their
+    own, the rest are aggregated together under limiter.OTHER.
+    """
+
+    def __init__(self, source, config, verbose_histogram,
+                 relative_error=None, max_tags=None):
+        self.worker = Worker(config, verbose_histogram, relative_error)
+        self.cumulative = Cumulative(self.worker)
+        self.limiter = TagLimiter(max_tags) if max_tags else None
         self.source = source
         self.groupby = 'tag'
 
+    def _states(self, chunk):
+        """
+        Per-tag states and overall state of a chunk
+        """
+        codes, tags = factorize(chunk[self.groupby])
+        if self.limiter:
+            codes, tags = self.limiter.fold(codes, tags)
+        groups = len(tags)
+        if (codes < 0).any():
+            codes[codes < 0] = groups
+            groups += 1
+        states = self.worker.partials(chunk, codes, groups)
+        return dict(zip(tags, states)), self.worker.merge(states)
+
+    def _render(self, tagged, overall):
+        return {
+            tag: self.worker.render(state)
+            for tag, state in tagged.items()
+        }, self.worker.render(overall)
+
+    def _result(self, ts, tagged, overall, amendment):
+        self.cumulative.update(overall, tagged)
+        result = {"ts": ts}
+        result["tagged"], result["overall"] = self._render(tagged, overall)
+        result["cumulative"] = self.cumulative.render()
+        if amendment:
+            result["amendment"] = True
+        return result
+
     def __iter__(self):
-        for ts, chunk in self.source:
-            by_tag = list(chunk.groupby([self.groupby]))
+        for item in self.source:
+            ts, chunk = item
             start_time = time.time()
-            result = {
-                "ts": ts,
-                "tagged": {
-                    tag: self.worker.aggregate(data)
-                    for tag, data in by_tag
-                },
-                "overall": self.worker.aggregate(chunk),
-            }
+            tagged, overall = self._states(chunk)
+            result = self._result(ts, tagged, overall,
+                                  getattr(item, 'amendment', False))
             logger.debug("Aggregation time: %.2fms",
                          (time.time() - start_time) * 1000)
             yield result
+
+
+class RollupAggregator(Aggregator):
+    """
+    Aggregate buckets of 1 / per_second of a second, as produced by
+    chopper.Rebucket, and publish results for whole seconds, merged from
+    bucket states. Every result lists its buckets under 'subseconds' as
+    {"ts": <bucket start>, "tagged": ..., "overall": ...}.
+    """
+
+    def __init__(self, source, config, verbose_histogram, per_second,
+                 relative_error=None, max_tags=None):
+        super(RollupAggregator, self).__init__(
+            source, config, verbose_histogram, relative_error, max_tags)
+        self.per_second = per_second
+
+    def _rollup(self, second, buckets, amendment=False):
+        tagged = {}
+        for _, bucket_tagged, _ in buckets:
+            for tag, state in bucket_tagged.items():
+                tagged.setdefault(tag, []).append(state)
+        tagged = {
+            tag: self.worker.merge(states)
+            for tag, states in tagged.items()
+        }
+        overall = self.worker.merge(
+            [bucket_overall for _, _, bucket_overall in buckets])
+        result = self._result(second, tagged, overall, amendment)
+        result["subseconds"] = []
+        for bucket, bucket_tagged, bucket_overall in buckets:
+            subsecond = {"ts": float(bucket) / self.per_second}
+            subsecond["tagged"], subsecond["overall"] = self._render(
+                bucket_tagged, bucket_overall)
+            result["subseconds"].append(subsecond)
+        return result
+
+    def __iter__(self):
+        second = None
+        buckets = []
+        for item in self.source:
+            bucket, chunk = item
+            start_time = time.time()
+            tagged, overall = self._states(chunk)
+            if getattr(item, 'amendment', False):
+                yield self._rollup(bucket // self.per_second,
+                                   [(bucket, tagged, overall)], True)
+                continue
+            if buckets and bucket // self.per_second != second:
+                yield self._rollup(second, buckets)
+                buckets = []
+            second = bucket // self.per_second
+            buckets.append((bucket, tagged, overall))
+            logger.debug("Bucket aggregation time: %.2fms",
+                         (time.time() - start_time) * 1000)
+        if buckets:
+            yield self._rollup(second, buckets)
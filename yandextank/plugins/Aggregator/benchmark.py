@@ -0,0 +1,240 @@
+"""
+Benchmarks for the aggregation pipeline on synthetic phout. Run with:
+
+    python -m yandextank.plugins.Aggregator.benchmark --rps 50000 --tags 100
+
+A synthetic phout stream is parsed with PhantomReader's phout_to_df,
+chopped into seconds with TimeChopper and aggregated with Aggregator,
+each stage on the whole output of the previous one. Throughput and peak
+memory are reported for every stage, and the latency of every second
+taken from one Aggregator, cumulative aggregates included. Parse
+throughput of phout_to_df is compared to read_csv based string_to_df.
+Results are printed as JSON.
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+import pandas as pd
+from pkg_resources import resource_string
+
+from .aggregator import Aggregator
+from .chopper import TimeChopper
+from ..Phantom.reader import TagDictionary, phout_columns, phout_to_df, \
+    string_to_df
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+LATENCY_DISTRIBUTIONS = {
+    # response times in microseconds
+    'lognormal': lambda rng, size: rng.lognormal(9, 1, size),
+    'exponential': lambda rng, size: rng.exponential(20000, size),
+    'uniform': lambda rng, size: rng.uniform(1000, 100000, size),
+    'bimodal': lambda rng, size: np.where(
+        rng.rand(size) < 0.9,
+        rng.normal(10000, 1000, size), rng.normal(500000, 50000, size)),
+}
+
+
+def indexed_chunks(rows, seconds, chunk_rows, seed=42):
+    """
+    Frames indexed by second, as readers produce them: each chunk holds
+    chunk_rows consecutive samples, so a second spans many small chunks
+    """
+    rng = np.random.RandomState(seed)
+    index = np.sort(rng.randint(0, seconds, rows))
+    df = pd.DataFrame(
+        rng.randint(0, 100000, (rows, 4)),
+        columns=['interval_real', 'connect_time', 'net_code', 'proto_code'],
+        index=index)
+    return [df.iloc[i:i + chunk_rows] for i in range(0, rows, chunk_rows)]
+
+
+def bench_chopper(chunks, cache_size=3):
+    start = time.time()
+    rows = sum(len(data) for _, data in TimeChopper(chunks, cache_size))
+    elapsed = time.time() - start
+    return {
+        "stage": "chopper",
+        "rows": rows,
+        "chunks": len(chunks),
+        "seconds": elapsed,
+        "rows_per_sec": rows / elapsed if elapsed else None,
+    }
+
+
+def synthetic_phout(rps, seconds, tags, latency='lognormal', start=1.5e9,
+                    seed=42):
+    """
+    Phout text with rps samples a second spread among tags cases
+    """
+    rng = np.random.RandomState(seed)
+    rows = rps * seconds
+    interval_real = np.maximum(
+        LATENCY_DISTRIBUTIONS[latency](rng, rows), 1).astype(np.int64)
+    parts = rng.dirichlet(np.ones(4), rows)
+    phases = (parts * interval_real[:, None]).astype(np.int64)
+    frame = pd.DataFrame({
+        'send_ts': np.sort(start + rng.uniform(0, seconds, rows)),
+        'tag': np.char.add(
+            'case', rng.randint(0, tags, rows).astype(str)),
+        'interval_real': interval_real,
+        'connect_time': phases[:, 0],
+        'send_time': phases[:, 1],
+        'latency': phases[:, 2],
+        'receive_time': phases[:, 3],
+        'interval_event': phases[:, 2],
+        'size_out': rng.randint(100, 500, rows),
+        'size_in': rng.randint(1000, 50000, rows),
+        'net_code': np.where(rng.rand(rows) < 0.01, 110, 0),
+        'proto_code': rng.choice([200, 200, 200, 404, 500], rows),
+    }, columns=phout_columns)
+    return frame.to_csv(sep='\t', header=False, index=False,
+                        float_format='%.3f')
+
+
+def text_chunks(text, chunk_bytes):
+    """
+    Split text at line ends into chunks of about chunk_bytes,
+    as PhantomReader reads them
+    """
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = text.find('\n', start + chunk_bytes)
+        end = len(text) if end < 0 else end + 1
+        chunks.append(text[start:end])
+        start = end
+    return chunks
+
+
+def measure(stage, function, rows, **extra):
+    """
+    Run function twice: timed, and with memory tracing if available.
+    Return function's result and a stage report
+    """
+    start = time.time()
+    result = function()
+    elapsed = time.time() - start
+    peak = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    report = {
+        "stage": stage,
+        "rows": rows,
+        "seconds": elapsed,
+        "rows_per_sec": rows / elapsed if elapsed else None,
+        "peak_memory_bytes": peak,
+    }
+    report.update(extra)
+    return result, report
+
+
+def bench_parsers(text, chunk_bytes):
+    """
+    Reports for parsing text with string_to_df and with phout_to_df
+    """
+    chunks = text_chunks(text, chunk_bytes)
+    encoded = [chunk.encode('utf-8') for chunk in chunks]
+
+    def parse_bytes():
+        tags = TagDictionary()
+        return [phout_to_df(chunk, tags) for chunk in encoded]
+
+    _, text_parse = measure(
+        "parse", lambda: [string_to_df(chunk) for chunk in chunks],
+        rows=text.count('\n'), chunks=len(chunks),
+        implementation="string_to_df")
+    _, bytes_parse = measure(
+        "parse", parse_bytes,
+        rows=text.count('\n'), chunks=len(chunks),
+        implementation="phout_to_df")
+    return [text_parse, bytes_parse]
+
+
+def bench_pipeline(text, chunk_bytes, config, verbose_histogram=False):
+    """
+    Per-stage reports for phout_to_df -> TimeChopper -> Aggregator
+    """
+    chunks = [chunk.encode('utf-8')
+              for chunk in text_chunks(text, chunk_bytes)]
+    tags = TagDictionary()
+    frames, parse = measure(
+        "parse", lambda: [phout_to_df(chunk, tags) for chunk in chunks],
+        rows=text.count('\n'), chunks=len(chunks))
+    rows = sum(len(frame) for frame in frames)
+    seconds, chop = measure(
+        "chopper", lambda: list(TimeChopper(frames, cache_size=3)),
+        rows=rows, chunks=len(frames))
+
+    runs = []
+
+    def aggregate():
+        latencies = []
+        results = []
+        aggregator = iter(
+            Aggregator(iter(seconds), config, verbose_histogram))
+        while True:
+            start = time.time()
+            try:
+                result = next(aggregator)
+            except StopIteration:
+                break
+            latencies.append(time.time() - start)
+            results.append(result)
+        runs.append(latencies)
+        return results
+
+    _, aggregation = measure("aggregator", aggregate, rows=rows)
+    # the first run is not slowed down by memory tracing
+    latencies = runs[0]
+    aggregation.update({
+        "seconds_aggregated": len(latencies),
+        "latency_ms": {
+            "mean": float(np.mean(latencies)) * 1000,
+            "p50": float(np.percentile(latencies, 50)) * 1000,
+            "p99": float(np.percentile(latencies, 99)) * 1000,
+            "max": float(np.max(latencies)) * 1000,
+        } if latencies else None,
+    })
+    return [parse, chop, aggregation]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rps', type=int, default=50000)
+    parser.add_argument('--seconds', type=int, default=10)
+    parser.add_argument('--tags', type=int, default=10)
+    parser.add_argument(
+        '--latency', choices=sorted(LATENCY_DISTRIBUTIONS),
+        default='lognormal')
+    parser.add_argument('--chunk-bytes', type=int, default=1024 * 1024)
+    parser.add_argument('--chunk-rows', type=int, default=250)
+    parser.add_argument('--verbose-histogram', action='store_true')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    config = json.loads(resource_string(
+        __name__, 'config/phout.json').decode('utf8'))
+    text = synthetic_phout(args.rps, args.seconds, args.tags, args.latency,
+                           seed=args.seed)
+    results = bench_pipeline(text, args.chunk_bytes, config,
+                             args.verbose_histogram)
+    results += bench_parsers(text, args.chunk_bytes)
+
+    chunks = indexed_chunks(args.rps * args.seconds, args.seconds,
+                            args.chunk_rows, args.seed)
+    results.append(bench_chopper(chunks))
+    print(json.dumps({"parameters": vars(args), "results": results},
+                     indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,35 +2,135 @@
 Split incoming DataFrames into chunks, cache them, union chunks with same key
 and pass to the underlying aggregator.
 """
+import heapq
+import logging
 
+import numpy as np
 import pandas as pd
 
+logger = logging.getLogger(__name__)
+
+
+class Amendment(tuple):
+    """
+    (<timestamp>, <dataframe>) of samples that came after their key had
+    been emitted. Unpacks like a regular chopper item.
+    """
+    amendment = True
+
+
+def concat(fragments):
+    """
+    pd.concat that keeps categorical columns categorical when fragments
+    have different categories, e.g. tags of chunks with different tags
+    """
+    first = fragments[0]
+    for name in first.columns:
+        if first[name].dtype.name != 'category':
+            continue
+        categories = [fragment[name].cat.categories for fragment in fragments]
+        union = max(categories, key=len)
+        if all(len(c) == len(union) and c.equals(union) for c in categories):
+            continue
+        for c in categories:
+            union = union.append(c.difference(union))
+        columns = [fragment[name].cat.set_categories(union)
+                   for fragment in fragments]
+        fragments = [fragment.assign(**{name: column})
+                     for fragment, column in zip(fragments, columns)]
+    return pd.concat(fragments)
+
+
+class Rebucket(object):
+    """
+    Reindex chunks from seconds to buckets of 1 / per_second of a second:
+    bucket = second * per_second + number of the bucket within the second.
+    Buckets are taken within the second of the index, so a bucket never
+    belongs to another second than its samples.
+    """
+
+    def __init__(self, source, per_second, column='receive_ts'):
+        self.source = source
+        self.per_second = per_second
+        self.column = column
+
+    def __iter__(self):
+        for chunk in self.source:
+            seconds = np.asarray(chunk.index, dtype=np.int64)
+            fraction = np.floor(
+                (chunk[self.column].values - seconds) * self.per_second)
+            chunk.index = pd.Index(
+                seconds * self.per_second +
+                np.clip(fraction, 0, self.per_second - 1).astype(np.int64))
+            yield chunk
+
 
 class TimeChopper(object):
     """
     TimeChopper splits incoming dataframes by index. Chunks are cached and
     chunks for same key from different DFs are joined. Then chunks are passed
     further as (<timestamp>, <dataframe>) tuples.
+
+    Fragments of a key are only collected while it is cached and are
+    concatenated once, when the key is emitted. Cached keys are kept in a
+    heap, so the oldest one is found without scanning the cache.
+
+    A key is emitted when the event-time watermark passes it: the
+    watermark lags allowed_lateness behind the highest key seen. Keys are
+    also emitted when there are more than cache_size of them. Samples for
+    keys that have already been emitted are late: they are counted in
+    late_samples and either dropped (late='drop') or passed further as
+    Amendment items (late='amend').
     """
 
-    def __init__(self, source, cache_size):
+    def __init__(self, source, cache_size=None, allowed_lateness=None,
+                 late='amend'):
+        if late not in ('amend', 'drop'):
+            raise ValueError("Unknown late samples policy: %s" % late)
         self.cache_size = cache_size
+        self.allowed_lateness = allowed_lateness
+        self.late = late
         self.source = source
         self.cache = {}
+        self.keys = []
+        self.emitted = None
+        self.highest = None
+        self.late_samples = 0
+
+    def _pop_oldest(self):
+        key = heapq.heappop(self.keys)
+        fragments = self.cache.pop(key)
+        self.emitted = key
+        if len(fragments) == 1:
+            return key, fragments[0]
+        return key, concat(fragments)
+
+    def _ready(self):
+        if not self.keys:
+            return False
+        if self.cache_size is not None and len(self.cache) > self.cache_size:
+            return True
+        return self.allowed_lateness is not None and \
+            self.keys[0] < self.highest - self.allowed_lateness
 
     def __iter__(self):
         for chunk in self.source:
             grouped = chunk.groupby(level=0)
-            for group_key, group_data in list(grouped):
-                if group_key in self.cache:
-                    self.cache[group_key] = pd.concat([
-                        self.cache[group_key], group_data
-                    ])
+            for group_key, group_data in grouped:
+                if self.emitted is not None and group_key <= self.emitted:
+                    self.late_samples += len(group_data)
+                    logger.debug("%s late samples for %s", len(group_data),
+                                 group_key)
+                    if self.late == 'amend':
+                        yield Amendment((group_key, group_data))
+                elif group_key in self.cache:
+                    self.cache[group_key].append(group_data)
                 else:
-                    self.cache[group_key] = group_data
-                while len(self.cache) > self.cache_size:
-                    key = min(self.cache.keys())
-                    yield (key, self.cache.pop(key, None))
+                    self.cache[group_key] = [group_data]
+                    heapq.heappush(self.keys, group_key)
+                    if self.highest is None or group_key > self.highest:
+                        self.highest = group_key
+                while self._ready():
+                    yield self._pop_oldest()
         while self.cache:
-            key = min(self.cache.keys())
-            yield (key, self.cache.pop(key, None))
+            yield self._pop_oldest()
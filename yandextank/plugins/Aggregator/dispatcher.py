@@ -0,0 +1,203 @@
+"""
+Deliver aggregated seconds to listeners without letting a slow listener
+hold up the others
+"""
+import logging
+import queue as q
+import threading as th
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def listener_name(listener):
+    return getattr(listener, 'SECTION', None) or type(listener).__name__
+
+
+class DeliveryStats(object):
+    """
+    Delivery latency is the time from handing a second to the dispatcher
+    until the listener has processed it. last_ts is the latest second the
+    listener has processed.
+    """
+
+    def __init__(self):
+        self.delivered = 0
+        self.dropped = 0
+        self.latency = 0.0
+        self.max_latency = 0.0
+        self.last_ts = None
+
+    def delivered_at(self, queued_at, ts=None):
+        self.delivered += 1
+        self.latency = time.time() - queued_at
+        self.max_latency = max(self.max_latency, self.latency)
+        if ts is not None and (self.last_ts is None or ts > self.last_ts):
+            self.last_ts = ts
+
+    def as_dict(self):
+        return {
+            'delivered': self.delivered,
+            'dropped': self.dropped,
+            'latency': self.latency,
+            'max_latency': self.max_latency,
+        }
+
+
+class ListenerWorker(th.Thread):
+    """
+    Feed a listener from a bounded queue in a thread of its own. When the
+    queue is full, new seconds are dropped for this listener only.
+    """
+
+    def __init__(self, listener, name, queue_size):
+        super(ListenerWorker, self).__init__(name='listener-%s' % name)
+        self.daemon = True
+        self.listener = listener
+        self.listener_name = name
+        self.queue = q.Queue(maxsize=queue_size)
+        self.stats = DeliveryStats()
+
+    def put(self, data, stats):
+        try:
+            self.queue.put_nowait((time.time(), data, stats))
+        except q.Full:
+            self.stats.dropped += 1
+            logger.warning("Listener %s is too slow, dropped second %s",
+                           self.listener_name, data.get('ts'))
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    break
+                queued_at, data, stats = item
+                try:
+                    self.listener.on_aggregated_data(data, stats)
+                except Exception:
+                    logger.exception("Listener %s failed on second %s",
+                                     self.listener_name, data.get('ts'))
+                self.stats.delivered_at(queued_at, data.get('ts'))
+            finally:
+                self.queue.task_done()
+
+    def flush(self, deadline):
+        while self.queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.05)
+        return not self.queue.unfinished_tasks
+
+    def stop(self, deadline):
+        try:
+            self.queue.put(None, timeout=max(deadline - time.time(), 0))
+        except q.Full:
+            logger.warning("Listener %s is still busy, abandoning it",
+                           self.listener_name)
+
+
+class ListenerDispatcher(object):
+    """
+    Listeners with aggregator_fast_path set (autostop, console widgets)
+    are called right away, in order of subscription. Every other listener
+    gets its own queue and thread, so it can't delay the fast path or the
+    other listeners.
+    """
+
+    def __init__(self, queue_size=60, asynchronous=True):
+        self.queue_size = queue_size
+        self.asynchronous = asynchronous
+        self.pending = []
+        self.started = False
+        self.fast = []
+        self.workers = []
+        self.names = set()
+        self.last_ts = None
+
+    def _name(self, listener):
+        name = base = listener_name(listener)
+        index = 1
+        while name in self.names:
+            index += 1
+            name = '%s_%s' % (base, index)
+        self.names.add(name)
+        return name
+
+    def _attach(self, listener):
+        name = self._name(listener)
+        if not self.asynchronous or getattr(listener, 'aggregator_fast_path',
+                                            False):
+            self.fast.append((name, listener, DeliveryStats()))
+        else:
+            worker = ListenerWorker(listener, name, self.queue_size)
+            worker.start()
+            self.workers.append(worker)
+
+    def add(self, listener):
+        """
+        Listeners added before start are attached when it is called,
+        so that settings may change until then
+        """
+        if self.started:
+            self._attach(listener)
+        else:
+            self.pending.append(listener)
+
+    def start(self):
+        self.started = True
+        for listener in self.pending:
+            self._attach(listener)
+        self.pending = []
+
+    def notify(self, data, stats):
+        if not self.started:
+            self.start()
+        queued_at = time.time()
+        ts = data.get('ts')
+        if ts is not None and (self.last_ts is None or ts > self.last_ts):
+            self.last_ts = ts
+        for _, listener, delivery in self.fast:
+            listener.on_aggregated_data(data, stats)
+            delivery.delivered_at(queued_at, ts)
+        for worker in self.workers:
+            worker.put(data, stats)
+
+    def delivered_ts(self):
+        """
+        Latest second that every listener has processed, None if some
+        listener hasn't processed any yet
+        """
+        seen = [delivery.last_ts for _, _, delivery in self.fast] + \
+            [worker.stats.last_ts for worker in self.workers]
+        if not seen:
+            return self.last_ts
+        if None in seen:
+            return None
+        return min(seen)
+
+    def metrics(self):
+        """
+        {listener name: delivery stats and queue depth}
+        """
+        result = {}
+        for name, _, delivery in self.fast:
+            result[name] = dict(delivery.as_dict(), queue=0)
+        for worker in self.workers:
+            result[worker.listener_name] = dict(
+                worker.stats.as_dict(), queue=worker.queue.qsize())
+        return result
+
+    def close(self, timeout):
+        """
+        Let listeners process what they have got within timeout, then stop
+        their threads
+        """
+        deadline = time.time() + timeout
+        for worker in self.workers:
+            if not worker.flush(deadline):
+                logger.warning(
+                    "Listener %s didn't process %s seconds in time",
+                    worker.listener_name, worker.queue.unfinished_tasks)
+        for worker in self.workers:
+            worker.stop(deadline)
+        for worker in self.workers:
+            worker.join(max(deadline - time.time(), 0))
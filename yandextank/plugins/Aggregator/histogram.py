@@ -0,0 +1,206 @@
+"""
+Mergeable log-linear (HDR-style) histogram for non-negative integer values,
+such as response times in microseconds.
+
+Values below 2 ** sub_bucket_bits are counted exactly. Every power-of-two
+range above that is split into 2 ** (sub_bucket_bits - 1) linear sub-buckets,
+so the relative error of any value restored from its bucket is bounded by
+the relative error the layout was created with. Bucket assignment is plain
+index arithmetic, and histograms with the same layout merge by adding
+counts, so the cost of merging depends on bucket count, not sample count.
+"""
+import numpy as np
+
+
+class HistogramLayout(object):
+    """
+    Bucket layout. Only histograms that share a layout can be merged.
+    """
+
+    def __init__(self, relative_error=0.01):
+        relative_error = float(relative_error)
+        if not 0 < relative_error < 1:
+            raise ValueError(
+                "Histogram relative error should be in (0, 1): %s" %
+                relative_error)
+        self.relative_error = relative_error
+        self.sub_bucket_bits = int(np.ceil(np.log2(1.0 / relative_error))) + 1
+        self.sub_bucket_half = 1 << (self.sub_bucket_bits - 1)
+        # the highest int64 value has 63 significant bits
+        self.size = (63 - self.sub_bucket_bits + 2) * self.sub_bucket_half
+
+    def index(self, values):
+        """
+        Bucket index for each value in values
+        """
+        values = np.maximum(np.asarray(values, dtype=np.int64), 0)
+        bit_length = np.frexp(values.astype(np.float64))[1]
+        shift = np.maximum(bit_length - self.sub_bucket_bits, 0)
+        return shift * self.sub_bucket_half + (values >> shift)
+
+    def _shift(self, index):
+        index = np.asarray(index, dtype=np.int64)
+        return index, np.maximum(index // self.sub_bucket_half - 1, 0)
+
+    def lowest(self, index):
+        """
+        The lowest value that falls into each of the buckets
+        """
+        index, shift = self._shift(index)
+        return (index - shift * self.sub_bucket_half) << shift
+
+    def highest(self, index):
+        """
+        The highest value that falls into each of the buckets
+        """
+        index, shift = self._shift(index)
+        return ((index - shift * self.sub_bucket_half + 1) << shift) - 1
+
+    def __eq__(self, other):
+        return isinstance(other, HistogramLayout) and \
+            self.sub_bucket_bits == other.sub_bucket_bits
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'HistogramLayout(%s)' % self.relative_error
+
+
+class Histogram(object):
+    """
+    Sparse histogram: sorted indices of non-empty buckets and their counts.
+    Exact min and max are tracked alongside to make q0 and q100 exact.
+    """
+
+    def __init__(self, layout, index=None, count=None, min_value=0,
+                 max_value=0):
+        self.layout = layout
+        if index is None:
+            index = np.array([], dtype=np.int64)
+            count = np.array([], dtype=np.int64)
+        self.index = index
+        self.count = count
+        self.min = min_value
+        self.max = max_value
+
+    @classmethod
+    def from_values(cls, layout, values):
+        values = np.asarray(values)
+        if not len(values):
+            return cls(layout)
+        counts = np.bincount(layout.index(values))
+        index = np.flatnonzero(counts)
+        return cls(layout, index, counts[index],
+                   values.min().item(), values.max().item())
+
+    @classmethod
+    def from_dict(cls, layout, data):
+        """
+        Restore histogram from the output of to_dict
+        """
+        return cls(layout,
+                   np.array(data['index'], dtype=np.int64),
+                   np.array(data['count'], dtype=np.int64),
+                   data['min'], data['max'])
+
+    @classmethod
+    def merged(cls, layout, histograms):
+        """
+        Merge any number of histograms with the same layout in one pass
+        """
+        histograms = [h for h in histograms if len(h.index)]
+        if not histograms:
+            return cls(layout)
+        if any(h.layout != layout for h in histograms):
+            raise ValueError("Can't merge histograms with different layouts")
+        if len(histograms) == 1:
+            h = histograms[0]
+            return cls(layout, h.index, h.count, h.min, h.max)
+        counts = np.bincount(
+            np.concatenate([h.index for h in histograms]),
+            weights=np.concatenate([h.count for h in histograms]))
+        index = np.flatnonzero(counts)
+        return cls(layout, index, counts[index].astype(np.int64),
+                   min(h.min for h in histograms),
+                   max(h.max for h in histograms))
+
+    def merge(self, *others):
+        return self.merged(self.layout, (self, ) + others)
+
+    def __add__(self, other):
+        return self.merge(other)
+
+    def __len__(self):
+        return int(self.count.sum())
+
+    def quantiles(self, percentiles):
+        """
+        Nearest-rank percentiles. Every value is the highest value of the
+        bucket that holds the rank, clipped to the exact [min, max] range.
+        """
+        percentiles = np.asarray(percentiles, dtype=np.float64)
+        if not len(self.index):
+            return np.zeros(len(percentiles))
+        cumulative = np.cumsum(self.count)
+        ranks = np.clip(
+            np.ceil(percentiles / 100.0 * cumulative[-1]), 1, cumulative[-1])
+        buckets = self.index[np.searchsorted(cumulative, ranks)]
+        return np.clip(
+            self.layout.highest(buckets), self.min,
+            self.max).astype(np.float64)
+
+    def to_bins(self, bins):
+        """
+        Counts per bins interval, np.histogram style: each interval
+        includes its left edge, the last one includes its right edge too
+        and values outside of the bins are skipped. Buckets are attributed
+        by their lowest value.
+        """
+        if not len(self.index):
+            return np.zeros(len(bins) - 1, dtype=np.int64)
+        lowest = self.layout.lowest(self.index)
+        position = np.searchsorted(bins, lowest, side='right') - 1
+        position[lowest == bins[-1]] = len(bins) - 2
+        mask = (position >= 0) & (position < len(bins) - 1)
+        return np.bincount(position[mask],
+                           weights=self.count[mask],
+                           minlength=len(bins) - 1).astype(np.int64)
+
+    def to_dict(self):
+        return {
+            "index": self.index.tolist(),
+            "count": self.count.tolist(),
+            "min": self.min,
+            "max": self.max,
+        }
+
+
+class BinLayout(object):
+    """
+    Display bins compiled against a histogram layout: a lookup table maps
+    every histogram bucket to its bin, so counting a histogram into bins
+    costs one table lookup per non-empty bucket. Counts are the same as
+    Histogram.to_bins gives for these edges.
+    """
+
+    def __init__(self, edges, layout):
+        self.edges = np.asarray(edges)
+        self.layout = layout
+        bins = len(self.edges) - 1
+        lowest = layout.lowest(np.arange(layout.index([self.edges[-1]])[0] +
+                                         1))
+        table = np.searchsorted(self.edges, lowest, side='right') - 1
+        table[lowest == self.edges[-1]] = bins - 1
+        # the extra slot collects buckets outside of the bins
+        table[(table < 0) | (table >= bins)] = bins
+        self.table = np.append(table, bins)
+
+    def count(self, histogram):
+        if histogram.layout != self.layout:
+            raise ValueError("Bins are compiled for another histogram layout")
+        position = self.table[np.minimum(histogram.index,
+                                         len(self.table) - 1)]
+        return np.bincount(position,
+                           weights=histogram.count,
+                           minlength=len(self.edges))[:-1].astype(np.int64)
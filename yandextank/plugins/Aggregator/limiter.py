@@ -0,0 +1,56 @@
+"""
+Limit the number of tags aggregated separately
+"""
+import numpy as np
+import pandas as pd
+
+OTHER = '__OTHER__'
+
+
+class TagLimiter(object):
+    """
+    Track heavy-hitter tags with a Misra-Gries summary of at most max_tags
+    counters, updated with the tag counts of every second. Tags that are
+    in the summary are aggregated as they are, all others are folded into
+    the OTHER tag. Any tag that has more than 1 / (max_tags + 1) of all
+    samples seen so far is guaranteed to stay in the summary. When tags
+    tie for the last places, the first of them in tag order are kept, so
+    the summary always holds max_tags tags.
+    """
+
+    def __init__(self, max_tags):
+        if max_tags < 1:
+            raise ValueError("max_tags should be positive: %s" % max_tags)
+        self.max_tags = max_tags
+        self.counts = pd.Series(dtype=np.int64)
+
+    def update(self, tags, counts):
+        """
+        Add counts of distinct tags to the summary,
+        return a mask of tags that are in the summary now
+        """
+        counts = self.counts.add(pd.Series(counts, index=tags),
+                                 fill_value=0)
+        if len(counts) > self.max_tags:
+            threshold = np.partition(
+                counts.values, -(self.max_tags + 1))[-(self.max_tags + 1)]
+            top = np.argsort(-counts.values, kind='mergesort')
+            counts = counts.iloc[np.sort(top[:self.max_tags])] - threshold
+        self.counts = counts.astype(np.int64)
+        return np.asarray(pd.Index(tags).isin(self.counts.index))
+
+    def fold(self, codes, tags):
+        """
+        Rewrite pd.factorize result so that tags out of the summary
+        share the OTHER tag. Negative codes (no tag) are left as they are.
+        """
+        codes = np.asarray(codes)
+        tagged = codes >= 0
+        kept = self.update(
+            tags, np.bincount(codes[tagged], minlength=len(tags)))
+        if kept.all():
+            return codes, tags
+        mapping = np.full(len(tags), kept.sum(), dtype=np.int64)
+        mapping[kept] = np.arange(kept.sum())
+        folded = np.where(tagged, mapping[np.where(tagged, codes, 0)], -1)
+        return folded, list(np.asarray(tags, dtype=object)[kept]) + [OTHER]
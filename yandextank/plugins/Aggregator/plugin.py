@@ -1,16 +1,20 @@
 """ Core module to calculate aggregate data """
 import json
 import logging
+import time
 
 import queue as q
 from pkg_resources import resource_string
 from ...common.exceptions import PluginImplementationError
 
-from .aggregator import Aggregator, DataPoller
-from .chopper import TimeChopper
+from .aggregator import Aggregator, DataPoller, RollupAggregator
+from .chopper import Rebucket, TimeChopper
+from .dispatcher import ListenerDispatcher
+from .sharded import ShardedAggregator
 from ...common.interfaces import AbstractPlugin
 from ...common.interfaces import AggregateResultListener
-from ...common.util import Drain
+from ...common.util import Drain, expand_to_milliseconds, \
+    expand_to_seconds
 
 logger = logging.getLogger(__name__)
 
@@ -37,16 +41,45 @@ class Plugin(AbstractPlugin):
     def __init__(self, core):
         AbstractPlugin.__init__(self, core)
         self.listeners = []  # [LoggingListener()]
+        self.dispatcher = ListenerDispatcher(asynchronous=False)
+        self.listeners_flush_timeout = 30
         self.reader = None
         self.stats_reader = None
+        self.drain = None
+        self.stats_drain = None
         self.results = q.Queue()
         self.stats = q.Queue()
         self.verbose_histogram = False
+        self.histogram_relative_error = None
+        self.shards = 0
+        self.max_tags = 0
+        self.per_second = 1
+        self.queue_size = 60
+        self.cache_size = 300
+        self.stats_timeout = 10
+        # part of a core loop spent taking results of readers that
+        # aggregate on their own, e.g. phout import
+        self.import_drain_time = 0.4
+        self.allowed_lateness = 2
+        self.late_samples = 'amend'
+        self.chopper = None
+        self.amendments = 0
         self.data_cache = {}
         self.stat_cache = {}
+        self.flushed_data = 0
+        self.dropped_stats = 0
+        self.newest_data_ts = None
+        self.newest_stats_ts = None
+        self.stats_arrived_at = None
 
     def get_available_options(self):
-        return ["verbose_histogram"]
+        return [
+            "verbose_histogram", "histogram_relative_error", "shards",
+            "percentiles", "histogram_bins", "queue_size", "cache_size",
+            "stats_timeout", "allowed_lateness", "late_samples", "max_tags",
+            "resolution", "async_listeners", "listener_queue_size",
+            "listeners_flush_timeout"
+        ]
 
     def configure(self):
         self.aggregator_config = json.loads(resource_string(
@@ -57,21 +90,108 @@ class Plugin(AbstractPlugin):
                 verbose_histogram_option.lower() == "1")
         if self.verbose_histogram:
             logger.info("using verbose histogram")
+        relative_error = self.get_option("histogram_relative_error", "")
+        if relative_error:
+            self.histogram_relative_error = float(relative_error)
+        self.shards = int(self.get_option("shards", "0"))
+        self.max_tags = int(self.get_option("max_tags", self.max_tags))
+        resolution = expand_to_milliseconds(
+            self.get_option("resolution", "1s"))
+        if resolution <= 0 or 1000 % resolution:
+            raise ValueError(
+                "Aggregation resolution should divide a second: %sms" %
+                resolution)
+        self.per_second = 1000 // resolution
+        self.queue_size = int(self.get_option("queue_size", self.queue_size))
+        self.cache_size = int(self.get_option("cache_size", self.cache_size))
+        self.stats_timeout = expand_to_seconds(
+            self.get_option("stats_timeout", "%ss" % self.stats_timeout))
+        self.allowed_lateness = expand_to_seconds(
+            self.get_option("allowed_lateness",
+                            "%ss" % self.allowed_lateness))
+        self.late_samples = self.get_option("late_samples", self.late_samples)
+        self.dispatcher.asynchronous = bool(int(
+            self.get_option("async_listeners", "0")))
+        self.dispatcher.queue_size = int(
+            self.get_option("listener_queue_size", self.dispatcher.queue_size))
+        self.listeners_flush_timeout = expand_to_seconds(
+            self.get_option("listeners_flush_timeout",
+                            "%ss" % self.listeners_flush_timeout))
+        self.results = q.Queue(maxsize=self.queue_size)
+        self.stats = q.Queue(maxsize=self.queue_size)
+        # whole percentiles stay ints, consumers format them as q50, q99
+        percentiles = [
+            int(p) if float(p).is_integer() else float(p)
+            for p in self.get_option("percentiles", "").split()
+        ]
+        bins = self.get_option("histogram_bins", "")
+        if percentiles or bins:
+            for key, column in self.aggregator_config.items():
+                if not isinstance(column, dict):
+                    column = {"aggregates": column}
+                if percentiles:
+                    column["percentiles"] = percentiles
+                if bins:
+                    column["bins"] = bins
+                self.aggregator_config[key] = column
+
+    def _live_pipeline(self):
+        source = DataPoller(source=self.reader,
+                            poll_period=getattr(
+                                self.reader, 'poll_period', 1))
+        if self.per_second > 1:
+            source = Rebucket(source, self.per_second)
+        chopper = TimeChopper(
+            source,
+            allowed_lateness=self.allowed_lateness * self.per_second,
+            late=self.late_samples)
+        self.chopper = chopper
+        if self.per_second > 1:
+            if self.shards > 0:
+                logger.warning(
+                    "shards are not supported with sub-second "
+                    "resolution, aggregating in one thread")
+            return RollupAggregator(
+                chopper,
+                self.aggregator_config,
+                self.verbose_histogram,
+                self.per_second,
+                self.histogram_relative_error,
+                max_tags=self.max_tags)
+        if self.shards > 0:
+            logger.info("aggregating in %s shard processes", self.shards)
+            return ShardedAggregator(
+                chopper,
+                self.aggregator_config,
+                self.verbose_histogram,
+                self.histogram_relative_error,
+                processes=self.shards,
+                max_tags=self.max_tags)
+        return Aggregator(
+            chopper,
+            self.aggregator_config,
+            self.verbose_histogram,
+            self.histogram_relative_error,
+            max_tags=self.max_tags)
 
     def start_test(self):
+        self.dispatcher.start()
         if self.reader and self.stats_reader:
-            pipeline = Aggregator(
-                TimeChopper(
-                    DataPoller(source=self.reader,
-                               poll_period=1),
-                    cache_size=3),
-                self.aggregator_config,
-                self.verbose_histogram)
+            if hasattr(self.reader, 'aggregate'):
+                # readers that aggregate on their own, e.g. phout import
+                pipeline = self.reader.aggregate(
+                    self.aggregator_config,
+                    self.verbose_histogram,
+                    self.histogram_relative_error,
+                    max_tags=self.max_tags)
+            else:
+                pipeline = self._live_pipeline()
             self.drain = Drain(pipeline, self.results)
             self.drain.start()
             self.stats_drain = Drain(
                 DataPoller(source=self.stats_reader,
-                           poll_period=1),
+                           poll_period=getattr(
+                               self.stats_reader, 'poll_period', 1)),
                 self.stats)
             self.stats_drain.start()
         else:
@@ -99,45 +219,161 @@ class Plugin(AbstractPlugin):
         logger.debug("Stats timestamps:\n%s" % [d.get('ts') for d in stats])
         logger.debug("Data cache timestamps:\n%s" % self.data_cache.keys())
         logger.debug("Stats cache timestamps:\n%s" % self.stat_cache.keys())
+        now = time.time()
+        if stats:
+            self.stats_arrived_at = now
         for item in data:
             ts = item['ts']
+            if self.newest_data_ts is None or ts > self.newest_data_ts:
+                self.newest_data_ts = ts
+            if item.get('amendment'):
+                # stats of this second are gone with its first result,
+                # late samples only reach cumulative aggregates
+                self.amendments += 1
+                continue
             if ts in self.stat_cache:
                 # send items
                 data_item = item
-                stat_item = self.stat_cache.pop(ts)
+                _, stat_item = self.stat_cache.pop(ts)
                 self.__notify_listeners(data_item, stat_item)
             else:
-                self.data_cache[ts] = item
+                self.data_cache[ts] = (now, item)
         for item in stats:
             ts = item['ts']
+            if self.newest_stats_ts is None or ts > self.newest_stats_ts:
+                self.newest_stats_ts = ts
             if ts in self.data_cache:
                 # send items
-                data_item = self.data_cache.pop(ts)
+                _, data_item = self.data_cache.pop(ts)
                 stat_item = item
                 self.__notify_listeners(data_item, stat_item)
             else:
-                self.stat_cache[ts] = item
+                self.stat_cache[ts] = (now, item)
+        self._expire(now)
+        self._report_emitted()
+        self._publish_metrics()
+
+    def _report_emitted(self, force=False):
+        """
+        Let readers that checkpoint their position know which seconds
+        listeners have got
+        """
+        if hasattr(self.reader, 'emitted'):
+            self.reader.emitted(self.dispatcher.delivered_ts(), force)
+
+    @staticmethod
+    def _expired(cache, watermark, limit, deadline=None):
+        """
+        Timestamps of items older than watermark, of items cached before
+        deadline and of the oldest items that don't fit in limit
+        """
+        keys = sorted(cache)
+        overflow = max(len(keys) - limit, 0)
+        return [
+            ts for i, ts in enumerate(keys)
+            if i < overflow or watermark is not None and ts < watermark or
+            deadline is not None and cache[ts][0] < deadline
+        ]
+
+    def _expire(self, now, limit=None):
+        """
+        Data is sent with empty stats once stats are more than
+        stats_timeout seconds of test ahead of it, or if no stats came for
+        stats_timeout while it waited. Stats are dropped once data is more
+        than stats_timeout seconds ahead of them. Either stream lagging
+        behind the other doesn't make them miss each other.
+        """
+        if limit is None:
+            limit = self.cache_size
+        deadline = None
+        if self.stats_arrived_at is None or \
+                self.stats_arrived_at < now - self.stats_timeout:
+            deadline = now - self.stats_timeout
+        for ts in self._expired(
+                self.data_cache, self._watermark(self.newest_stats_ts),
+                limit, deadline):
+            _, data_item = self.data_cache.pop(ts)
+            logger.debug("No stats for %s, sending data with empty stats", ts)
+            self.flushed_data += 1
+            self.__notify_listeners(data_item, self.empty_stats(ts))
+        for ts in self._expired(
+                self.stat_cache, self._watermark(self.newest_data_ts),
+                limit):
+            logger.debug("No data for %s, dropping stats", ts)
+            self.stat_cache.pop(ts)
+            self.dropped_stats += 1
+
+    def _watermark(self, newest_ts):
+        if newest_ts is None:
+            return None
+        return newest_ts - self.stats_timeout
+
+    @staticmethod
+    def empty_stats(ts):
+        return {'ts': ts, 'metrics': {'instances': 0, 'reqps': 0}}
+
+    def _publish_metrics(self):
+        self.publish('results_queue', self.results.qsize())
+        self.publish('stats_queue', self.stats.qsize())
+        self.publish('data_cache', len(self.data_cache))
+        self.publish('stat_cache', len(self.stat_cache))
+        self.publish('flushed_data', self.flushed_data)
+        self.publish('dropped_stats', self.dropped_stats)
+        self.publish('amendments', self.amendments)
+        if self.chopper:
+            self.publish('late_samples', self.chopper.late_samples)
+        if self.drain:
+            self.publish('results_blocked_time', self.drain.blocked_time)
+        if self.stats_drain:
+            self.publish('stats_blocked_time', self.stats_drain.blocked_time)
+        for name, metrics in self.dispatcher.metrics().items():
+            for key, value in metrics.items():
+                self.publish('listeners.%s.%s' % (name, key), value)
 
     def is_test_finished(self):
         self._collect_data()
+        if self.drain and hasattr(self.reader, 'aggregate'):
+            self._drain_for(self.import_drain_time)
         return -1
 
+    def _drain_for(self, duration):
+        """
+        Readers that aggregate on their own produce seconds as fast as
+        they can, so keep taking them for a while instead of a queue_size
+        of them per core loop
+        """
+        deadline = time.time() + duration
+        while not self.drain.is_finished() and time.time() < deadline:
+            self.drain.wait(0.01)
+            self._collect_data()
+
+    def _wait(self, drain):
+        # drains block on full queues, keep them flowing while waiting
+        while not drain.is_finished():
+            self._collect_data()
+            drain.wait(0.1)
+
     def end_test(self, retcode):
         if self.reader:
             self.reader.close()
         if self.drain:
-            self.drain.wait()
+            self._wait(self.drain)
         if self.stats_reader:
             self.stats_reader.close()
         if self.stats_drain:
-            self.stats_drain.wait()
+            self._wait(self.stats_drain)
         self._collect_data()
+        # nothing else will come, send what is left
+        self._expire(time.time(), 0)
+        self.dispatcher.close(self.listeners_flush_timeout)
+        self._report_emitted(force=True)
+        self._publish_metrics()
         return retcode
 
     def add_result_listener(self, listener):
         self.listeners.append(listener)
+        self.dispatcher.add(listener)
 
     def __notify_listeners(self, data, stats):
         """ notify all listeners about aggregate data and stats """
-        for listener in self.listeners:
-            listener.on_aggregated_data(data, stats)
+        self.dispatcher.notify(data, stats)
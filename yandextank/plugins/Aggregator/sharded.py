@@ -0,0 +1,235 @@
+"""
+Aggregation sharded by tag across worker processes.
+
+Each second's samples are split by tag hash. Every shard process owns the
+tags that hash to it: it aggregates them, keeps their cumulative states and
+renders them. Samples move to shards through shared memory column buffers,
+only tag names and aggregated results are pickled. The parent merges the
+overall state of each shard into the overall result.
+"""
+import ctypes
+import logging
+import multiprocessing as mp
+import time
+import zlib
+from multiprocessing.sharedctypes import RawArray
+
+import numpy as np
+import pandas as pd
+
+from .aggregator import Cumulative, Worker, factorize
+from .limiter import TagLimiter
+
+logger = logging.getLogger(__name__)
+
+CODES = '__codes__'
+
+
+def _shard_loop(connection, buffers, config, verbose_histogram,
+                relative_error):
+    """
+    Shard process body. Messages are:
+      ('batch', rows, tags) -- buffers hold rows samples of this shard,
+          CODES column has indices in tags. Answered with None as soon as
+          buffers may be overwritten.
+      ('second', ) -- the second is complete. Answered with rendered
+          tags, overall state and rendered cumulative states of the tags.
+      None -- quit.
+    """
+    worker = Worker(config, verbose_histogram, relative_error)
+    cumulative = Cumulative(worker)
+    columns = {
+        key: np.frombuffer(buf, dtype=np.int64)
+        for key, buf in buffers.items()
+    }
+    states = {}
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        if message[0] == 'batch':
+            _, rows, tags = message
+            data = {key: column[:rows] for key, column in columns.items()}
+            codes, present = pd.factorize(data[CODES])
+            for code, state in zip(present,
+                                   worker.partials(data, codes, len(present))):
+                tag = tags[code]
+                if tag in states:
+                    state = worker.merge([states[tag], state])
+                states[tag] = state
+            connection.send(None)
+        elif message[0] == 'second':
+            overall = worker.merge(list(states.values()))
+            cumulative.update(None, states)
+            connection.send((
+                {tag: worker.render(state) for tag, state in states.items()},
+                overall,
+                cumulative.render_updated(),
+            ))
+            states = {}
+    connection.close()
+
+
+class Shard(object):
+    def __init__(self, columns, capacity, config, verbose_histogram,
+                 relative_error):
+        self.capacity = capacity
+        buffers = {
+            key: RawArray(ctypes.c_int64, capacity)
+            for key in columns + [CODES]
+        }
+        self.columns = {
+            key: np.frombuffer(buf, dtype=np.int64)
+            for key, buf in buffers.items()
+        }
+        self.connection, child_connection = mp.Pipe()
+        self.process = mp.Process(
+            target=_shard_loop,
+            args=(child_connection, buffers, config, verbose_histogram,
+                  relative_error))
+        self.process.daemon = True
+        self.process.start()
+        child_connection.close()
+
+    def send_batch(self, data, codes, tags):
+        rows = len(codes)
+        for key, values in data.items():
+            self.columns[key][:rows] = values
+        self.columns[CODES][:rows] = codes
+        self.connection.send(('batch', rows, tags))
+
+    def stop(self):
+        try:
+            self.connection.send(None)
+        except (IOError, OSError):
+            pass
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.connection.close()
+
+
+class ShardedAggregator(object):
+    """
+    Drop-in replacement for Aggregator that aggregates tags in shard
+    processes. Results are the same as Aggregator's. Untagged samples are
+    aggregated in the parent process. Aggregated columns should be integer.
+    """
+
+    def __init__(self, source, config, verbose_histogram,
+                 relative_error=None, processes=2, capacity=100000,
+                 max_tags=None):
+        self.worker = Worker(config, verbose_histogram, relative_error)
+        self.cumulative = Cumulative(self.worker)
+        self.limiter = TagLimiter(max_tags) if max_tags else None
+        self.source = source
+        self.config = config
+        self.verbose_histogram = verbose_histogram
+        self.relative_error = relative_error
+        self.processes = processes
+        self.capacity = capacity
+        self.groupby = 'tag'
+        self.shards = []
+        self.tag_shards = {}
+
+    def _shard_of(self, tag):
+        if tag not in self.tag_shards:
+            self.tag_shards[tag] = zlib.crc32(
+                str(tag).encode('utf-8')) % self.processes
+        return self.tag_shards[tag]
+
+    def _aggregate(self, chunk):
+        codes, tags = factorize(chunk[self.groupby])
+        if self.limiter:
+            codes, tags = self.limiter.fold(codes, tags)
+        untagged = codes < 0
+        shard_of_tag = np.array([self._shard_of(tag) for tag in tags],
+                                dtype=np.int64)
+        local_codes = np.zeros(len(tags), dtype=np.int64)
+        shard_tags = []
+        for shard in range(self.processes):
+            in_shard = np.flatnonzero(shard_of_tag == shard)
+            local_codes[in_shard] = np.arange(len(in_shard))
+            shard_tags.append([tags[code] for code in in_shard])
+
+        tagged_rows = np.flatnonzero(~untagged)
+        row_shards = shard_of_tag[codes[tagged_rows]]
+        order = tagged_rows[np.argsort(row_shards, kind='mergesort')]
+        sizes = np.bincount(row_shards, minlength=self.processes)
+        columns = {
+            key: np.asarray(chunk[key])[order]
+            for key in self.worker.config
+        }
+        codes = local_codes[codes[order]]
+
+        # feed shards batch by batch, each batch is processed in parallel
+        offsets = np.cumsum(sizes) - sizes
+        remaining = sizes.copy()
+        while remaining.any():
+            busy = []
+            for shard, worker in enumerate(self.shards):
+                if not remaining[shard]:
+                    continue
+                start = offsets[shard] + sizes[shard] - remaining[shard]
+                end = start + min(remaining[shard], worker.capacity)
+                worker.send_batch(
+                    {key: values[start:end]
+                     for key, values in columns.items()},
+                    codes[start:end], shard_tags[shard])
+                remaining[shard] -= end - start
+                busy.append(worker)
+            for worker in busy:
+                worker.connection.recv()
+
+        involved = [
+            worker for shard, worker in enumerate(self.shards)
+            if sizes[shard]
+        ]
+        for worker in involved:
+            worker.connection.send(('second', ))
+        tagged = {}
+        overall_states = []
+        for worker in involved:
+            rendered, overall, cumulative = worker.connection.recv()
+            tagged.update(rendered)
+            overall_states.append(overall)
+            self.cumulative.update_rendered(cumulative)
+        if untagged.any():
+            overall_states += self.worker.partials(
+                chunk[untagged], np.zeros(untagged.sum(), dtype=np.int64), 1)
+        return tagged, self.worker.merge(overall_states)
+
+    def _start(self):
+        columns = list(self.worker.config)
+        self.shards = [
+            Shard(columns, self.capacity, self.config,
+                  self.verbose_histogram, self.relative_error)
+            for _ in range(self.processes)
+        ]
+
+    def _stop(self):
+        for shard in self.shards:
+            shard.stop()
+        self.shards = []
+
+    def __iter__(self):
+        self._start()
+        try:
+            for item in self.source:
+                ts, chunk = item
+                start_time = time.time()
+                tagged, overall = self._aggregate(chunk)
+                self.cumulative.update(overall, {})
+                result = {
+                    "ts": ts,
+                    "tagged": tagged,
+                    "overall": self.worker.render(overall),
+                    "cumulative": self.cumulative.render(),
+                }
+                if getattr(item, 'amendment', False):
+                    result["amendment"] = True
+                logger.debug("Sharded aggregation time: %.2fms",
+                             (time.time() - start_time) * 1000)
+                yield result
+        finally:
+            self._stop()
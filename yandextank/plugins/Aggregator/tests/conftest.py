@@ -8,6 +8,35 @@ np.random.seed(42)
 MAX_TS = 1000
 
 
+class ConcatTimeChopper(object):
+    """
+    Reference chopper that concatenates a cached frame with every new
+    fragment of the same second, as TimeChopper used to do
+    """
+
+    def __init__(self, source, cache_size):
+        self.cache_size = cache_size
+        self.source = source
+        self.cache = {}
+
+    def __iter__(self):
+        for chunk in self.source:
+            grouped = chunk.groupby(level=0)
+            for group_key, group_data in list(grouped):
+                if group_key in self.cache:
+                    self.cache[group_key] = pd.concat([
+                        self.cache[group_key], group_data
+                    ])
+                else:
+                    self.cache[group_key] = group_data
+                while len(self.cache) > self.cache_size:
+                    key = min(self.cache.keys())
+                    yield (key, self.cache.pop(key, None))
+        while self.cache:
+            key = min(self.cache.keys())
+            yield (key, self.cache.pop(key, None))
+
+
 def random_split(df):
     i = 0
     while True:
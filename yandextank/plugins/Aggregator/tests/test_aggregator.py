@@ -0,0 +1,155 @@
+import json
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import pytest
+from pkg_resources import resource_string
+from yandextank.plugins.Aggregator.aggregator import Aggregator, \
+    RollupAggregator, Worker, bin_edges
+from yandextank.plugins.Aggregator.chopper import Amendment, Rebucket, \
+    TimeChopper
+from yandextank.plugins.Aggregator.sharded import ShardedAggregator
+
+AGGR_CONFIG = json.loads(resource_string("yandextank.plugins.Aggregator",
+                                         'config/phout.json').decode('utf-8'))
+AGGR_CONFIG["interval_real"] = AGGR_CONFIG["interval_real"] + ["hdr", "mean"]
+
+
+class TestAggregator(object):
+    def test_grouped_equals_per_tag(self, data):
+        data['tag'] = np.random.choice(['a', 'b', 'c', None], len(data))
+        worker = Worker(AGGR_CONFIG, False)
+        result = list(Aggregator([(1, data)], AGGR_CONFIG, False))[0]
+        assert result["ts"] == 1
+        assert sorted(result["tagged"]) == ['a', 'b', 'c']
+        for tag in ['a', 'b', 'c']:
+            expected = worker.aggregate(data[data.tag == tag])
+            assert result["tagged"][tag] == expected
+        assert result["overall"] == worker.aggregate(data)
+
+    def test_merge(self, data):
+        worker = Worker(AGGR_CONFIG, False)
+        codes = np.random.randint(0, 5, len(data))
+        states = worker.partials(data, codes, 5)
+        for code, state in enumerate(states):
+            assert worker.render(state) == worker.aggregate(
+                data[codes == code])
+        merged = worker.merge(states[:2] + [worker.merge(states[2:])])
+        assert worker.render(merged) == worker.aggregate(data)
+
+    def test_cumulative(self, data):
+        data['tag'] = np.random.choice(['a', 'b', 'c'], len(data))
+        seconds = [(ts, data.loc[[ts]]) for ts in sorted(set(data.index))[:20]]
+        results = list(Aggregator(seconds, AGGR_CONFIG, False))
+        worker = Worker(AGGR_CONFIG, False)
+        for i in (0, 9, 19):
+            seen = data.loc[[ts for ts, _ in seconds[:i + 1]]]
+            cumulative = results[i]["cumulative"]
+            assert cumulative["overall"] == worker.aggregate(seen)
+            for tag in set(seen.tag):
+                assert cumulative["tagged"][tag] == worker.aggregate(
+                    seen[seen.tag == tag])
+
+    def test_amendment(self, data):
+        data['tag'] = np.random.choice(['a', 'b'], len(data))
+        first, late = data.loc[[1]].iloc[:5], data.loc[[1]].iloc[5:]
+        results = list(Aggregator([(1, first), Amendment((1, late))],
+                                  AGGR_CONFIG, False))
+        assert "amendment" not in results[0]
+        assert results[1]["amendment"]
+        worker = Worker(AGGR_CONFIG, False)
+        assert results[1]["cumulative"]["overall"] == worker.aggregate(
+            data.loc[[1]])
+
+    @pytest.mark.parametrize("values", [
+        np.random.choice([0, 110, 200, 404, 500], 1000),
+        np.random.choice([-1, 2**40], 1000),
+        np.random.choice([200.0, 404.0], 1000),
+    ])
+    def test_counts(self, values):
+        worker = Worker({"code": ["count"]}, False)
+        codes = np.random.randint(0, 3, len(values))
+        states = worker.partials({"code": values}, codes, 3)
+        for code, state in enumerate(states):
+            expected = Counter(values[codes == code].tolist())
+            assert worker.render(state)["code"]["count"] == {
+                str(k): v for k, v in expected.items()}
+        assert worker.render(worker.merge(states))["code"]["count"] == {
+            str(k): v for k, v in Counter(values.tolist()).items()}
+        assert worker.aggregate({"code": values})["code"]["count"] == {
+            str(k): v for k, v in Counter(values.tolist()).items()}
+
+    def test_rollup(self, data):
+        rng = np.random.RandomState(0)
+        data['tag'] = rng.choice(['a', 'b', 'c'], len(data))
+        data['receive_ts'] = data.index + rng.rand(len(data))
+        data = data.loc[data.index < 30]
+        expected = list(Aggregator(TimeChopper([data.copy()], 3),
+                                   AGGR_CONFIG, False))
+        results = list(RollupAggregator(
+            TimeChopper(Rebucket([data.copy()], 4), 12),
+            AGGR_CONFIG, False, 4))
+        worker = Worker(AGGR_CONFIG, False)
+        assert len(results) == len(expected)
+        for result, second in zip(results, expected):
+            subseconds = result.pop("subseconds")
+            assert result == second
+            assert sum(s["overall"]["interval_real"]["len"]
+                       for s in subseconds) == len(data.loc[[second["ts"]]])
+            for subsecond in subseconds:
+                ts = subsecond["ts"]
+                assert int(ts) == second["ts"]
+                samples = data[(data.receive_ts >= ts) &
+                               (data.receive_ts < ts + 0.25)]
+                assert subsecond["overall"] == worker.aggregate(samples)
+
+    def test_column_percentiles_and_bins(self, data):
+        config = {
+            "interval_real": {
+                "aggregates": ["hist", "q"],
+                "percentiles": [50, 99.9],
+                "bins": [0, [10, 100, 10], 1000],
+            },
+            "connect_time": {
+                "aggregates": ["hist", "q"],
+                "bins": "verbose",
+            },
+        }
+        result = Worker(config, False).aggregate(data)
+        q = result["interval_real"]["q"]
+        assert q["q"] == [50, 99.9]
+        assert np.allclose(
+            q["value"], np.percentile(data.interval_real, [50, 99.9]),
+            rtol=0.02)
+        hist = result["interval_real"]["hist"]
+        expected, _ = np.histogram(data.interval_real,
+                                   bins=bin_edges([0, [10, 100, 10], 1000]))
+        assert hist["data"] == [e for e in expected if e]
+        assert len(result["connect_time"]["q"]["q"]) == 9
+        assert sum(result["connect_time"]["hist"]["data"]) == len(data)
+
+    def test_sharded_same_as_aggregator(self, data):
+        tags = ['case%s' % i for i in range(20)] + [None]
+        data['tag'] = np.random.choice(tags, len(data))
+        seconds = [(ts, data.loc[[ts]]) for ts in sorted(set(data.index))[:30]]
+        expected = list(Aggregator(seconds, AGGR_CONFIG, False))
+        sharded = list(ShardedAggregator(
+            seconds, AGGR_CONFIG, False, processes=3, capacity=4))
+        assert sharded == expected
+
+    def test_categorical_tags(self, data):
+        rng = np.random.RandomState(17)
+        names = ['case%s' % i for i in range(5)]
+        codes = rng.randint(-1, len(names), len(data))
+        seconds = sorted(set(data.index))[:20]
+        categorical = data.assign(
+            tag=pd.Categorical.from_codes(codes, categories=names))
+        plain = categorical.assign(tag=categorical.tag.astype(object))
+        expected = list(Aggregator(
+            [(ts, plain.loc[[ts]]) for ts in seconds], AGGR_CONFIG, False))
+        result = list(Aggregator(
+            [(ts, categorical.loc[[ts]]) for ts in seconds], AGGR_CONFIG,
+            False))
+        assert result == expected
+        assert all(isinstance(tag, str) for r in result for tag in r["tagged"])
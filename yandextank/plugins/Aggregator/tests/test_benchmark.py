@@ -0,0 +1,40 @@
+from test_pipeline import AGGR_CONFIG
+from yandextank.plugins.Aggregator.benchmark import bench_parsers, \
+    bench_pipeline, synthetic_phout, text_chunks
+
+
+class TestBenchmark(object):
+    def test_synthetic_phout(self):
+        rows = [line.split('\t')
+                for line in synthetic_phout(100, 2, 3).splitlines()]
+        assert len(rows) == 200
+        assert all(len(row) == 12 for row in rows)
+        send_ts = [float(row[0]) for row in rows]
+        assert send_ts == sorted(send_ts)
+        assert 1.5e9 <= send_ts[0] < send_ts[-1] <= 1.5e9 + 2
+        assert set(row[1] for row in rows) == {'case0', 'case1', 'case2'}
+        assert all(int(row[2]) >= 1 for row in rows)
+        assert set(int(row[10]) for row in rows) <= {0, 110}
+        assert set(int(row[11]) for row in rows) <= {200, 404, 500}
+
+    def test_text_chunks(self):
+        text = synthetic_phout(100, 2, 3)
+        chunks = text_chunks(text, 1000)
+        assert ''.join(chunks) == text
+        assert all(chunk.endswith('\n') for chunk in chunks)
+
+    def test_bench_pipeline(self):
+        text = synthetic_phout(200, 3, 5, latency='bimodal')
+        reports = bench_pipeline(text, 4096, AGGR_CONFIG)
+        assert [r["stage"] for r in reports] == [
+            "parse", "chopper", "aggregator"]
+        assert all(r["rows"] == 600 for r in reports)
+        assert reports[2]["seconds_aggregated"] >= 3
+
+    def test_bench_parsers(self):
+        text = synthetic_phout(200, 2, 3)
+        reports = bench_parsers(text, 4096)
+        assert [r["implementation"] for r in reports] == [
+            "string_to_df", "phout_to_df"]
+        assert all(r["rows"] == 400 for r in reports)
+        assert all(r["rows_per_sec"] > 0 for r in reports)
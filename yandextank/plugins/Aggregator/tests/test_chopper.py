@@ -1,9 +1,10 @@
 import pandas as pd
 import numpy as np
 
-from yandextank.plugins.Aggregator.chopper import TimeChopper
+from yandextank.plugins.Aggregator.benchmark import indexed_chunks
+from yandextank.plugins.Aggregator.chopper import Amendment, TimeChopper
 
-from conftest import MAX_TS, random_split
+from conftest import MAX_TS, ConcatTimeChopper, random_split
 
 
 class TestChopper(object):
@@ -33,3 +34,58 @@ class TestChopper(object):
         assert len(data) == len(concatinated), "We did not lose anything"
         assert np.allclose(concatinated.values,
                            data.values), "We did not corrupt the data"
+
+    def test_same_as_concat_chopper(self):
+        chunks = indexed_chunks(20000, 10, 100)
+        result = list(TimeChopper(chunks, 3))
+        expected = list(ConcatTimeChopper(chunks, 3))
+        assert [ts for ts, _ in result] == [ts for ts, _ in expected]
+        for (_, data), (_, expected_data) in zip(result, expected):
+            assert data.equals(expected_data)
+
+    def test_allowed_lateness(self):
+        chunks = [
+            pd.DataFrame({'v': range(4)}, index=[1, 1, 2, 5]),
+            pd.DataFrame({'v': range(3)}, index=[3, 6, 9]),
+        ]
+        chopper = TimeChopper(iter(chunks), allowed_lateness=2)
+        result = [(ts, len(data)) for ts, data in chopper]
+        assert result == [(1, 2), (2, 1), (3, 1), (5, 1), (6, 1), (9, 1)]
+        assert chopper.late_samples == 0
+
+    def test_late_samples_amend(self):
+        chunks = [
+            pd.DataFrame({'v': range(3)}, index=[1, 2, 5]),
+            pd.DataFrame({'v': range(3)}, index=[1, 1, 6]),
+        ]
+        chopper = TimeChopper(iter(chunks), allowed_lateness=2)
+        result = list(chopper)
+        assert [ts for ts, _ in result] == [1, 2, 1, 5, 6]
+        assert [type(item) for item in result].count(Amendment) == 1
+        amendment = result[2]
+        assert amendment.amendment
+        assert len(amendment[1]) == 2
+        assert chopper.late_samples == 2
+
+    def test_late_samples_drop(self):
+        chunks = [
+            pd.DataFrame({'v': range(3)}, index=[1, 2, 5]),
+            pd.DataFrame({'v': range(3)}, index=[1, 1, 6]),
+        ]
+        chopper = TimeChopper(iter(chunks), allowed_lateness=2, late='drop')
+        assert [ts for ts, _ in chopper] == [1, 2, 5, 6]
+        assert chopper.late_samples == 2
+
+    def test_growing_categories(self):
+        names = ['a', 'b', 'c']
+        chunks = [
+            pd.DataFrame({'tag': pd.Categorical.from_codes(
+                [0, -1], categories=names[:1])}, index=[1, 1]),
+            pd.DataFrame({'tag': pd.Categorical.from_codes(
+                [2, 1], categories=names)}, index=[1, 2]),
+        ]
+        result = list(TimeChopper(chunks, 5))
+        data = result[0][1]
+        assert data.tag.dtype.name == 'category'
+        assert list(data.tag.cat.categories) == names
+        assert list(data.tag.astype(object).fillna('-')) == ['a', '-', 'c']
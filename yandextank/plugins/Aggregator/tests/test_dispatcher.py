@@ -0,0 +1,82 @@
+import threading as th
+
+from yandextank.plugins.Aggregator.dispatcher import ListenerDispatcher
+
+
+class Listener(object):
+    def __init__(self, fail=False):
+        self.received = []
+        self.fail = fail
+
+    def on_aggregated_data(self, data, stats):
+        self.received.append(data['ts'])
+        if self.fail:
+            raise RuntimeError("listener failed")
+
+
+class FastListener(Listener):
+    aggregator_fast_path = True
+
+
+class BlockedListener(Listener):
+    def __init__(self):
+        super(BlockedListener, self).__init__()
+        self.unblocked = th.Event()
+
+    def on_aggregated_data(self, data, stats):
+        self.unblocked.wait()
+        super(BlockedListener, self).on_aggregated_data(data, stats)
+
+
+class TestDispatcher(object):
+    def test_slow_listener_does_not_block(self):
+        dispatcher = ListenerDispatcher(queue_size=2)
+        slow, fast = BlockedListener(), FastListener()
+        dispatcher.add(slow)
+        dispatcher.add(fast)
+        for ts in range(5):
+            dispatcher.notify({'ts': ts}, {})
+        assert fast.received == list(range(5))
+        metrics = dispatcher.metrics()
+        assert metrics['BlockedListener']['dropped'] > 0
+        assert metrics['FastListener']['delivered'] == 5
+        slow.unblocked.set()
+        dispatcher.close(5)
+        assert len(slow.received) + \
+            dispatcher.metrics()['BlockedListener']['dropped'] == 5
+
+    def test_close_flushes(self):
+        dispatcher = ListenerDispatcher()
+        listener, failing = Listener(), Listener(fail=True)
+        dispatcher.add(listener)
+        dispatcher.add(failing)
+        for ts in range(10):
+            dispatcher.notify({'ts': ts}, {})
+        dispatcher.close(5)
+        assert listener.received == list(range(10))
+        assert failing.received == list(range(10))
+        metrics = dispatcher.metrics()
+        assert set(metrics) == {'Listener', 'Listener_2'}
+        assert metrics['Listener_2']['delivered'] == 10
+        assert metrics['Listener']['queue'] == 0
+
+    def test_synchronous(self):
+        dispatcher = ListenerDispatcher(asynchronous=False)
+        listener = Listener()
+        dispatcher.add(listener)
+        dispatcher.notify({'ts': 1}, {})
+        assert listener.received == [1]
+        assert not dispatcher.workers
+
+    def test_delivered_ts(self):
+        dispatcher = ListenerDispatcher()
+        assert dispatcher.delivered_ts() is None
+        slow, fast = BlockedListener(), FastListener()
+        dispatcher.add(slow)
+        dispatcher.add(fast)
+        for ts in range(3):
+            dispatcher.notify({'ts': ts}, {})
+        assert dispatcher.delivered_ts() is None
+        slow.unblocked.set()
+        dispatcher.close(5)
+        assert dispatcher.delivered_ts() == 2
@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+
+from yandextank.plugins.Aggregator.histogram import BinLayout, Histogram, \
+    HistogramLayout
+
+
+@pytest.fixture
+def samples():
+    np.random.seed(42)
+    return np.random.lognormal(9, 1.5, 100000).astype(np.int64)
+
+
+class TestLayout(object):
+    @pytest.mark.parametrize("relative_error", [0.1, 0.01, 0.001])
+    def test_bounds(self, relative_error):
+        layout = HistogramLayout(relative_error)
+        values = np.concatenate([
+            np.arange(0, 5000), np.random.randint(0, 2**40, 10000),
+            [2**62, 2**63 - 1]
+        ]).astype(np.int64)
+        index = layout.index(values)
+        assert index.max() < layout.size
+        assert (layout.lowest(index) <= values).all()
+        assert (layout.highest(index) >= values).all()
+        width = layout.highest(index) - layout.lowest(index)
+        assert (width <= np.maximum(values * relative_error, 0)).all()
+
+    def test_small_values_are_exact(self):
+        layout = HistogramLayout(0.01)
+        values = np.arange(0, 2**layout.sub_bucket_bits)
+        assert (layout.lowest(layout.index(values)) == values).all()
+        assert (layout.highest(layout.index(values)) == values).all()
+
+    def test_invalid_error(self):
+        with pytest.raises(ValueError):
+            HistogramLayout(0)
+
+
+class TestHistogram(object):
+    percentiles = [50, 75, 80, 85, 90, 95, 98, 99, 100]
+
+    def test_quantiles(self, samples):
+        layout = HistogramLayout(0.01)
+        histogram = Histogram.from_values(layout, samples)
+        assert len(histogram) == len(samples)
+        expected = np.percentile(samples, self.percentiles)
+        actual = histogram.quantiles(self.percentiles)
+        assert np.allclose(actual, expected, rtol=0.011)
+        assert actual[-1] == samples.max()
+
+    def test_merge(self, samples):
+        layout = HistogramLayout(0.01)
+        parts = [
+            Histogram.from_values(layout, part)
+            for part in np.array_split(samples, 7)
+        ]
+        merged = Histogram.merged(layout, parts)
+        whole = Histogram.from_values(layout, samples)
+        assert (merged.index == whole.index).all()
+        assert (merged.count == whole.count).all()
+        assert (merged.min, merged.max) == (whole.min, whole.max)
+        assert len(parts[0] + parts[1]) == len(parts[0]) + len(parts[1])
+
+    def test_merge_different_layouts(self, samples):
+        with pytest.raises(ValueError):
+            Histogram.from_values(HistogramLayout(0.01), samples).merge(
+                Histogram.from_values(HistogramLayout(0.1), samples))
+
+    def test_to_bins(self):
+        layout = HistogramLayout(0.01)
+        bins = np.array([0, 10, 20, 50, 100, 200])
+        values = np.array([0, 1, 9, 10, 15, 49, 50, 100, 199, 200, 201, 500])
+        expected, _ = np.histogram(values, bins=bins)
+        actual = Histogram.from_values(layout, values).to_bins(bins)
+        assert (actual == expected).all()
+
+    def test_empty(self):
+        histogram = Histogram.from_values(HistogramLayout(), [])
+        assert len(histogram) == 0
+        assert (histogram.quantiles(self.percentiles) == 0).all()
+        assert (histogram.to_bins(np.array([0, 10])) == 0).all()
+
+    def test_dict_roundtrip(self, samples):
+        layout = HistogramLayout(0.01)
+        histogram = Histogram.from_values(layout, samples)
+        restored = Histogram.from_dict(layout, histogram.to_dict())
+        assert restored.to_dict() == histogram.to_dict()
+
+
+class TestBinLayout(object):
+    @pytest.mark.parametrize("relative_error", [0.01, 0.001])
+    def test_same_as_to_bins(self, samples, relative_error):
+        layout = HistogramLayout(relative_error)
+        edges = np.array([0, 1000, 5000, 8191, 8192, 20000, 100000, 1000000])
+        histogram = Histogram.from_values(layout, samples)
+        bins = BinLayout(edges, layout)
+        assert (bins.count(histogram) == histogram.to_bins(edges)).all()
+        assert (bins.count(Histogram(layout)) == 0).all()
+
+    def test_other_layout(self, samples):
+        bins = BinLayout([0, 10, 100], HistogramLayout(0.01))
+        with pytest.raises(ValueError):
+            bins.count(Histogram.from_values(HistogramLayout(0.1), samples))
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+from yandextank.plugins.Aggregator.aggregator import Aggregator
+from yandextank.plugins.Aggregator.limiter import OTHER, TagLimiter
+
+from test_aggregator import AGGR_CONFIG
+
+
+class TestTagLimiter(object):
+    def test_all_fit(self):
+        limiter = TagLimiter(3)
+        codes, tags = pd.factorize(pd.Series(['a', 'b', None, 'a']))
+        folded, folded_tags = limiter.fold(codes, tags)
+        assert list(folded) == list(codes)
+        assert list(folded_tags) == ['a', 'b']
+
+    def test_heavy_hitters_stay(self):
+        limiter = TagLimiter(2)
+        for second in range(10):
+            values = ['heavy'] * 50 + ['unique%s_%s' % (second, i)
+                                       for i in range(20)]
+            codes, tags = pd.factorize(pd.Series(values + [None]))
+            folded, folded_tags = limiter.fold(codes, tags)
+            assert 'heavy' in folded_tags
+            assert len(folded_tags) <= 3
+            assert folded[-1] == -1
+            named = dict(zip(*np.unique(
+                np.asarray(folded_tags, dtype=object)[folded[:-1]],
+                return_counts=True)))
+            assert named['heavy'] == 50
+            assert sum(named.values()) == 70
+        assert len(limiter.counts) <= 2
+
+    def test_ties(self):
+        limiter = TagLimiter(2)
+        values = ['heavy'] * 50 + ['tied%s' % i for i in range(5)] * 3
+        codes, tags = pd.factorize(pd.Series(values))
+        folded, folded_tags = limiter.fold(codes, tags)
+        assert folded_tags == ['heavy', 'tied0', OTHER]
+        assert list(limiter.counts) == [47, 0]
+        codes, tags = pd.factorize(pd.Series(['heavy', 'tied1']))
+        folded, folded_tags = limiter.fold(codes, tags)
+        assert folded_tags[0] == 'heavy'
+
+    def test_aggregator(self, data):
+        data['tag'] = ['tag%s' % i for i in range(len(data))]
+        data.loc[data.index < 500, 'tag'] = 'common'
+        seconds = [(ts, data.loc[[ts]]) for ts in sorted(set(data.index))]
+        results = list(Aggregator(seconds, AGGR_CONFIG, False, max_tags=10))
+        assert all(len(r["tagged"]) <= 11 for r in results)
+        cumulative = results[-1]["cumulative"]["tagged"]
+        assert cumulative["common"]["interval_real"]["len"] == \
+            (data.tag == 'common').sum()
+        assert OTHER in cumulative
@@ -0,0 +1,149 @@
+import time
+
+from yandextank.common.util import Drain
+from yandextank.plugins.Aggregator.plugin import Plugin
+
+
+class FakeCore(object):
+    def __init__(self, options):
+        self.options = options
+        self.status = {}
+
+    def get_option(self, section, option, default=None):
+        return self.options.get(option, default)
+
+    def publish(self, publisher, key, value):
+        self.status[key] = value
+
+
+class RecordingListener(object):
+    aggregator_fast_path = True
+
+    def __init__(self):
+        self.received = []
+
+    def on_aggregated_data(self, data, stats):
+        self.received.append((data, stats))
+
+
+class CheckpointingReader(object):
+    def __init__(self):
+        self.emitted_seconds = []
+
+    def emitted(self, second, force=False):
+        self.emitted_seconds.append((second, force))
+
+    def close(self):
+        pass
+
+
+class ImportingReader(object):
+    def aggregate(self, *args, **kwargs):
+        pass
+
+
+def make_plugin(**options):
+    plugin = Plugin(FakeCore(options))
+    plugin.configure()
+    listener = RecordingListener()
+    plugin.add_result_listener(listener)
+    return plugin, listener
+
+
+class TestPlugin(object):
+    def test_bounded_queues(self):
+        plugin, _ = make_plugin(queue_size='5')
+        assert plugin.results.maxsize == 5
+        assert plugin.stats.maxsize == 5
+
+    def test_match(self):
+        plugin, listener = make_plugin()
+        plugin.results.put({'ts': 1})
+        plugin.stats.put([{'ts': 1, 'metrics': {}}, {'ts': 2, 'metrics': {}}])
+        plugin.is_test_finished()
+        assert listener.received == [({'ts': 1}, {'ts': 1, 'metrics': {}})]
+        assert plugin.core.status['stat_cache'] == 1
+
+    def test_watermark(self):
+        plugin, listener = make_plugin(stats_timeout='1')
+        plugin.results.put({'ts': 1})
+        plugin.stats.put([{'ts': 2, 'metrics': {}}])
+        plugin.is_test_finished()
+        assert not listener.received
+        plugin.stats.put([{'ts': 3, 'metrics': {}}])
+        plugin.is_test_finished()
+        assert listener.received == [({'ts': 1}, Plugin.empty_stats(1))]
+        plugin.results.put({'ts': 5})
+        plugin.is_test_finished()
+        assert not plugin.stat_cache
+        assert plugin.core.status['flushed_data'] == 1
+        assert plugin.core.status['dropped_stats'] == 2
+
+    def test_lagging_data(self):
+        plugin, listener = make_plugin(stats_timeout='1')
+        plugin.stats.put([{'ts': 1, 'metrics': {}}])
+        plugin.is_test_finished()
+        for ts, (arrival, item) in plugin.stat_cache.items():
+            plugin.stat_cache[ts] = (arrival - 10, item)
+        plugin.is_test_finished()
+        assert plugin.stat_cache
+        plugin.results.put({'ts': 1})
+        plugin.is_test_finished()
+        assert listener.received == [({'ts': 1}, {'ts': 1, 'metrics': {}})]
+
+    def test_no_stats(self):
+        plugin, listener = make_plugin(stats_timeout='1')
+        plugin.results.put({'ts': 1})
+        plugin.is_test_finished()
+        assert not listener.received
+        for ts, (arrival, item) in plugin.data_cache.items():
+            plugin.data_cache[ts] = (arrival - 2, item)
+        plugin.is_test_finished()
+        assert listener.received == [({'ts': 1}, Plugin.empty_stats(1))]
+
+    def test_cache_size(self):
+        plugin, listener = make_plugin(cache_size='2')
+        for ts in range(5):
+            plugin.results.put({'ts': ts})
+        plugin.is_test_finished()
+        assert [data['ts'] for data, _ in listener.received] == [0, 1, 2]
+        assert sorted(plugin.data_cache) == [3, 4]
+
+    def test_end_test_flushes(self):
+        plugin, listener = make_plugin()
+        plugin.results.put({'ts': 1})
+        start = time.time()
+        plugin.end_test(0)
+        assert time.time() - start < 1
+        assert listener.received == [({'ts': 1}, Plugin.empty_stats(1))]
+
+    def test_amendments_are_not_matched(self):
+        plugin, listener = make_plugin()
+        plugin.results.put({'ts': 1})
+        plugin.results.put({'ts': 1, 'amendment': True})
+        plugin.stats.put([{'ts': 1, 'metrics': {}}])
+        plugin.is_test_finished()
+        assert listener.received == [({'ts': 1}, {'ts': 1, 'metrics': {}})]
+        assert not plugin.data_cache
+        assert plugin.core.status['amendments'] == 1
+
+    def test_emitted_seconds(self):
+        plugin, listener = make_plugin()
+        plugin.reader = CheckpointingReader()
+        plugin.results.put({'ts': 1})
+        plugin.is_test_finished()
+        plugin.stats.put([{'ts': 1, 'metrics': {}}])
+        plugin.is_test_finished()
+        assert plugin.reader.emitted_seconds == [(None, False), (1, False)]
+        plugin.end_test(0)
+        assert plugin.reader.emitted_seconds[-1] == (1, True)
+
+    def test_import_is_drained(self):
+        plugin, listener = make_plugin(queue_size='5')
+        plugin.reader = ImportingReader()
+        plugin.drain = Drain(({'ts': ts} for ts in range(100)), plugin.results)
+        plugin.drain.start()
+        plugin.is_test_finished()
+        assert plugin.drain.is_finished()
+        plugin.is_test_finished()
+        assert len(plugin.data_cache) == 100
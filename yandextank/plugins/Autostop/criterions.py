@@ -268,7 +268,6 @@ class SteadyCumulativeQuantilesCriterion(AbstractCriterion):
         return 'steady_cumulative'
 
     def __init__(self, autostop, param_str):
-        raise (NotImplementedError("Cumulative quantiles not implemented"))
         AbstractCriterion.__init__(self)
         self.seconds_count = 0
         self.quantile_hash = ""
@@ -277,9 +276,10 @@ class SteadyCumulativeQuantilesCriterion(AbstractCriterion):
         self.autostop = autostop
 
     def notify(self, data, stat):
-        quantiles = dict(zip(data["overall"]["q"]["q"], data["overall"]["q"][
-            "values"]))
-        quantile_hash = json.dumps(quantiles)
+        quantiles = data["cumulative"]["overall"]["interval_real"]["q"]
+        quantile_hash = json.dumps(
+            [[float(q), float(value)]
+             for q, value in zip(quantiles["q"], quantiles["value"])])
         logging.debug("Cumulative quantiles hash: %s", quantile_hash)
         if self.quantile_hash == quantile_hash:
             if not self.seconds_count:
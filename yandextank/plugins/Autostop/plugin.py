@@ -16,6 +16,8 @@ logger = logging.getLogger(__name__)
 class Plugin(AbstractPlugin, AggregateResultListener):
     """ Plugin that accepts criterion classes and triggers autostop """
     SECTION = 'autostop'
+    # criteria should see every second as soon as it is aggregated
+    aggregator_fast_path = True
 
     def __init__(self, core):
         AbstractPlugin.__init__(self, core)
@@ -40,10 +40,15 @@ Gun: {gun.__class__.__name__}
         self.feeder.daemon = True
         self.workers_finished = False
         self.start_time = None
+        self.reader = None
+        self.stpd = None
         self.plan = None
 
     def start(self):
         self.start_time = time.time()
+        # workers share this map, tasks only point into it
+        self.reader = StpdReader(self.stpd_filename)
+        self.stpd = self.reader.mmap()
         for process in self.pool:
             process.daemon = True
             process.start()
@@ -66,9 +71,12 @@ Gun: {gun.__class__.__name__}
         """
         A feeder that runs in distinct thread in main process.
         """
-        self.plan = StpdReader(self.stpd_filename)
+        # tasks are (timestamp, offset, size, marker), so missiles are
+        # never pickled
         if self.cached_stpd:
-            self.plan = list(self.plan)
+            self.plan = self.reader.index()
+        else:
+            self.plan = self.reader.records()
         for task in self.plan:
             if self.quit.is_set():
                 logger.info("Stop feeding: gonna quit")
@@ -130,7 +138,8 @@ Gun: {gun.__class__.__name__}
                 if not task:
                     logger.debug("Got killer task.")
                     break
-                timestamp, missile, marker = task
+                timestamp, offset, size, marker = task
+                missile = self.stpd[offset:offset + size]
                 planned_time = self.start_time + (timestamp / 1000.0)
                 delay = planned_time - time.time()
                 if delay > 0:
@@ -15,6 +15,7 @@ LOG = logging.getLogger(__name__)
 class Plugin(AbstractPlugin, AggregateResultListener):
     ''' Console plugin '''
     SECTION = 'console'
+    aggregator_fast_path = True
 
     def __init__(self, core):
         AbstractPlugin.__init__(self, core)
@@ -307,12 +307,9 @@ class CurrentHTTPBlock(AbstractBlock):
         codes_dist = data["overall"]["proto_code"]["count"]
 
         self.log.debug("Arrived codes data: %s", codes_dist)
-        self.highlight_codes = []
-
-        for code, count in codes_dist.iteritems():
-            self.total_count += count
-            self.highlight_codes.append(code)
-            self.times_dist[code] += count
+        self.highlight_codes = list(codes_dist.keys())
+        self.times_dist = data["cumulative"]["overall"]["proto_code"]["count"]
+        self.total_count = sum(self.times_dist.values())
 
         self.log.debug("Current codes dist: %s", self.times_dist)
 
@@ -373,12 +370,9 @@ class CurrentNetBlock(AbstractBlock):
         net_dist = data["overall"]["net_code"]["count"]
 
         self.log.debug("Arrived net codes data: %s", net_dist)
-        self.highlight_codes = []
-
-        for code, count in net_dist.iteritems():
-            self.total_count += count
-            self.highlight_codes.append(code)
-            self.times_dist[code] += count
+        self.highlight_codes = list(net_dist.keys())
+        self.times_dist = data["cumulative"]["overall"]["net_code"]["count"]
+        self.total_count = sum(self.times_dist.values())
 
         self.log.debug("Current net codes dist: %s", self.times_dist)
 
@@ -492,13 +486,14 @@ class AnswSizesBlock(AbstractBlock):
 
     def add_second(self, data):
 
-        self.cur_in = data["overall"]["size_out"]["total"]
+        self.cur_in = data["overall"]["size_in"]["total"]
         self.cur_out = data["overall"]["size_out"]["total"]
         self.cur_count = data["overall"]["interval_real"]["len"]
 
-        self.count += self.cur_count
-        self.sum_in += self.cur_in
-        self.sum_out += self.cur_out
+        cumulative = data["cumulative"]["overall"]
+        self.count = cumulative["interval_real"]["len"]
+        self.sum_in = cumulative["size_in"]["total"]
+        self.sum_out = cumulative["size_out"]["total"]
 
 # ======================================================
 
@@ -534,12 +529,13 @@ class AvgTimesBlock(AbstractBlock):
         self.last_overall = data["overall"]["interval_real"]["total"]
         self.last_count = count
 
-        self.all_connect += self.last_connect
-        self.all_send += self.last_send
-        self.all_latency += self.last_latency
-        self.all_receive += self.last_receive
-        self.all_overall += self.last_overall
-        self.all_count += count
+        cumulative = data["cumulative"]["overall"]
+        self.all_connect = cumulative["connect_time"]["total"]
+        self.all_send = cumulative["send_time"]["total"]
+        self.all_latency = cumulative["latency"]["total"]
+        self.all_receive = cumulative["receive_time"]["total"]
+        self.all_overall = cumulative["interval_real"]["total"]
+        self.all_count = cumulative["interval_real"]["len"]
 
     def render(self):
         self.lines = [
@@ -592,16 +588,15 @@ class CasesBlock(AbstractBlock):
         self.max_case_len = 0
 
     def add_second(self, data):
-        tagged = data["tagged"]
-        for tag_name, tag_data in tagged.iteritems():
+        tagged = data["cumulative"]["tagged"]
+        for tag_name in data["tagged"]:
+            tag_data = tagged[tag_name]
             #decode symbols to utf-8 in order to support cyrillic symbols in cases
             name = tag_name.decode('utf-8')
             if not name in self.cases.keys():
-                self.cases[name] = [0, 0]
                 self.max_case_len = max(self.max_case_len, len(name))
-            rps = tag_data["interval_real"]["len"]
-            self.cases[name][0] += rps
-            self.cases[name][1] += tag_data["interval_real"]["total"] / 1000
+            self.cases[name] = [tag_data["interval_real"]["len"],
+                                tag_data["interval_real"]["total"] / 1000]
 
     def render(self):
         self.lines = [
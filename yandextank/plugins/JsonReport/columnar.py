@@ -0,0 +1,210 @@
+"""
+Columnar binary storage for aggregated seconds.
+
+A store is a directory. seconds.bin holds one fixed-width record per
+second for overall (tag -1) and for every tag, with a field per scalar
+aggregate, e.g. 'interval_real.max' or 'interval_real.q.99'. Aggregates of
+variable size (times distribution, code counts, histogram buckets) are
+kept in sparse files '<column>.<aggregate>.bin' of (key, count) records,
+each seconds record points to its slice with '<column>.<aggregate>.offset'
+and '<column>.<aggregate>.size' fields. meta.json describes record layout
+and holds tag names. Files are only appended to while a test runs and are
+read back with numpy.memmap without parsing.
+"""
+import json
+import os
+
+import numpy as np
+
+META = 'meta.json'
+SECONDS = 'seconds.bin'
+OVERALL = -1
+VERSION = 1
+
+SPARSE_DTYPE = np.dtype([('key', np.int64), ('count', np.int64)])
+
+
+def _sparse(aggregate, value):
+    """
+    (keys, counts) of aggregates of variable size, None for others
+    """
+    if aggregate == 'hist':
+        return value['bins'], value['data']
+    if aggregate == 'hdr':
+        return value['index'], value['count']
+    if aggregate == 'count':
+        return [int(k) for k in value], list(value.values())
+    return None
+
+
+def _scalars(column, aggregate, value):
+    """
+    (field name, dtype, value) of every fixed-width field of an aggregate
+    """
+    if aggregate == 'q':
+        return [('%s.q.%s' % (column, q), 'f8', v)
+                for q, v in zip(value['q'], value['value'])]
+    if aggregate == 'hdr':
+        return [('%s.hdr.min' % column, 'i8', value['min']),
+                ('%s.hdr.max' % column, 'i8', value['max'])]
+    if _sparse(aggregate, value) is not None:
+        return []
+    dtype = 'f8' if isinstance(value, float) else 'i8'
+    return [('%s.%s' % (column, aggregate), dtype, value)]
+
+
+class ColumnarWriter(object):
+    """
+    Append aggregated seconds to a columnar store. Record layout is taken
+    from the first second written.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.dtype = None
+        self.sparse = []
+        self.sparse_files = {}
+        self.offsets = {}
+        self.tags = []
+        self.tag_ids = {}
+        self.seconds = None
+        self.meta_dirty = False
+
+    def _layout(self, aggregates):
+        fields = [('ts', 'i8'), ('tag', 'i4')]
+        for column in sorted(aggregates):
+            for aggregate in sorted(aggregates[column]):
+                value = aggregates[column][aggregate]
+                fields += [(name, dtype) for name, dtype, _ in _scalars(
+                    column, aggregate, value)]
+                if _sparse(aggregate, value) is not None:
+                    name = '%s.%s' % (column, aggregate)
+                    self.sparse.append((column, aggregate))
+                    fields += [(name + '.offset', 'i8'),
+                               (name + '.size', 'i4')]
+                    self.sparse_files[name] = open(
+                        os.path.join(self.path, name + '.bin'), 'wb')
+                    self.offsets[name] = 0
+        self.dtype = np.dtype(fields)
+        self.seconds = open(os.path.join(self.path, SECONDS), 'wb')
+        self.meta_dirty = True
+
+    def _tag_id(self, tag):
+        if tag not in self.tag_ids:
+            self.tag_ids[tag] = len(self.tags)
+            self.tags.append(tag)
+            self.meta_dirty = True
+        return self.tag_ids[tag]
+
+    def _fill(self, record, aggregates):
+        for column, column_aggregates in aggregates.items():
+            for aggregate, value in column_aggregates.items():
+                for name, _, scalar in _scalars(column, aggregate, value):
+                    if name in self.dtype.names:
+                        record[name] = scalar
+        for column, aggregate in self.sparse:
+            name = '%s.%s' % (column, aggregate)
+            value = aggregates.get(column, {}).get(aggregate)
+            pairs = np.zeros(0, dtype=SPARSE_DTYPE)
+            if value is not None:
+                keys, counts = _sparse(aggregate, value)
+                pairs = np.zeros(len(keys), dtype=SPARSE_DTYPE)
+                pairs['key'] = keys
+                pairs['count'] = counts
+            pairs.tofile(self.sparse_files[name])
+            record[name + '.offset'] = self.offsets[name]
+            record[name + '.size'] = len(pairs)
+            self.offsets[name] += len(pairs)
+
+    def write(self, data):
+        """
+        Append a second as published by the aggregator
+        """
+        if self.dtype is None:
+            self._layout(data['overall'])
+        scopes = [(OVERALL, data['overall'])] + [
+            (self._tag_id(tag), aggregates)
+            for tag, aggregates in sorted(data['tagged'].items())
+        ]
+        records = np.zeros(len(scopes), dtype=self.dtype)
+        records['ts'] = data['ts']
+        for record, (tag, aggregates) in zip(records, scopes):
+            record['tag'] = tag
+            self._fill(record, aggregates)
+        records.tofile(self.seconds)
+        if self.meta_dirty:
+            self.write_meta()
+        self.flush()
+
+    def write_meta(self):
+        meta = {
+            'version': VERSION,
+            'fields': [[name, self.dtype[name].str]
+                       for name in self.dtype.names],
+            'sparse': ['%s.%s' % pair for pair in self.sparse],
+            'tags': self.tags,
+        }
+        tmp = os.path.join(self.path, META + '.tmp')
+        with open(tmp, 'w') as meta_file:
+            json.dump(meta, meta_file)
+        os.rename(tmp, os.path.join(self.path, META))
+        self.meta_dirty = False
+
+    def flush(self):
+        for f in self.sparse_files.values():
+            f.flush()
+        if self.seconds:
+            self.seconds.flush()
+
+    def close(self):
+        for f in self.sparse_files.values():
+            f.close()
+        if self.seconds:
+            self.seconds.close()
+
+
+class ColumnarReader(object):
+    """
+    Memory-mapped view of a columnar store. seconds is a numpy record
+    array, columns are read with seconds['interval_real.max'] and friends.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META)) as meta_file:
+            meta = json.load(meta_file)
+        if meta['version'] != VERSION:
+            raise ValueError(
+                "Unsupported columnar store version: %s" % meta['version'])
+        self.dtype = np.dtype([(str(name), str(dtype))
+                               for name, dtype in meta['fields']])
+        self.tags = meta['tags']
+        self.seconds = self._map(SECONDS, self.dtype)
+        self.sparse = {
+            name: self._map(name + '.bin', SPARSE_DTYPE)
+            for name in meta['sparse']
+        }
+
+    def _map(self, filename, dtype):
+        filename = os.path.join(self.path, filename)
+        # a test may still be running, ignore a partially written record
+        records = os.path.getsize(filename) // dtype.itemsize
+        if not records:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(filename, dtype=dtype, mode='r', shape=(records, ))
+
+    def overall(self):
+        return self.seconds[self.seconds['tag'] == OVERALL]
+
+    def tagged(self, tag):
+        return self.seconds[self.seconds['tag'] == self.tags.index(tag)]
+
+    def pairs(self, record, name):
+        """
+        (key, count) records of sparse aggregate name, e.g.
+        'interval_real.hist' or 'net_code.count', for a seconds record
+        """
+        offset = record[name + '.offset']
+        return self.sparse[name][offset:offset + record[name + '.size']]
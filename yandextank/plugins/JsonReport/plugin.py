@@ -4,10 +4,12 @@
 
 import logging
 import os
+import threading as th
 
 from ..Aggregator import Plugin as AggregatorPlugin
 from ..Monitoring import Plugin as MonitoringPlugin
 from ..Telegraf import Plugin as TelegrafPlugin
+from .columnar import ColumnarWriter
 from ...common.interfaces import AbstractPlugin, MonitoringDataListener, AggregateResultListener
 
 logger = logging.getLogger(__name__)  # pylint: disable=C0103
@@ -18,7 +20,7 @@ class Plugin(AbstractPlugin, AggregateResultListener, MonitoringDataListener):
     SECTION = 'json_report'
 
     def get_available_options(self):
-        return ['monitoring_log', 'test_data_log', 'test_stats_log']
+        return ['monitoring_log', 'test_data_log', 'test_stats_log', 'test_data_columns']
 
     def configure(self):
         self.monitoring_logger = self.create_file_logger('monitoring',
@@ -30,6 +32,14 @@ class Plugin(AbstractPlugin, AggregateResultListener, MonitoringDataListener):
         self.stats_logger = self.create_file_logger('stats',
                                                     self.get_option('test_stats_log',
                                                                     'test_stats.log'))
+        columns_dir = self.get_option('test_data_columns', 'test_data.columns')
+        self.columnar_writer = ColumnarWriter(
+            os.path.join(self.core.artifacts_dir, columns_dir)) if columns_dir else None
+        self.cumulative = None
+        # with async listeners seconds come from a dispatcher thread,
+        # which may still be writing when post_process closes the report
+        self.lock = th.Lock()
+        self.closed = False
         self.core.job.subscribe_plugin(self)
 
     def create_file_logger(self, logger_name, file_name, formatter=None):
@@ -47,9 +57,30 @@ class Plugin(AbstractPlugin, AggregateResultListener, MonitoringDataListener):
         """
         @data: aggregated data
         @stats: stats about gun
+
+        Whole-test aggregates come with every second, they are logged once
+        in post_process, so that the log doesn't grow with seconds x cases
         """
-        self.aggregator_data_logger.info(data)
-        self.stats_logger.info(stats)
+        with self.lock:
+            if self.closed:
+                logger.warning("Second %s came after the report was closed, "
+                               "not writing it", data.get('ts'))
+                return
+            self.cumulative = data.get('cumulative', self.cumulative)
+            self.aggregator_data_logger.info(
+                {key: value for key, value in data.items() if key != 'cumulative'})
+            self.stats_logger.info(stats)
+            if self.columnar_writer:
+                self.columnar_writer.write(data)
+
+    def post_process(self, retcode):
+        with self.lock:
+            self.closed = True
+            if self.cumulative is not None:
+                self.aggregator_data_logger.info({'cumulative': self.cumulative})
+            if self.columnar_writer:
+                self.columnar_writer.close()
+        return retcode
 
     def monitoring_data(self, data_list):
         self.monitoring_logger.info(data_list)
\ No newline at end of file
@@ -0,0 +1,57 @@
+import json
+
+import numpy as np
+import pandas as pd
+from pkg_resources import resource_string
+from yandextank.plugins.Aggregator.aggregator import Aggregator
+from yandextank.plugins.JsonReport.columnar import ColumnarReader, ColumnarWriter
+
+AGGR_CONFIG = json.loads(resource_string("yandextank.plugins.Aggregator",
+                                         'config/phout.json').decode('utf-8'))
+
+
+def seconds(count):
+    rng = np.random.RandomState(1)
+    for ts in range(count):
+        df = pd.DataFrame(
+            rng.randint(0, 10000, (100, len(AGGR_CONFIG))),
+            columns=list(AGGR_CONFIG))
+        df['net_code'] %= 3
+        df['proto_code'] = rng.choice([200, 404, 500], len(df))
+        df['tag'] = rng.choice(['a', 'b', 'c%s' % ts], len(df))
+        yield ts, df
+
+
+class TestColumnar(object):
+    def test_write_read(self, tmpdir):
+        path = str(tmpdir.join('test_data.columns'))
+        results = list(Aggregator(seconds(5), AGGR_CONFIG, False))
+        writer = ColumnarWriter(path)
+        for data in results:
+            writer.write(data)
+        writer.close()
+
+        reader = ColumnarReader(path)
+        overall = reader.overall()
+        assert list(overall['ts']) == list(range(5))
+        for record, data in zip(overall, results):
+            expected = data['overall']
+            assert record['interval_real.max'] == \
+                expected['interval_real']['max']
+            assert record['size_in.total'] == expected['size_in']['total']
+            assert [record['interval_real.q.%s' % q]
+                    for q in expected['interval_real']['q']['q']] == \
+                expected['interval_real']['q']['value']
+            hist = reader.pairs(record, 'interval_real.hist')
+            assert list(hist['key']) == expected['interval_real']['hist'][
+                'bins']
+            assert list(hist['count']) == expected['interval_real']['hist'][
+                'data']
+            codes = reader.pairs(record, 'proto_code.count')
+            assert {str(k): v for k, v in codes} == \
+                expected['proto_code']['count']
+        c3 = reader.tagged('c3')
+        assert len(c3) == 1
+        assert c3[0]['interval_real.len'] == \
+            results[3]['tagged']['c3']['interval_real']['len']
+        assert len(reader.tagged('a')) == 5
@@ -0,0 +1,37 @@
+import ast
+
+from yandextank.plugins.JsonReport.plugin import Plugin
+
+
+class FakeJob(object):
+    def subscribe_plugin(self, plugin):
+        pass
+
+
+class FakeCore(object):
+    def __init__(self, artifacts_dir):
+        self.artifacts_dir = artifacts_dir
+        self.job = FakeJob()
+
+    def get_option(self, section, option, default=None):
+        return '' if option == 'test_data_columns' else default
+
+
+class TestPlugin(object):
+    def test_cumulative_logged_once(self, tmpdir):
+        plugin = Plugin(FakeCore(str(tmpdir)))
+        plugin.configure()
+        for ts in range(3):
+            plugin.on_aggregated_data(
+                {'ts': ts, 'overall': {}, 'cumulative': {'len': ts}}, {})
+        plugin.post_process(0)
+        # a late second from a listener thread is not written after close
+        plugin.on_aggregated_data({'ts': 3, 'cumulative': {'len': 3}}, {})
+        for handler in plugin.aggregator_data_logger.handlers:
+            handler.close()
+        plugin.aggregator_data_logger.handlers = []
+
+        lines = [ast.literal_eval(line)
+                 for line in tmpdir.join('test_data.log').readlines()]
+        assert lines == [{'ts': 0, 'overall': {}}, {'ts': 1, 'overall': {}},
+                         {'ts': 2, 'overall': {}}, {'cumulative': {'len': 2}}]
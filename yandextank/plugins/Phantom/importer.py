@@ -0,0 +1,285 @@
+"""
+Offline phout import. The file is split into newline-aligned byte ranges
+that are parsed and aggregated in a process pool. Per-second states of
+the ranges are merged in the parent and published in timestamp order, as
+fast as the pool produces them.
+"""
+import logging
+import multiprocessing as mp
+import os
+import time
+from collections import deque
+
+import numpy as np
+
+from ..Aggregator.aggregator import Aggregator, Worker, factorize
+from ..Aggregator.limiter import OTHER
+from ..Aggregator.plugin import Plugin as AggregatorPlugin
+from .reader import LineReader, TagDictionary, phout_to_df
+
+logger = logging.getLogger(__name__)
+
+RANGE_BYTES = 64 * 1024 * 1024
+CHUNK_BYTES = 8 * 1024 * 1024
+
+# Worker of a pool process, created once by _init_process
+_worker = None
+
+
+def byte_ranges(filename, range_bytes=RANGE_BYTES):
+    """
+    [start, end) ranges of about range_bytes, every range ends at a line end
+    """
+    size = os.path.getsize(filename)
+    ranges = []
+    start = 0
+    with open(filename, 'rb') as phout:
+        while start < size:
+            end = min(start + range_bytes, size)
+            if end < size:
+                phout.seek(end - 1)
+                end += len(phout.readline()) - 1
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+class _Range(object):
+    """
+    File-like view of a byte range for LineReader
+    """
+
+    def __init__(self, phout, start, end):
+        self.phout = phout
+        self.phout.seek(start)
+        self.remaining = end - start
+
+    def readinto(self, buf):
+        buf = buf[:self.remaining]
+        read = self.phout.readinto(buf)
+        self.remaining -= read
+        return read
+
+
+def _init_process(config, verbose_histogram, relative_error):
+    global _worker
+    _worker = Worker(config, verbose_histogram, relative_error)
+
+
+def aggregate_range(filename, start, end, worker=None,
+                    chunk_bytes=CHUNK_BYTES):
+    """
+    {second: {tag: (state, samples)}} for phout lines within [start, end),
+    untagged samples have None for a tag
+    """
+    worker = worker or _worker
+    tags = TagDictionary()
+    states = {}
+    with open(filename, 'rb') as phout:
+        lines = LineReader(_Range(phout, start, end), chunk_bytes)
+        while True:
+            view = lines.read()
+            if view is None:
+                break
+            chunk = phout_to_df(view, tags)
+            del view
+            tag_codes, names = factorize(chunk.tag)
+            tag_codes[tag_codes < 0] = len(names)
+            names = list(names) + [None]
+            codes, pairs = factorize(
+                np.asarray(chunk.index, dtype=np.int64) *
+                len(names) + tag_codes)
+            sizes = np.bincount(codes, minlength=len(pairs))
+            for pair, state, size in zip(
+                    pairs, worker.partials(chunk, codes, len(pairs)),
+                    sizes):
+                second, tag = divmod(int(pair), len(names))
+                states.setdefault(second, {}).setdefault(
+                    names[tag], []).append((state, int(size)))
+    return {
+        second: {
+            tag: (worker.merge([state for state, _ in parts]),
+                  sum(size for _, size in parts))
+            for tag, parts in tagged.items()
+        }
+        for second, tagged in states.items()
+    }
+
+
+def _aggregate_range(args):
+    return aggregate_range(*args)
+
+
+class PhoutImportAggregator(Aggregator):
+    """
+    Aggregate a whole phout file with a pool of processes, results are the
+    same as Aggregator's for the file read in one piece.
+
+    Ranges are handed out in file order and their results are taken in
+    the same order. A second is published once a range whose seconds all
+    come after it has been merged; samples of a published second found
+    later are published as an amendment, as live aggregation does with
+    late samples.
+    """
+
+    def __init__(self, filename, config, verbose_histogram,
+                 relative_error=None, max_tags=None, processes=None,
+                 range_bytes=RANGE_BYTES):
+        super(PhoutImportAggregator, self).__init__(
+            None, config, verbose_histogram, relative_error, max_tags)
+        self.filename = filename
+        self.config = config
+        self.verbose_histogram = verbose_histogram
+        self.relative_error = relative_error
+        self.processes = processes or mp.cpu_count()
+        self.range_bytes = range_bytes
+        self.emitted = None
+        self.published = deque()
+        self.closed = False
+        self.finished = False
+
+    def _merged_states(self, tagged):
+        """
+        Per-tag states and overall state of a second merged from ranges
+        """
+        overall = self.worker.merge([state for state, _ in tagged.values()])
+        tagged = dict(
+            (tag, value) for tag, value in tagged.items() if tag is not None)
+        if self.limiter and tagged:
+            names = np.array(list(tagged), dtype=object)
+            kept = self.limiter.update(
+                names, [tagged[tag][1] for tag in names])
+            if not kept.all():
+                other = self.worker.merge(
+                    [tagged[tag][0] for tag in names[~kept]])
+                tagged = dict((tag, tagged[tag]) for tag in names[kept])
+                tagged[OTHER] = (other, 0)
+        return dict((tag, state) for tag, (state, _) in tagged.items()), \
+            overall
+
+    def _publish(self, second, tagged):
+        start_time = time.time()
+        amendment = self.emitted is not None and second <= self.emitted
+        tagged, overall = self._merged_states(tagged)
+        result = self._result(second, tagged, overall, amendment)
+        if not amendment:
+            self.emitted = second
+            self.published.append(second)
+        logger.debug("Merge time: %.2fms", (time.time() - start_time) * 1000)
+        return result
+
+    @staticmethod
+    def _merge_into(pending, second, tagged, worker):
+        current = pending.setdefault(second, {})
+        for tag, (state, size) in tagged.items():
+            if tag in current:
+                previous, previous_size = current[tag]
+                state = worker.merge([previous, state])
+                size += previous_size
+            current[tag] = (state, size)
+
+    def __iter__(self):
+        ranges = byte_ranges(self.filename, self.range_bytes)
+        logger.info("Importing %s in %s ranges with %s processes",
+                    self.filename, len(ranges), self.processes)
+        pool = mp.Pool(self.processes, _init_process,
+                       (self.config, self.verbose_histogram,
+                        self.relative_error))
+        try:
+            pending = {}
+            results = pool.imap(
+                _aggregate_range,
+                [(self.filename, start, end) for start, end in ranges])
+            for seconds in results:
+                if self.closed:
+                    logger.warning("Phout import interrupted")
+                    return
+                for second, tagged in seconds.items():
+                    if self.emitted is not None and second <= self.emitted:
+                        yield self._publish(second, tagged)
+                    else:
+                        self._merge_into(pending, second, tagged,
+                                         self.worker)
+                # seconds before the first one of this range are
+                # complete unless phout is out of order
+                watermark = min(seconds) if seconds else None
+                for second in sorted(pending):
+                    if watermark is None or second >= watermark:
+                        break
+                    yield self._publish(second, pending.pop(second))
+            for second in sorted(pending):
+                yield self._publish(second, pending.pop(second))
+        finally:
+            pool.terminate()
+            pool.join()
+            self.finished = True
+
+    def close(self):
+        self.closed = True
+
+
+class ImportStatsReader(object):
+    """
+    Phantom stats don't exist for an imported phout, make up empty stats
+    for every second the import has published
+    """
+    poll_period = 0.1
+
+    def __init__(self, importer):
+        self.importer = importer
+        self.closed = False
+
+    def __iter__(self):
+        while True:
+            closed = self.closed
+            published = self.importer.published
+            stats = [AggregatorPlugin.empty_stats(published.popleft())
+                     for _ in range(len(published))]
+            if stats:
+                yield stats
+            elif closed:
+                return
+            else:
+                yield None
+
+    def close(self):
+        self.closed = True
+
+
+class PhoutImport(object):
+    """
+    Reader for the Aggregator plugin that aggregates phout on its own with
+    PhoutImportAggregator instead of feeding the live pipeline
+    """
+
+    def __init__(self, filename, processes=None, range_bytes=RANGE_BYTES):
+        self.filename = filename
+        self.processes = processes
+        self.range_bytes = range_bytes
+        self.aggregator = None
+        self.stats = None
+
+    def aggregate(self, config, verbose_histogram, relative_error=None,
+                  max_tags=None):
+        self.aggregator = PhoutImportAggregator(
+            self.filename, config, verbose_histogram, relative_error,
+            max_tags, self.processes, self.range_bytes)
+        return self.aggregator
+
+    def stats_reader(self):
+        self.stats = ImportStatsReader(self)
+        return self.stats
+
+    @property
+    def published(self):
+        if self.aggregator is None:
+            return deque()
+        return self.aggregator.published
+
+    @property
+    def finished(self):
+        return self.aggregator is not None and self.aggregator.finished
+
+    def close(self):
+        if self.aggregator is not None:
+            self.aggregator.close()
@@ -10,6 +10,7 @@ import time
 from ...common.util import execute, expand_to_seconds
 from ...common.interfaces import AbstractPlugin, AbstractCriterion, GeneratorPlugin
 
+from .importer import PhoutImport
 from .reader import PhantomReader, PhantomStatsReader
 from .utils import PhantomConfig
 from .widget import PhantomInfoWidget, PhantomProgressBarWidget
@@ -34,6 +35,9 @@ class Plugin(AbstractPlugin, GeneratorPlugin):
         self.predefined_phout = None
         self.phout_import_mode = False
         self.did_phout_import_try = False
+        self.phout_state_file = None
+        self.phout_import_processes = 0
+        self.importer = None
 
         self.phantom_path = None
         self.eta_file = None
@@ -58,7 +62,8 @@ class Plugin(AbstractPlugin, GeneratorPlugin):
 
     def get_available_options(self):
         opts = ["phantom_path", "buffered_seconds", "exclude_markers",
-                "affinity"]
+                "affinity", "phout_state_file",
+                "phout_import_processes"]
         opts += [PhantomConfig.OPTION_PHOUT, self.OPTION_CONFIG]
         opts += PhantomConfig.get_available_options()
         return opts
@@ -74,6 +79,9 @@ class Plugin(AbstractPlugin, GeneratorPlugin):
             (lambda marker: marker != ''), self.get_option('exclude_markers',
                                                            []).split(' ')))
         self.taskset_affinity = self.get_option('affinity', '')
+        self.phout_state_file = self.get_option('phout_state_file', '')
+        self.phout_import_processes = int(self.get_option(
+            'phout_import_processes', self.phout_import_processes))
 
         try:
             autostop = self.core.get_plugin_of_type(AutostopPlugin)
@@ -93,6 +101,11 @@ class Plugin(AbstractPlugin, GeneratorPlugin):
 
     def prepare_test(self):
         aggregator = self.core.job.aggregator_plugin
+        state_file = None
+        if self.phout_state_file:
+            # relative to artifacts dir, absolute paths are kept as is
+            state_file = os.path.join(self.core.artifacts_dir,
+                                      self.phout_state_file)
 
         if not self.config and not self.phout_import_mode:
 
@@ -113,21 +126,33 @@ class Plugin(AbstractPlugin, GeneratorPlugin):
             if result[2]:
                 raise RuntimeError("Subprocess returned message: %s" %
                                    result[2])
-            reader = PhantomReader(self.phantom.phout_file)
+            reader = PhantomReader(self.phantom.phout_file,
+                                   state_file=state_file)
             logger.debug("Linking sample reader to aggregator."
                          " Reading samples from %s", self.phantom.phout_file)
 
             logger.debug("Linking stats reader to aggregator."
                          " Reading stats from %s", self.phantom.stat_log)
+            stats_reader = None
+        elif self.phout_import_processes > 0:
+            self.importer = PhoutImport(self.predefined_phout,
+                                        self.phout_import_processes)
+            reader = self.importer
+            stats_reader = self.importer.stats_reader()
+            logger.debug("Importing samples from %s with %s processes",
+                         self.predefined_phout, self.phout_import_processes)
         else:
-            reader = PhantomReader(self.predefined_phout)
+            reader = PhantomReader(self.predefined_phout,
+                                   state_file=state_file)
+            stats_reader = None
             logger.debug("Linking sample reader to aggregator."
                          " Reading samples from %s", self.predefined_phout)
         if aggregator:
             aggregator.reader = reader
-            info = self.phantom.get_info()
-            aggregator.stats_reader = PhantomStatsReader(self.phantom.stat_log,
-                                                         info)
+            if stats_reader is None:
+                stats_reader = PhantomStatsReader(self.phantom.stat_log,
+                                                  self.phantom.get_info())
+            aggregator.stats_reader = stats_reader
 
             aggregator.add_result_listener(self)
         try:
@@ -136,7 +161,7 @@ class Plugin(AbstractPlugin, GeneratorPlugin):
             logger.debug("Console not found: %s", ex)
             console = None
 
-        self.core.job.phantom_info = self.phantom.get_info()
+        self.core.job.phantom_info = self.get_info()
 
         if console and aggregator:
             widget = PhantomProgressBarWidget(self)
@@ -190,6 +215,8 @@ class Plugin(AbstractPlugin, GeneratorPlugin):
                                                 int(self.phantom_start_time))
                     self.publish('eta', eta)
                 return -1
+        elif self.importer:
+            return 0 if self.importer.finished else -1
         else:
             if not self.processed_ammo_count or self.did_phout_import_try != self.processed_ammo_count:
                 self.did_phout_import_try = self.processed_ammo_count
@@ -5,11 +5,17 @@ import pandas as pd
 import numpy as np
 import logging
 import json
+import os
+import re
+import sys
 import time
 import datetime
 import itertools as itt
+from collections import deque
 from StringIO import StringIO
+from numpy.lib.stride_tricks import as_strided
 
+from ...common.follow import FileFollower
 
 logger = logging.getLogger(__name__)
 
@@ -34,6 +40,16 @@ dtypes = {
     'proto_code': np.int64,
 }
 
+TAB, NEWLINE, QUOTE, HASH, MINUS, DOT = (ord(c) for c in '\t\n"#-.')
+# wider numbers don't fit int64, wider tags are parsed with read_csv
+MAX_DIGITS = 18
+MAX_TAG_BYTES = 128
+MAX_CACHED_TAGS = 100000
+POWERS = 10 ** np.arange(MAX_DIGITS + 1, dtype=np.int64)
+STAT_READ_BYTES = 1024 * 1024 * 50
+# stat records longer than this are skipped instead of buffered
+MAX_STAT_RECORD = 1024 * 1024 * 16
+
 
 def string_to_df(data):
     start_time = time.time()
@@ -54,29 +70,352 @@ def string_to_df(data):
     return chunk
 
 
+def _windows(data, offsets, width):
+    """
+    Matrix of width bytes from every offset, taken from a strided view of
+    data, so only the matrix itself is allocated. Bytes out of data are 0.
+    """
+    last = len(data) - width
+    windows = as_strided(data, shape=(last + 1, width), strides=(1, 1))
+    chars = windows[np.clip(offsets, 0, last)]
+    for row in np.flatnonzero((offsets < 0) | (offsets > last)):
+        # fields at the very start or end of the buffer
+        low = max(offsets[row], 0)
+        high = min(offsets[row] + width, len(data))
+        chars[row] = 0
+        chars[row, low - offsets[row]:high - offsets[row]] = data[low:high]
+    return chars
+
+
+def _digits_value(digits):
+    value = digits[:, 0].astype(np.int64)
+    for column in range(1, digits.shape[1]):
+        value *= 10
+        value += digits[:, column]
+    return value
+
+
+def _parse_numbers(data, starts, ends, fractional=False):
+    """
+    Parse decimal fields data[starts:ends] as a matrix of characters,
+    aligned right. Return None if a field is not a plain number.
+    """
+    width = ends - starts
+    if not len(width) or width.min() < 1 or \
+            width.max() > MAX_DIGITS + fractional:
+        return None
+    max_width = width.max()
+    positions = np.arange(max_width)[::-1]
+    inside = positions < width[:, None]
+    chars = _windows(data, ends - max_width, max_width)
+    digits = chars - np.uint8(ord('0'))
+    digits *= inside
+    if digits.max() <= 9:
+        return _digits_value(digits)
+    other = digits > 9
+    odd = np.flatnonzero(other.any(axis=0))
+    if fractional and len(odd) == 1 and other[:, odd[0]].all() and \
+            (chars[:, odd[0]] == DOT).all():
+        # a decimal point at the same place in every field,
+        # as phantom writes timestamps
+        value = _digits_value(np.delete(digits, odd[0], axis=1))
+        return value / float(POWERS[positions[odd[0]]])
+    is_digit = inside & ~other
+    # power of ten of every digit is the number of digits to the right
+    exponent = np.cumsum(is_digit[:, ::-1], axis=1)[:, ::-1] - 1
+    value = (np.where(is_digit, digits, 0) *
+             POWERS[np.maximum(exponent, 0)]).sum(axis=1)
+    sign = other & (chars == MINUS) & (positions == width[:, None] - 1)
+    point = other & (chars == DOT) if fractional else np.zeros_like(other)
+    if (other & ~sign & ~point).any() or (point.sum(axis=1) > 1).any() \
+            or not is_digit[:, -1].all():
+        return None
+    value = np.where(sign.any(axis=1), -value, value)
+    if fractional:
+        divisor = POWERS[np.where(point, exponent + 1, 0).max(axis=1)]
+        return value / divisor.astype(np.float64)
+    return value
+
+
+class TagDictionary(object):
+    """
+    Cache of tag names by their utf-8 bytes, so that a tag seen in many
+    chunks is named once. Names are native str, as read_csv gives them:
+    utf-8 bytes on python 2 and text on python 3. The cache is cleared when
+    it holds max_size tags, so unique tags, e.g. of uniq or enum_ammo
+    markers, don't pile up.
+    """
+
+    def __init__(self, max_size=MAX_CACHED_TAGS):
+        self.max_size = max_size
+        self.names = {}
+
+    def name_of(self, raw):
+        """
+        Name of a tag as utf-8 bytes with '#' suffix already cut
+        """
+        name = self.names.get(raw)
+        if name is None:
+            if len(self.names) >= self.max_size:
+                self.names.clear()
+            if sys.version_info[0] < 3:
+                name = bytes(raw)
+            else:
+                name = raw.decode('utf-8')
+            self.names[raw] = name
+        return name
+
+
+def _parse_tags(data, starts, ends, tags):
+    """
+    Cut tags at the last '#' and return them as a categorical of the tags
+    present in the chunk. Distinct tags are found with np.unique on a
+    fixed-width byte matrix and named once per chunk.
+    """
+    width = ends - starts
+    max_width = width.max() if len(width) else 0
+    if not max_width:
+        return pd.Categorical.from_codes(
+            np.full(len(width), -1, dtype=np.int64), categories=[])
+    if max_width > MAX_TAG_BYTES:
+        return None
+    matrix = _windows(data, starts, max_width)
+    matrix *= np.arange(max_width) < width[:, None]
+    if (matrix == QUOTE).any():
+        return None
+    hashes = matrix == HASH
+    last_hash = max_width - 1 - np.argmax(hashes[:, ::-1], axis=1)
+    cut = np.where(hashes.any(axis=1), last_hash, width)
+    matrix[np.arange(max_width) >= cut[:, None]] = 0
+    keys = matrix.view('S%s' % max_width).ravel()
+    distinct, inverse = np.unique(keys, return_inverse=True)
+    return pd.Categorical.from_codes(
+        np.where(width > 0, inverse.ravel(), -1),
+        categories=[tags.name_of(key) for key in distinct])
+
+
+def phout_to_df(buf, tags=None):
+    """
+    Same as string_to_df for whole phout lines in bytes, a bytearray, an
+    mmap or a uint8 array, parsed right from the buffer into numpy
+    columns. Tags are a categorical column of the
+    tags present in buf, named through tags, a TagDictionary kept between
+    chunks. Lines that aren't plain phout are handed over to
+    string_to_df.
+    """
+    start_time = time.time()
+    tags = TagDictionary() if tags is None else tags
+    if isinstance(buf, np.ndarray):
+        data = buf
+    else:
+        data = np.frombuffer(buf, dtype=np.uint8)
+    fields = len(phout_columns)
+    separators = np.flatnonzero((data == TAB) | (data == NEWLINE))
+    line_ends = separators[fields - 1::fields]
+    columns = None
+    if len(line_ends) and len(separators) == len(line_ends) * fields and \
+            len(data) == separators[-1] + 1 and \
+            (data[line_ends] == NEWLINE).all():
+        columns = {}
+        for i, name in enumerate(phout_columns):
+            # field bounds are taken from separators column by column,
+            # so that only one column of them is copied at a time
+            ends = np.ascontiguousarray(separators[i::fields])
+            if i:
+                starts = separators[i - 1::fields] + 1
+            else:
+                starts = np.concatenate(([0], line_ends[:-1] + 1))
+            if name == 'tag':
+                parsed = _parse_tags(data, starts, ends, tags)
+            else:
+                parsed = _parse_numbers(
+                    data, starts, ends, name == 'send_ts')
+            if parsed is None:
+                columns = None
+                break
+            columns[name] = parsed
+    del separators, line_ends
+    if columns is None:
+        logger.debug("Chunk is not plain phout, parsing it with read_csv")
+        text = data.tobytes()
+        if sys.version_info[0] >= 3:
+            text = text.decode('utf-8')
+        chunk = string_to_df(text)
+        chunk['tag'] = pd.Categorical(chunk.tag)
+        return chunk
+
+    chunk = pd.DataFrame(columns, columns=phout_columns)
+    chunk['receive_ts'] = chunk.send_ts + chunk.interval_real / 1e6
+    chunk['receive_sec'] = chunk.receive_ts.astype(np.int64)
+    chunk.set_index(['receive_sec'], inplace=True)
+
+    logger.debug("Chunk decode time: %.2fms",
+                 (time.time() - start_time) * 1000)
+    return chunk
+
+
+class LineReader(object):
+    """
+    Read whole lines from a file object into a buffer that is reused for
+    every read: an incomplete last line is moved to the buffer's start
+    and the file is read right after it.
+    """
+
+    def __init__(self, source, chunk_size):
+        self.source = source
+        self.buffer = bytearray(chunk_size)
+        self.pending = 0
+        self.consumed = 0
+
+    def read(self, limit=None):
+        """
+        uint8 array of whole lines, a view of the buffer valid until the
+        next read, or None if no line has been completed. At most limit bytes are read from
+        source.
+        """
+        if self.consumed:
+            self.buffer[:self.pending] = \
+                self.buffer[self.consumed:self.consumed + self.pending]
+            self.consumed = 0
+        if self.pending == len(self.buffer):
+            # a line longer than the buffer
+            self.buffer += bytearray(len(self.buffer))
+        end = len(self.buffer)
+        if limit is not None:
+            end = min(end, self.pending + limit)
+        read = self.source.readinto(memoryview(self.buffer)[self.pending:end])
+        if not read:
+            return None
+        size = self.pending + read
+        self.consumed = self.buffer.rfind(b'\n', 0, size) + 1
+        self.pending = size - self.consumed
+        if not self.consumed:
+            return None
+        # numpy of python 2 can't take a buffer from a memoryview
+        return np.frombuffer(self.buffer, np.uint8, count=self.consumed)
+
+
+def _file_id(filename):
+    stat = os.stat(filename)
+    return [stat.st_dev, stat.st_ino]
+
+
 class PhantomReader(object):
-    def __init__(self, filename):
-        self.buffer = ""
-        self.phout = open(filename, 'r')
+    """
+    Read phout with a LineReader, so the buffer is reused for every chunk.
+    Tag names are cached by the reader and passed on as categoricals.
+
+    With state_file, the reader checkpoints the last second its consumer
+    reports as delivered to listeners through emitted(), and the offset of
+    the first line after which it has read only later seconds, at most once
+    a checkpoint_period. A reader for the same file (same device and inode)
+    with the same state_file seeks right to that offset and skips samples
+    of seconds up to the checkpointed one, so a restarted tank or a
+    repeated phout import neither loses seconds that were still on their
+    way to listeners nor delivers a second twice.
+    """
+    # waits for appended data itself, so pollers shouldn't sleep
+    poll_period = 0
+
+    def __init__(self, filename, chunk_size=1024 * 1024 * 50,
+                 state_file=None, checkpoint_period=1.0):
+        self.filename = filename
+        self.tags = TagDictionary()
+        self.phout = FileFollower(filename, 'rb')
+        self.lines = LineReader(self.phout, chunk_size)
         self.closed = False
+        self.state_file = state_file
+        self.checkpoint_period = checkpoint_period
+        self.checkpointed_at = 0
+        self.offset = 0
+        self.last_second = None
+        # (offset, last second read before it) of every chunk read
+        self.read_marks = deque()
+        self.emitted_second = None
+        self.checkpointed_offset = 0
+        self.resumed_second = None
+        if state_file:
+            self._resume()
+
+    def _resume(self):
+        try:
+            with open(self.state_file) as state_file:
+                state = json.load(state_file)
+        except IOError:
+            return
+        except ValueError as e:
+            logger.warning("Broken phout state %s, reading from start: %s",
+                           self.state_file, e)
+            return
+        if state.get('file_id') != _file_id(self.filename) or \
+                state['offset'] > os.path.getsize(self.filename):
+            logger.info("Phout state %s is for another file, reading %s "
+                        "from start", self.state_file, self.filename)
+            return
+        self.offset = self.checkpointed_offset = state['offset']
+        self.last_second = self.emitted_second = self.resumed_second = \
+            state['last_second']
+        self.phout.seek(self.offset)
+        logger.info("Resuming %s at byte %s, last second delivered: %s",
+                    self.filename, self.offset, self.last_second)
+
+    def emitted(self, second, force=False):
+        """
+        Called by the consumer once listeners have got every second up to
+        second, checkpoints at most once a checkpoint_period or if forced
+        """
+        if second is not None and (self.emitted_second is None or
+                                   second > self.emitted_second):
+            self.emitted_second = second
+        self.checkpoint(force)
+
+    def checkpoint(self, force=False):
+        now = time.time()
+        if not self.state_file or self.emitted_second is None or \
+                not force and now < self.checkpointed_at + \
+                self.checkpoint_period:
+            return
+        self.checkpointed_at = now
+        # chunks are appended by the reading thread, only popped here
+        while self.read_marks and (
+                self.read_marks[0][1] is None or
+                self.read_marks[0][1] <= self.emitted_second):
+            self.checkpointed_offset = self.read_marks.popleft()[0]
+        state = {
+            'phout': os.path.abspath(self.filename),
+            'file_id': _file_id(self.filename),
+            'offset': self.checkpointed_offset,
+            'last_second': self.emitted_second,
+        }
+        tmp = self.state_file + '.tmp'
+        with open(tmp, 'w') as state_file:
+            json.dump(state, state_file)
+        os.rename(tmp, self.state_file)
 
     def _read_phout_chunk(self):
-        data = self.phout.read(1024 * 1024 * 50)
-        if data:
-            parts = data.rsplit('\n', 1)
-            if len(parts) > 1:
-                ready_chunk = self.buffer + parts[0] + '\n'
-                self.buffer = parts[1]
-                return string_to_df(ready_chunk)
-            else:
-                self.buffer += parts[0]
-        else:
-            self.buffer += self.phout.readline()
-        return None
+        lines = self.lines.read()
+        if lines is None:
+            return None
+        chunk = phout_to_df(lines, self.tags)
+        self.offset += len(lines)
+        if self.resumed_second is not None:
+            # these were delivered before the restart
+            chunk = chunk[chunk.index > self.resumed_second]
+        if len(chunk):
+            second = int(chunk.index.max())
+            if self.last_second is None or second > self.last_second:
+                self.last_second = second
+        if self.state_file:
+            self.read_marks.append((self.offset, self.last_second))
+        return chunk
 
     def __iter__(self):
         while not self.closed:
-            yield self._read_phout_chunk()
+            chunk = self._read_phout_chunk()
+            if chunk is not None:
+                yield chunk
+            else:
+                self.phout.wait_for_data()
         yield self._read_phout_chunk()
         self.phout.close()
 
@@ -84,11 +423,125 @@ class PhantomReader(object):
         self.closed = True
 
 
+class StatStream(object):
+    """
+    Incremental parser of phantom stat log, a stream of
+    '"<date>" : {...}' records separated by commas. feed() takes text cut
+    anywhere and returns the records it completes as {date: stats} dicts.
+
+    Brace depth and string state are kept between feeds, so every char is
+    scanned once and the buffer holds only the unfinished record.
+    """
+    TOKENS = re.compile(r'[{}"]')
+    STRING_END = re.compile(r'["\\]')
+
+    def __init__(self, max_record=MAX_STAT_RECORD):
+        self.max_record = max_record
+        self.buffer = ''
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.oversized = False
+
+    def _record(self, text):
+        if self.oversized:
+            self.oversized = False
+            logger.warning("Skipped phantom stats record over %s bytes",
+                           self.max_record)
+            return None
+        text = text.lstrip(' \t\r\n,')
+        try:
+            return json.loads(text if text.startswith('{') else '{%s}' % text)
+        except ValueError:
+            logger.warning("Malformed phantom stats record: %s", text[:100])
+            return None
+
+    def _scan(self, buf, pos, start, records):
+        """
+        Scan buf from pos, return where to continue and where the
+        unfinished record starts
+        """
+        while True:
+            if self.in_string:
+                match = self.STRING_END.search(buf, pos)
+                if not match:
+                    return len(buf), start
+                if match.group() == '\\':
+                    if match.end() == len(buf):
+                        # the escaped char is in the next feed
+                        return match.start(), start
+                    pos = match.end() + 1
+                    continue
+                self.in_string = False
+                pos = match.end()
+                continue
+            match = self.TOKENS.search(buf, pos)
+            if not match:
+                return len(buf), start
+            pos = match.end()
+            token = match.group()
+            if token == '"':
+                self.in_string = True
+            elif token == '{':
+                self.depth += 1
+            elif self.depth > 1:
+                self.depth -= 1
+            else:
+                if self.depth == 1:
+                    record = self._record(buf[start:pos])
+                    if record:
+                        records.append(record)
+                self.depth = 0
+                start = pos
+
+    def feed(self, text):
+        buf = self.buffer + text
+        records = []
+        pos, start = self._scan(buf, self.pos, 0, records)
+        if len(buf) - start > self.max_record:
+            # keep tracking the record to find its end, drop its text
+            self.oversized = True
+            start = pos
+        self.buffer = buf[start:]
+        self.pos = pos - start
+        return records
+
+
+class StatTimestamps(object):
+    """
+    Epoch seconds of phantom's local 'YYYY-MM-DD HH:MM:SS.mmm' dates.
+    Dates come in order, so the start of the current minute is cached and
+    seconds are added to it; other formats are parsed with strptime.
+    """
+
+    def __init__(self):
+        self.minute = None
+        self.minute_start = None
+
+    @staticmethod
+    def _parse(date_str):
+        date_obj = datetime.datetime.strptime(date_str, '%Y-%m-%d %H:%M:%S')
+        return int(time.mktime(date_obj.timetuple()))
+
+    def __call__(self, date_str):
+        seconds = date_str[17:19]
+        if date_str[16:17] != ':' or not seconds.isdigit():
+            return self._parse(date_str.split(".")[0])
+        minute = date_str[:16]
+        if minute != self.minute:
+            self.minute_start = self._parse(minute + ':00')
+            self.minute = minute
+        return self.minute_start + int(seconds)
+
+
 class PhantomStatsReader(object):
+    # waits for appended data itself, so pollers shouldn't sleep
+    poll_period = 0
+
     def __init__(self, filename, phantom_info):
         self.phantom_info = phantom_info
-        self.buffer = ""
-        self.stat_buffer = ""
+        self.stream = StatStream()
+        self.timestamps = StatTimestamps()
         self.stat_filename = filename
         self.closed = False
         self.start_time = 0
@@ -97,15 +550,13 @@ class PhantomStatsReader(object):
         """
         Return all items found in this chunk
         """
-        for date_str, statistics in chunk.iteritems():
-            date_obj = datetime.datetime.strptime(
-                date_str.split(".")[0], '%Y-%m-%d %H:%M:%S')
-            chunk_date = int(time.mktime(date_obj.timetuple()))
+        for date_str, statistics in chunk.items():
+            chunk_date = self.timestamps(date_str)
             instances = 0
-            for benchmark_name, benchmark in statistics.iteritems():
+            for benchmark_name, benchmark in statistics.items():
                 if not benchmark_name.startswith("benchmark_io"):
                     continue
-                for method, meth_obj in benchmark.iteritems():
+                for method, meth_obj in benchmark.items():
                     if "mmtasks" in meth_obj:
                         instances += meth_obj["mmtasks"][2]
 
@@ -118,30 +569,28 @@ class PhantomStatsReader(object):
                                'reqps': reqps}}
 
     def _read_stat_data(self, stat_file):
-        chunk = stat_file.read(1024 * 1024 * 50)
+        chunk = stat_file.read(STAT_READ_BYTES)
         if chunk:
-            self.stat_buffer += chunk
-            parts = self.stat_buffer.rsplit('\n},', 1)
-            if len(parts) > 1:
-                ready_chunk = parts[0]
-                self.stat_buffer = parts[1]
-                chunks = [json.loads('{%s}}' % s)
-                          for s in ready_chunk.split('\n},')]
-                return list(itt.chain(*(self._decode_stat_data(chunk)
-                                        for chunk in chunks)))
-        else:
-            self.stat_buffer += stat_file.readline()
+            return list(itt.chain(*(self._decode_stat_data(record)
+                                    for record in self.stream.feed(chunk))))
 
     def __iter__(self):
         """
-        Union buffer and chunk, split using '\n},',
-        return splitted parts
+        Feed stat log to the stream parser as it grows,
+        yield lists of stats of the records completed
         """
         self.start_time = int(time.time())
-        with open(self.stat_filename, 'r') as stat_file:
+        stat_file = FileFollower(self.stat_filename)
+        try:
             while not self.closed:
-                yield self._read_stat_data(stat_file)
+                stats = self._read_stat_data(stat_file)
+                if stats:
+                    yield stats
+                else:
+                    stat_file.wait_for_data()
             yield self._read_stat_data(stat_file)
+        finally:
+            stat_file.close()
 
     def close(self):
         self.closed = True
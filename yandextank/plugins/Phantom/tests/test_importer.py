@@ -0,0 +1,58 @@
+import json
+
+from pkg_resources import resource_string
+
+from yandextank.plugins.Aggregator.aggregator import Aggregator
+from yandextank.plugins.Aggregator.benchmark import synthetic_phout
+from yandextank.plugins.Aggregator.chopper import TimeChopper
+from yandextank.plugins.Phantom.importer import PhoutImport, \
+    PhoutImportAggregator, byte_ranges
+from yandextank.plugins.Phantom.reader import phout_to_df
+
+AGGR_CONFIG = json.loads(resource_string("yandextank.plugins.Aggregator",
+                                         'config/phout.json').decode('utf-8'))
+
+
+def write_phout(tmpdir):
+    text = synthetic_phout(2000, 10, 8)
+    phout = tmpdir.join('phout.log')
+    phout.write(text)
+    return str(phout), text
+
+
+class TestImporter(object):
+    def test_byte_ranges(self, tmpdir):
+        filename, text = write_phout(tmpdir)
+        ranges = byte_ranges(filename, 10000)
+        assert len(ranges) > 1
+        assert ranges[0][0] == 0 and ranges[-1][1] == len(text)
+        for (_, end), (start, _) in zip(ranges, ranges[1:]):
+            assert end == start
+            assert text[end - 1] == '\n'
+
+    def test_same_as_live(self, tmpdir):
+        filename, text = write_phout(tmpdir)
+        expected = list(Aggregator(
+            TimeChopper([phout_to_df(text.encode('utf-8'))]),
+            AGGR_CONFIG, False, max_tags=5))
+        importer = PhoutImport(filename, processes=2, range_bytes=50000)
+        stats = importer.stats_reader()
+        result = list(importer.aggregate(AGGR_CONFIG, False, max_tags=5))
+        assert result == expected
+        assert importer.finished
+        stats.close()
+        seconds = [item['ts'] for chunk in stats if chunk for item in chunk]
+        assert seconds == [item['ts'] for item in expected]
+
+    def test_out_of_order(self, tmpdir):
+        filename, text = write_phout(tmpdir)
+        lines = text.splitlines(True)
+        # a sample of the first second at the end of phout
+        tmpdir.join('phout.log').write(''.join(lines[1:] + lines[:1]))
+        result = list(PhoutImportAggregator(
+            filename, AGGR_CONFIG, False, processes=2, range_bytes=50000))
+        amendments = [item for item in result if item.get('amendment')]
+        assert len(amendments) == 1
+        assert amendments[0]['ts'] == result[0]['ts']
+        assert amendments[0]['overall']['interval_real']['len'] == 1
+        assert len(result) == len(set(item['ts'] for item in result)) + 1
@@ -0,0 +1,177 @@
+import datetime
+import time
+
+import pandas as pd
+
+from yandextank.plugins.Aggregator.benchmark import synthetic_phout
+from yandextank.plugins.Phantom.reader import PhantomReader, \
+    StatStream, StatTimestamps, TagDictionary, phout_to_df, string_to_df
+
+
+def assert_same_frame(df, expected):
+    """
+    Frames are equal up to categorical tags
+    """
+    pd.testing.assert_frame_equal(
+        df.assign(tag=df.tag.astype(object)),
+        expected.assign(tag=expected.tag.astype(object)))
+
+
+def tagged_phout():
+    """
+    Synthetic phout with marked, empty and odd tags and a negative code
+    """
+    lines = [line.split('\t')
+             for line in synthetic_phout(500, 2, 5).splitlines(True)]
+    lines[1][1] = 'case#1#2'
+    lines[2][1] = '#case'
+    lines[3][1] = ''
+    lines[4][10] = '-1'
+    return ''.join('\t'.join(line) for line in lines)
+
+
+class TestPhoutToDf(object):
+    def test_same_as_read_csv(self):
+        text = tagged_phout()
+        tags = TagDictionary()
+        df = phout_to_df(text.encode('utf-8'), tags)
+        assert_same_frame(df, string_to_df(text))
+        assert len(tags.names) == 7
+        assert df.tag.iloc[1] == 'case#1'
+        assert df.tag.iloc[2] == ''
+        assert pd.isnull(df.tag.iloc[3])
+        assert df.net_code.iloc[4] == -1
+
+    def test_synthetic_phout(self):
+        df = phout_to_df(synthetic_phout(100, 1, 2).encode('utf-8'))
+        assert set(df.tag) == {'case0', 'case1'}
+        assert (df.send_ts >= 1.5e9).all() and (df.send_ts <= 1.5e9 + 1).all()
+        assert (df.interval_real >= 1).all()
+        assert set(df.proto_code) <= {200, 404, 500}
+
+    def test_chunk_categories(self):
+        tags = TagDictionary()
+        phout_to_df(synthetic_phout(100, 1, 4).encode('utf-8'), tags)
+        df = phout_to_df(synthetic_phout(100, 1, 2).encode('utf-8'), tags)
+        assert sorted(df.tag.cat.categories) == ['case0', 'case1']
+
+    def test_tag_dictionary_limit(self):
+        tags = TagDictionary(max_size=3)
+        phout_to_df(synthetic_phout(100, 1, 5).encode('utf-8'), tags)
+        assert len(tags.names) <= 3
+
+    def test_not_plain_phout(self):
+        text = '1500000000.5\t"a\tb"\t1\t2\t3\t4\t5\t6\t7\t8\t0\t200\n'
+        df = phout_to_df(text.encode('utf-8'))
+        assert_same_frame(df, string_to_df(text))
+        assert df.tag.dtype.name == 'category'
+        assert df.tag.iloc[0] == 'a\tb'
+
+    def test_non_ascii_tags(self):
+        case = u'\u043a\u0435\u0439\u0441'.encode('utf-8')
+        fields = b'\t1\t2\t3\t4\t5\t6\t7\t8\t0\t200\n'
+        plain = b'1500000000.5\t' + case + b'#1' + fields
+        quoted = b'1500000000.5\t"' + case + b'"' + fields
+        name = case if str is bytes else case.decode('utf-8')
+        for line in (plain, quoted):
+            tag = phout_to_df(line).tag.iloc[0]
+            assert type(tag) is str and tag == name
+
+
+class TestPhantomReader(object):
+    def test_reused_buffer(self, tmpdir):
+        text = synthetic_phout(200, 3, 5)
+        phout = tmpdir.join('phout.log')
+        phout.write(text)
+        reader = PhantomReader(str(phout), chunk_size=1000)
+        chunks = [reader._read_phout_chunk() for _ in range(100)]
+        df = pd.concat([chunk for chunk in chunks if chunk is not None])
+        assert_same_frame(df, string_to_df(text))
+        assert len(reader.lines.buffer) == 1000
+        reader.phout.close()
+
+    def test_resume(self, tmpdir):
+        text = synthetic_phout(200, 3, 5)
+        phout = tmpdir.join('phout.log')
+        phout.write(text)
+        state = str(tmpdir.join('phout.state'))
+        reader = PhantomReader(str(phout), chunk_size=5000, state_file=state,
+                               checkpoint_period=0)
+        for _ in range(3):
+            reader._read_phout_chunk()
+        reader.checkpoint(force=True)
+        # nothing is checkpointed until listeners have got a second
+        assert not tmpdir.join('phout.state').check()
+        marks = list(reader.read_marks)
+        emitted = marks[1][1]
+        reader.emitted(emitted)
+        reader.phout.close()
+
+        resumed = PhantomReader(str(phout), state_file=state)
+        assert resumed.offset == max(
+            offset for offset, second in marks if second <= emitted)
+        assert resumed.last_second == emitted
+        rest = [resumed._read_phout_chunk() for _ in range(100)]
+        resumed.phout.close()
+        expected = string_to_df(text)
+        # delivered seconds are skipped, the later ones are read again
+        assert_same_frame(
+            pd.concat([chunk for chunk in rest if chunk is not None]),
+            expected[expected.index > emitted])
+
+    def test_state_of_another_file(self, tmpdir):
+        text = synthetic_phout(100, 1, 2)
+        state = str(tmpdir.join('phout.state'))
+        for name in ('first.log', 'second.log'):
+            tmpdir.join(name).write(text)
+        reader = PhantomReader(str(tmpdir.join('first.log')),
+                               state_file=state)
+        reader._read_phout_chunk()
+        reader.emitted(reader.last_second, force=True)
+        reader.phout.close()
+        other = PhantomReader(str(tmpdir.join('second.log')),
+                              state_file=state)
+        assert other.offset == 0
+        assert len(other._read_phout_chunk()) == 100
+        other.phout.close()
+
+
+STAT_RECORD = """"2016-09-30 16:44:%02d.000" : {
+ "benchmark_io" : {
+  "stream_method" : {
+   "mmtasks" : [0, 1, %d],
+   "note" : "braces } { and \\"quotes\\" in a string"
+  }
+ }
+},
+"""
+
+
+class TestStatStream(object):
+    def test_any_boundaries(self):
+        text = ''.join(STAT_RECORD % (second, second) for second in range(3))
+        expected = StatStream().feed(text)
+        assert [list(r) for r in expected] == [
+            ['2016-09-30 16:44:0%s.000' % second] for second in range(3)]
+        for size in (1, 2, 7, 50):
+            stream = StatStream()
+            records = []
+            for start in range(0, len(text), size):
+                records += stream.feed(text[start:start + size])
+            assert records == expected
+            assert stream.buffer.strip(',\n') == ''
+
+    def test_oversized_record(self):
+        stream = StatStream(max_record=100)
+        text = STAT_RECORD % (0, 0) + STAT_RECORD % (1, 1)
+        records = stream.feed(text[:150]) + stream.feed(text[150:])
+        assert [list(r) for r in records] == [['2016-09-30 16:44:01.000']]
+
+    def test_timestamps(self):
+        timestamps = StatTimestamps()
+        for date_str in ('2016-09-30 16:44:59.000', '2016-09-30 16:45:00.500',
+                         '2016-09-30 16:45:01', '2016-10-01 00:00:00.000'):
+            expected = datetime.datetime.strptime(
+                date_str[:19], '%Y-%m-%d %H:%M:%S')
+            assert timestamps(date_str) == int(
+                time.mktime(expected.timetuple()))
@@ -0,0 +1,137 @@
+'''
+Offset index of phantom-format ammo files
+'''
+import gzip
+import hashlib
+import logging
+import os
+import tempfile
+
+import numpy as np
+
+from ..common.resource import FileOpener
+from .module_exceptions import AmmoFileError
+
+log = logging.getLogger(__name__)
+
+
+class AmmoIndex(object):
+    '''
+    Offsets, sizes and markers of missiles in a phantom-format ammo file, up
+    to its end or to the first zero-sized chunk. Markers are kept as codes
+    of names, '' is the code of missiles without a marker.
+    '''
+
+    def __init__(self, offsets, sizes, codes, names):
+        self.offsets = offsets
+        self.sizes = sizes
+        self.codes = codes
+        self.names = names
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def markers(self):
+        '''Marker of every missile, None if it has no marker'''
+        names = [name or None for name in self.names]
+        return [names[code] for code in self.codes.tolist()]
+
+    def select(self, cases):
+        '''
+        Index of missiles that are marked with one of cases or not marked
+        at all, as those get their markers later
+        '''
+        chosen = np.array([not name or name in cases
+                           for name in self.names], dtype=bool)
+        mask = chosen[self.codes]
+        return AmmoIndex(self.offsets[mask], self.sizes[mask],
+                         self.codes[mask], self.names)
+
+    @classmethod
+    def build(cls, ammo_file):
+        '''
+        Index an ammo file reading headers only, bodies are skipped
+        '''
+        length = os.fstat(ammo_file.fileno()).st_size
+        offsets, sizes, codes = [], [], []
+        names = {b'': 0}
+        while True:
+            line = ammo_file.readline()
+            if not line:
+                break
+            chunk_header = line.strip(b'\r\n')
+            if not chunk_header:
+                continue
+            try:
+                fields = chunk_header.split()
+                chunk_size = int(fields[0])
+            except (IndexError, ValueError) as e:
+                raise AmmoFileError(
+                    "Error while reading ammo file. Position: %s, header: '%s', original exception: %s"
+                    % (ammo_file.tell(), chunk_header, e))
+            if chunk_size == 0:
+                log.info('Zero-sized chunk in ammo file at %s. Starting over.',
+                         ammo_file.tell())
+                break
+            offset = ammo_file.tell()
+            if offset + chunk_size > length:
+                raise AmmoFileError(
+                    "Unexpected end of file: read %s bytes instead of %s"
+                    % (length - offset, chunk_size))
+            ammo_file.seek(chunk_size, os.SEEK_CUR)
+            marker = fields[1] if len(fields) > 1 else b''
+            offsets.append(offset)
+            sizes.append(chunk_size)
+            codes.append(names.setdefault(marker, len(names)))
+        return cls(
+            np.array(offsets, dtype=np.int64),
+            np.array(sizes, dtype=np.int64),
+            np.array(codes, dtype=np.int32),
+            sorted(names, key=names.get))
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as index:
+            return cls(index['offsets'], index['sizes'], index['codes'],
+                       index['names'].tolist())
+
+    def save(self, filename):
+        '''
+        Write the index to filename, through a temporary file so that a
+        concurrent reader never sees a partial index
+        '''
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, offsets=self.offsets, sizes=self.sizes,
+                         codes=self.codes,
+                         names=np.array(self.names, dtype=bytes))
+            os.rename(tmp, filename)
+        except Exception:
+            os.remove(tmp)
+            raise
+
+
+def get_index(opener, index_dir=None):
+    '''
+    Index of the ammo file of opener, or None if the file can not be
+    memory-mapped. Indexes are saved to index_dir under the hash of the
+    file, so a file is indexed again only when it changes.
+    '''
+    if not isinstance(opener, FileOpener):
+        return None
+    with opener() as ammo_file:
+        if isinstance(ammo_file, gzip.GzipFile):
+            return None
+        if index_dir is None:
+            return AmmoIndex.build(ammo_file)
+        filename = os.path.join(index_dir, "%s_%s.ammo_index.npz" % (
+            os.path.basename(opener.get_filename),
+            hashlib.md5(opener.hash.encode('utf8')).hexdigest()))
+        if os.path.exists(filename):
+            log.info("Using cached ammo index: %s", filename)
+            return AmmoIndex.load(filename)
+        log.info("Indexing ammo file: %s", opener.get_filename)
+        index = AmmoIndex.build(ammo_file)
+    index.save(filename)
+    return index
@@ -24,7 +24,8 @@ class ComponentFactory():
                  autocases=None,
                  enum_ammo=False,
                  ammo_type='phantom',
-                 chosen_cases=[], ):
+                 chosen_cases=[],
+                 index_dir=None, ):
         self.log = logging.getLogger(__name__)
         self.ammo_file = ammo_file
         self.ammo_type = ammo_type
@@ -47,8 +48,10 @@ class ComponentFactory():
         if self.uris and loop_limit:
             info.status.ammo_limit = len(self.uris) * loop_limit
         self.headers = headers
+        self.enum_ammo = enum_ammo
         self.marker = get_marker(autocases, enum_ammo)
         self.chosen_cases = chosen_cases
+        self.index_dir = index_dir
 
     def get_load_plan(self):
         """
@@ -109,9 +112,12 @@ class ComponentFactory():
             else:
                 raise NotImplementedError(
                     'No such ammo type implemented: "%s"' % self.ammo_type)
-            ammo_gen = af_readers[self.ammo_type](self.ammo_file,
-                                                  headers=self.headers,
-                                                  http_ver=self.http_ver)
+            ammo_gen = af_readers[self.ammo_type](
+                self.ammo_file,
+                headers=self.headers,
+                http_ver=self.http_ver,
+                index_dir=self.index_dir,
+                chosen_cases=self.chosen_cases)
         else:
             raise StepperConfigurationError(
                 'Ammo not found. Specify uris or ammo file')
@@ -2,9 +2,21 @@
 Ammo formatters
 '''
 import logging
+import mmap
+import os
+import sys
+import tempfile
+from builtins import range
 
+import numpy as np
+
+from ..common.resource import FileOpener
 from .module_exceptions import StpdFileError
 
+# records are taken out of an stpd index this many at a time
+INDEX_CHUNK = 65536
+
+
 class Stpd(object):
     '''
     STPD ammo formatter
@@ -17,41 +29,180 @@ class Stpd(object):
         return ("%s %s %s\n%s\n" % (len(missile), timestamp, marker, missile)
                 for timestamp, marker, missile in self.af)
 
+    @staticmethod
+    def render(timestamps, markers, missiles):
+        '''
+        Stpd text of a block of missiles in one string
+        '''
+        return ''.join(
+            "%s %s %s\n%s\n" % (len(missile), timestamp, marker, missile)
+            for timestamp, marker, missile in zip(timestamps, markers,
+                                                  missiles))
+
+
+class StpdIndex(object):
+    '''
+    Timestamps, offsets, sizes and marker codes of the missiles of an stpd
+    file, names holds the marker of every code
+    '''
+
+    def __init__(self, timestamps, offsets, sizes, codes, names):
+        self.timestamps = timestamps
+        self.offsets = offsets
+        self.sizes = sizes
+        self.codes = codes
+        self.names = names
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __iter__(self):
+        '''
+        (timestamp, offset, size, marker) records, StpdReader.records() does
+        '''
+        for start in range(0, len(self), INDEX_CHUNK):
+            chunk = slice(start, start + INDEX_CHUNK)
+            for timestamp, offset, size, code in zip(
+                    self.timestamps[chunk].tolist(),
+                    self.offsets[chunk].tolist(),
+                    self.sizes[chunk].tolist(),
+                    self.codes[chunk].tolist()):
+                yield timestamp, offset, size, self.names[code]
+
+    @classmethod
+    def from_records(cls, records):
+        timestamps, offsets, sizes, codes = [], [], [], []
+        names = {}
+        for timestamp, offset, size, marker in records:
+            timestamps.append(timestamp)
+            offsets.append(offset)
+            sizes.append(size)
+            codes.append(names.setdefault(marker, len(names)))
+        return cls(
+            np.array(timestamps, dtype=np.int64),
+            np.array(offsets, dtype=np.int64),
+            np.array(sizes, dtype=np.int64),
+            np.array(codes, dtype=np.int32),
+            sorted(names, key=names.get))
+
+    @classmethod
+    def load(cls, filename, stpd_hash):
+        '''
+        Index saved to filename, None if it was saved for another stpd file
+        '''
+        with np.load(filename) as index:
+            if index['hash'].tolist().decode('utf8') != stpd_hash:
+                return None
+            return cls(index['timestamps'], index['offsets'], index['sizes'],
+                       index['codes'], [name.decode('utf8') for name in
+                                        index['names'].tolist()])
+
+    def save(self, filename, stpd_hash):
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename) or '.')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, timestamps=self.timestamps, offsets=self.offsets,
+                         sizes=self.sizes, codes=self.codes,
+                         names=np.array([name.encode('utf8')
+                                         for name in self.names],
+                                        dtype=bytes),
+                         hash=np.array(stpd_hash.encode('utf8')))
+            os.rename(tmp, filename)
+        except Exception:
+            os.remove(tmp)
+            raise
+
 
 class StpdReader(object):
-    '''Read missiles from stpd file'''
+    '''
+    Read missiles from stpd file. The file is memory-mapped, missiles are
+    memoryview slices of it, buffer slices on py2.
+    '''
 
     def __init__(self, filename):
         self.filename = filename
         self.log = logging.getLogger(__name__)
         self.log.info("Loading stepped missiles from '%s'" % filename)
 
-    def __iter__(self):
-        def read_chunk_header(ammo_file):
-            chunk_header = ''
-            while not chunk_header:
-                line = ammo_file.readline().decode('utf8')
-                if not line:
-                    return line  # EOF
-                chunk_header = line.strip('\r\n')
-            return chunk_header
-        with open(self.filename, 'rb') as ammo_file:
-            chunk_header = read_chunk_header(ammo_file)
-            while chunk_header != '':
-                try:
-                    fields = chunk_header.split()
-                    chunk_size = int(fields[0])
-                    timestamp = int(fields[1])
-                    marker = fields[2] if len(fields) > 2 else ''
-                    missile = ammo_file.read(chunk_size)
-                    if len(missile) < chunk_size:
-                        raise StpdFileError(
-                            "Unexpected end of file: read %s bytes instead of %s"
-                            % (len(missile), chunk_size))
-                    yield (timestamp, missile, marker)
-                except (IndexError, ValueError) as e:
-                    raise StpdFileError(
-                        "Error while reading ammo file. Position: %s, header: '%s', original exception: %s"
-                        % (ammo_file.tell(), chunk_header, e))
-                chunk_header = read_chunk_header(ammo_file)
+    def mmap(self):
+        '''
+        Contents of the stpd file mapped to memory, empty bytes if it is empty
+        '''
+        with open(self.filename, 'rb') as stpd_file:
+            if not os.fstat(stpd_file.fileno()).st_size:
+                return b''
+            return mmap.mmap(stpd_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def records(self):
+        '''
+        Returns a generator of (timestamp, offset, size, marker) of the
+        missiles in the file, read as they are needed
+        '''
+        return self._records(self.mmap())
+
+    def _records(self, stpd):
+        end = len(stpd)
+        position = 0
+        markers = {}
+        while position < end:
+            eol = stpd.find(b'\n', position)
+            if eol < 0:
+                eol = end
+            chunk_header = stpd[position:eol].strip(b'\r\n')
+            position = eol + 1
+            if not chunk_header:
+                continue
+            try:
+                fields = chunk_header.split()
+                chunk_size = int(fields[0])
+                timestamp = int(fields[1])
+                marker = fields[2] if len(fields) > 2 else b''
+            except (IndexError, ValueError) as e:
+                raise StpdFileError(
+                    "Error while reading ammo file. Position: %s, header: '%s', original exception: %s"
+                    % (position, chunk_header, e))
+            if position + chunk_size > end:
+                raise StpdFileError(
+                    "Unexpected end of file: read %s bytes instead of %s"
+                    % (end - position, chunk_size))
+            if marker not in markers:
+                markers[marker] = marker.decode('utf8')
+            yield timestamp, position, chunk_size, markers[marker]
+            position += chunk_size
         self.log.info("Reached the end of stpd file")
+
+    def index(self):
+        '''
+        Records of all the missiles in the file. The index is saved next to
+        the file and loaded from there while the file stays the same.
+        '''
+        stpd_hash = FileOpener(self.filename).hash
+        index_filename = "%s_index.npz" % self.filename
+        if os.path.exists(index_filename):
+            index = StpdIndex.load(index_filename, stpd_hash)
+            if index is not None:
+                self.log.info("Using stpd index: %s", index_filename)
+                return index
+        self.log.info("Indexing stpd file: %s", self.filename)
+        index = StpdIndex.from_records(self.records())
+        try:
+            index.save(index_filename, stpd_hash)
+        except (IOError, OSError) as e:
+            self.log.warning("Could not save stpd index %s: %s",
+                             index_filename, e)
+        return index
+
+    def __iter__(self):
+        stpd = self.mmap()
+        if sys.version_info[0] < 3:
+            # mmap has no buffer interface for memoryview on py2,
+            # buffer() slices it without copying
+            def missile(offset, size):
+                return buffer(stpd, offset, size)  # noqa: F821
+        else:
+            missiles = memoryview(stpd)
+
+            def missile(offset, size):
+                return missiles[offset:offset + size]
+        for timestamp, offset, size, marker in self._records(stpd):
+            yield (timestamp, missile(offset, size), marker)
@@ -65,8 +65,17 @@ class StepperStatus(object):
             log.info("Ammo limit reached: %s", self.ammo_limit)
             raise StopIteration
 
-    def inc_ammo_count(self):
-        self.ammo_count += 1
+    def inc_ammo_count(self, count=1):
+        self.ammo_count += count
+
+    def ammo_left(self):
+        '''
+        How many more missiles to make, None if unlimited. Stepping stops
+        on the missile that exceeds the limit, so it is counted too.
+        '''
+        if self.ammo_limit:
+            return max(self.ammo_limit + 1 - self._ammo_count, 0)
+        return None
 
     @property
     def loop_count(self):
@@ -4,9 +4,24 @@ Load Plan generators
 import re
 from itertools import chain, groupby
 from builtins import range
+
+import numpy as np
+
 from . import info
 from .util import parse_duration, solve_quadratic, proper_round
 
+# timestamps are computed this many at a time
+BLOCK_SIZE = 1024 * 1024
+
+
+def _ranges(count, size):
+    for start in range(0, count, size):
+        yield np.arange(start, min(start + size, count), dtype=np.int64)
+
+
+def _iterate(blocks):
+    return chain.from_iterable(block.tolist() for block in blocks)
+
 
 class Const(object):
     '''
@@ -17,12 +32,18 @@ class Const(object):
         self.rps = float(rps)
         self.duration = duration
 
-    def __iter__(self):
+    def blocks(self, size=BLOCK_SIZE):
+        """
+        :return: int64 arrays of timestamps, size items each but the last
+        """
         if self.rps == 0:
-            return iter([])
+            return
         interval = 1000.0 / self.rps
-        return (int(i * interval)
-                for i in range(0, int(self.rps * self.duration / 1000)))
+        for i in _ranges(int(self.rps * self.duration / 1000), size):
+            yield (i * interval).astype(np.int64)
+
+    def __iter__(self):
+        return _iterate(self.blocks())
 
     def rps_at(self, t):
         '''Return rps for second t'''
@@ -72,12 +93,27 @@ class Line(object):
             root2 = float(n) / self.minrps
         return int(root2 * 1000)
 
+    def blocks(self, size=BLOCK_SIZE):
+        """
+        Vectorized ts(), same float operations in the same order
+
+        :return: int64 arrays of timestamps, size items each but the last
+        """
+        a = self.slope / 2.0
+        for n in _ranges(self.__len__(), size):
+            if a == 0:
+                root2 = n / self.minrps
+            else:
+                disc_root = np.sqrt((self.minrps * self.minrps) - 4 * a * -n)
+                root2 = (-self.minrps + disc_root) / (2 * a)
+            yield (root2 * 1000).astype(np.int64)
+
     def __iter__(self):
         """
 
         :return: timestamps for each charge
         """
-        return (self.ts(n) for n in range(0, self.__len__()))
+        return _iterate(self.blocks())
 
     def rps_at(self, t):
         '''Return rps for second t'''
@@ -123,13 +159,19 @@ class Composite(object):
     def __init__(self, steps):
         self.steps = steps
 
-    def __iter__(self):
+    def blocks(self, size=BLOCK_SIZE):
+        """
+        :return: blocks of the steps shifted by durations of previous steps
+        """
         base = 0
         for step in self.steps:
-            for ts in step:
-                yield ts + base
+            for block in step.blocks(size):
+                yield block + base
             base += step.get_duration()
 
+    def __iter__(self):
+        return _iterate(self.blocks())
+
     def get_duration(self):
         '''Return total duration'''
         return sum(step.get_duration() for step in self.steps)
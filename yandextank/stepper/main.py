@@ -4,9 +4,13 @@ Module contains top-level generators.
 import hashlib
 import json
 import logging
+import multiprocessing as mp
 import os
 import re
+import shutil
+from itertools import islice
 
+import numpy as np
 from builtins import zip
 from ..common.resource import manager as resource
 
@@ -14,6 +18,24 @@ from . import format as fmt
 from . import info
 from .config import ComponentFactory
 
+# missiles are generated, formatted and written this many at a time
+BLOCK_SIZE = 8192
+
+
+def _slice_blocks(blocks, start, stop):
+    '''
+    Items from start to stop of a sequence that comes in blocks, in blocks
+    '''
+    offset = 0
+    for block in blocks:
+        if stop is not None and offset >= stop:
+            return
+        end = offset + len(block)
+        if end > start:
+            yield block[max(start - offset, 0):
+                        None if stop is None else stop - offset]
+        offset = end
+
 
 class AmmoFactory(object):
     '''
@@ -39,14 +61,73 @@ class AmmoFactory(object):
         configured ComponentFactory, passed as a parameter to the
         __init__ method of this class.
         '''
-        ammo_stream = (ammo
-                       for ammo in ((missile, marker or self.marker(missile))
-                                    for missile, marker in self.ammo_generator)
-                       if self.filter(ammo))
-
         return ((timestamp, marker or self.marker(missile), missile)
                 for timestamp, (missile, marker) in zip(self.load_plan,
-                                                         ammo_stream))
+                                                         self._ammo_stream()))
+
+    def _ammo_stream(self, skip=0):
+        '''
+        (missile, marker) pairs of the ammo generator that pass the filter,
+        the first skip of them left out
+        '''
+        if skip:
+            # only seekable generators are split, see segmentable()
+            ammo_generator = self.ammo_generator.iter_from(skip)
+        else:
+            ammo_generator = self.ammo_generator
+        return (ammo
+                for ammo in ((missile, marker or self.marker(missile))
+                             for missile, marker in ammo_generator)
+                if self.filter(ammo))
+
+    def _timestamp_blocks(self, size, start=0, stop=None):
+        if hasattr(self.load_plan, 'blocks'):
+            blocks = self.load_plan.blocks(size)
+        else:
+            blocks = self._plain_blocks(size)
+        if start or stop is not None:
+            return _slice_blocks(blocks, start, stop)
+        return blocks
+
+    def _plain_blocks(self, size):
+        # instance plans are plain generators
+        while True:
+            timestamps = np.fromiter(islice(self.load_plan, size), np.int64)
+            if not len(timestamps):
+                return
+            yield timestamps
+
+    def blocks(self, size=BLOCK_SIZE, start=0, stop=None):
+        '''
+        Returns a generator of (timestamps, markers, missiles) blocks, the
+        same items __iter__ produces from start to stop, size at most. A
+        block never takes more ammo than there are timestamps for it, nor
+        more than info.status.ammo_left() when the block is requested.
+        '''
+        ammo_stream = self._ammo_stream(start)
+        for timestamps in self._timestamp_blocks(size, start, stop):
+            left = info.status.ammo_left()
+            if left is not None and left < len(timestamps):
+                timestamps = timestamps[:left]
+            ammo = list(islice(ammo_stream, len(timestamps)))
+            if not ammo:
+                return
+            missiles, markers = zip(*ammo)
+            yield timestamps[:len(ammo)].tolist(), markers, missiles
+            if len(ammo) < len(timestamps):
+                return
+
+    def segmentable(self):
+        '''
+        Whether ammo can be made in independent segments: the load plan
+        knows its length, the ammo generator starts at any missile without
+        reading the ones before, nothing is filtered out and markers do not
+        depend on earlier missiles
+        '''
+        return (hasattr(self.load_plan, 'blocks') and
+                getattr(self.ammo_generator, 'seekable', False) and
+                not self.factory.chosen_cases and
+                not self.factory.enum_ammo)
 
 
 class Stepper(object):
@@ -56,15 +137,50 @@ class Stepper(object):
         self.af = AmmoFactory(ComponentFactory(**kwargs))
         self.ammo = fmt.Stpd(self.af)
 
-    def write(self, f):
-        for missile in self.ammo:
-            f.write(missile)
+    def segments(self, count):
+        '''
+        Split ammo into at most count (start, stop) ranges of about the same
+        size, a single (0, None) range if it can not be split. The last
+        range is open, so stepping ends on the same limit as in one piece.
+        '''
+        if count < 2 or not self.af.segmentable():
+            return [(0, None)]
+        total = len(self.af.load_plan)
+        left = info.status.ammo_left()
+        if left is not None:
+            total = min(total, left)
+        if info.status.loop_limit:
+            total = min(total, info.status.loop_limit *
+                        self.af.ammo_generator.loop_length)
+        count = min(count, (total + BLOCK_SIZE - 1) // BLOCK_SIZE)
+        if count < 2:
+            return [(0, None)]
+        bounds = [total * i // count for i in range(count)]
+        return list(zip(bounds, bounds[1:] + [None]))
+
+    def write(self, f, start=0, stop=None):
+        if start:
+            info.status.ammo_count = start
+        for block in self.af.blocks(start=start, stop=stop):
+            f.write(self.ammo.render(*block))
             try:
-                info.status.inc_ammo_count()
+                info.status.inc_ammo_count(len(block[0]))
             except StopIteration:
                 break
 
 
+def _make_segment(args):
+    '''
+    Write the stpd of a segment to a file of its own. Returns the number of
+    missiles written and the loop count it ended with.
+    '''
+    stepper_config, filename, file_cache, start, stop = args
+    stepper = Stepper(None, **stepper_config)
+    with open(filename, 'w', file_cache) as f:
+        stepper.write(f, start, stop)
+    return info.status.ammo_count - start, info.status.loop_count
+
+
 class StepperWrapper(object):
     # TODO: review and rewrite this class
     '''
@@ -113,6 +229,7 @@ class StepperWrapper(object):
         self.loop_count = 0
         self.loadscheme = ""
         self.file_cache = 8192
+        self.stepping_processes = 1
 
     def get_option(self, option_ammofile, param2=None):
         ''' get_option wrapper'''
@@ -129,7 +246,7 @@ class StepperWrapper(object):
         opts += ["instances_schedule", "uris", "headers", "header_http",
                  "autocases", "enum_ammo", "ammo_type", "ammo_limit"]
         opts += ["use_caching", "cache_dir", "force_stepping", "file_cache",
-                 "chosen_cases"]
+                 "chosen_cases", "stepping_processes"]
         return opts
 
     def read_config(self):
@@ -170,6 +287,8 @@ class StepperWrapper(object):
                                          self.core.artifacts_base_dir)
         self.cache_dir = os.path.expanduser(cache_dir)
         self.force_stepping = int(self.get_option("force_stepping", '0'))
+        self.stepping_processes = int(self.get_option(
+            "stepping_processes", self.stepping_processes))
         self.stpd = self.get_option(self.OPTION_STPD, "")
         self.chosen_cases = self.get_option("chosen_cases", "").split()
         if self.chosen_cases:
@@ -284,8 +403,7 @@ class StepperWrapper(object):
     def __make_stpd_file(self):
         ''' stpd generation using Stepper class '''
         self.log.info("Making stpd-file: %s", self.stpd)
-        stepper = Stepper(
-            self.core,
+        stepper_config = dict(
             rps_schedule=self.rps_schedule,
             http_ver=self.http_ver,
             ammo_file=self.ammo_file,
@@ -298,6 +416,49 @@ class StepperWrapper(object):
             autocases=self.autocases,
             enum_ammo=self.enum_ammo,
             ammo_type=self.ammo_type,
-            chosen_cases=self.chosen_cases, )
-        with open(self.stpd, 'w', self.file_cache) as os:
-            stepper.write(os)
+            chosen_cases=self.chosen_cases,
+            index_dir=self.cache_dir if self.use_caching else None, )
+        stepper = Stepper(self.core, **stepper_config)
+        segments = stepper.segments(self.stepping_processes)
+        if len(segments) > 1:
+            self.__make_stpd_segments(stepper_config, segments)
+        else:
+            with open(self.stpd, 'w', self.file_cache) as stpd:
+                stepper.write(stpd)
+
+    def __make_stpd_segments(self, stepper_config, segments):
+        '''
+        Make stpd segments in a process pool and join them in stpd-file
+        '''
+        self.log.info("Making stpd-file in %s segments", len(segments))
+        parts = ["%s.part%s" % (self.stpd, i) for i in range(len(segments))]
+        pool = mp.Pool(min(self.stepping_processes, len(segments)))
+        ammo_count = loop_count = 0
+        try:
+            results = pool.imap(
+                _make_segment,
+                [(stepper_config, part, self.file_cache, start, stop)
+                 for part, (start, stop) in zip(parts, segments)])
+            with open(self.stpd, 'wb', self.file_cache) as stpd:
+                for part, (count, loops) in zip(parts, results):
+                    with open(part, 'rb') as segment:
+                        shutil.copyfileobj(segment, stpd, 1024 * 1024)
+                    os.remove(part)
+                    ammo_count += count
+                    if count:
+                        loop_count = loops
+                    try:
+                        info.status.ammo_count = ammo_count
+                    except StopIteration:
+                        pass
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+            for part in parts:
+                if os.path.exists(part):
+                    os.remove(part)
+        try:
+            info.status.loop_count = loop_count
+        except StopIteration:
+            pass
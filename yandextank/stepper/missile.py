@@ -4,13 +4,19 @@ Missile object and generators
 You should update Stepper.status.ammo_count and Stepper.status.loop_count in your custom generators!
 '''
 import logging
-from itertools import cycle
+import mmap
+from itertools import cycle, islice
+from builtins import range
 
 from ..common.resource import manager as resource
 
 from . import info
+from .ammo_index import get_index
 from .module_exceptions import AmmoFileError
 
+# af_position is updated once per this many missiles read through an index
+AF_POSITION_INTERVAL = 1024
+
 
 class HttpAmmo(object):
     '''
@@ -78,26 +84,93 @@ class UriStyleGenerator(object):
         uris - a list of URIs as strings.
         '''
         self.uri_count = len(uris)
-        self.missiles = cycle([(HttpAmmo(uri,
-                                         headers,
-                                         http_ver=http_ver).to_s(), None)
-                               for uri in uris])
+        self.uri_missiles = [(HttpAmmo(uri,
+                                       headers,
+                                       http_ver=http_ver).to_s(), None)
+                             for uri in uris]
+        self.missiles = cycle(self.uri_missiles)
+        self.seekable = True
+        self.loop_length = self.uri_count
 
     def __iter__(self):
-        for m in self.missiles:
+        # missiles are taken in blocks, ahead of ammo_count updates
+        for count, m in enumerate(self.missiles, 1):
+            yield m
+            info.status.loop_count = count / self.uri_count
+
+    def iter_from(self, start):
+        '''
+        Missiles from the start-th one on, the same as __iter__ skipping
+        start missiles
+        '''
+        missiles = cycle(self.uri_missiles)
+        next(islice(missiles, start % self.uri_count,
+                    start % self.uri_count), None)
+        for count, m in enumerate(missiles, start + 1):
             yield m
-            info.status.loop_count = info.status.ammo_count / self.uri_count
+            info.status.loop_count = count / self.uri_count
 
 
 class AmmoFileReader(object):
-    '''Read missiles from ammo file'''
+    '''
+    Read missiles from ammo file. Plain files are indexed once and missiles
+    are sliced from the memory-mapped file, gzipped and remote ones are
+    parsed as they are read.
+    '''
 
-    def __init__(self, filename, **kwargs):
+    def __init__(self, filename, index_dir=None, chosen_cases=None,
+                 **kwargs):
         self.filename = filename
         self.log = logging.getLogger(__name__)
         self.log.info("Loading ammo from '%s'" % filename)
+        self.opener = resource.get_opener(filename)
+        self.index = get_index(self.opener, index_dir)
+        if self.index is not None and chosen_cases:
+            self.index = self.index.select(chosen_cases)
+        # iter_from only jumps straight to a missile through the index
+        self.seekable = self.index is not None
+        # missiles in one loop over the file, known only from the index
+        self.loop_length = len(self.index) if self.seekable else None
 
     def __iter__(self):
+        if self.index is None:
+            return self._read()
+        return self._slice(0)
+
+    def iter_from(self, start):
+        '''
+        Missiles from the start-th one on, the same as __iter__ skipping
+        start missiles
+        '''
+        if self.index is None:
+            return islice(self._read(), start, None)
+        return self._slice(start)
+
+    def _slice(self, start):
+        count = len(self.index)
+        info.status.af_size = self.opener.data_length
+        if not count:
+            return
+        loop, start = divmod(start, count)
+        if loop:
+            info.status.loop_count = loop
+        offsets = self.index.offsets.tolist()
+        ends = (self.index.offsets + self.index.sizes).tolist()
+        markers = self.index.markers()
+        with open(self.filename, 'rb') as ammo_file:
+            ammo = mmap.mmap(ammo_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            while True:
+                for i in range(start, count):
+                    yield ammo[offsets[i]:ends[i]], markers[i]
+                    if not i % AF_POSITION_INTERVAL:
+                        info.status.af_position = ends[i]
+                start = 0
+                info.status.inc_loop_count()
+        finally:
+            ammo.close()
+
+    def _read(self):
         def read_chunk_header(ammo_file):
             chunk_header = ''
             while chunk_header is '':
@@ -271,6 +344,7 @@ class UriReader(object):
 
     def __iter__(self):
         opener = resource.get_opener(self.filename)
+        missiles = 0
         with opener() as ammo_file:
             info.status.af_size = opener.data_length
             while True:
@@ -286,6 +360,7 @@ class UriReader(object):
                             marker = fields[1]
                         else:
                             marker = None
+                        missiles += 1
                         yield (HttpAmmo(uri,
                                         headers=[
                                             ': '.join(header)
@@ -293,7 +368,7 @@ class UriReader(object):
                                         ],
                                         http_ver=self.http_ver, ).to_s(),
                                marker)
-                if info.status.ammo_count == 0:
+                if not missiles:
                     self.log.error("No ammo in uri-style file")
                     raise AmmoFileError("No ammo! Cover me!")
                 ammo_file.seek(0)
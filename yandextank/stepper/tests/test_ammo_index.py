@@ -0,0 +1,51 @@
+import pytest
+
+from yandextank.stepper.ammo_index import AmmoIndex
+from yandextank.stepper.module_exceptions import AmmoFileError
+
+AMMO = (b'5 first\nGET /\n'
+        b'\n'
+        b'3\nabc\n'
+        b'4 second\r\nabcd\n'
+        b'2 first\nxy\n'
+        b'0\n'
+        b'9\nignored\n')
+
+
+@pytest.fixture
+def ammo_file(tmpdir):
+    path = tmpdir.join('ammo.txt')
+    path.write_binary(AMMO)
+    return str(path)
+
+
+class TestAmmoIndex(object):
+    def test_build(self, ammo_file):
+        with open(ammo_file, 'rb') as f:
+            index = AmmoIndex.build(f)
+        assert [AMMO[offset:offset + size] for offset, size in zip(
+            index.offsets.tolist(), index.sizes.tolist())] == [
+                b'GET /', b'abc', b'abcd', b'xy']
+        assert index.markers() == [b'first', None, b'second', b'first']
+
+    def test_select(self, ammo_file):
+        with open(ammo_file, 'rb') as f:
+            index = AmmoIndex.build(f).select([b'first'])
+        assert index.markers() == [b'first', None, b'first']
+
+    def test_save_load(self, ammo_file, tmpdir):
+        with open(ammo_file, 'rb') as f:
+            index = AmmoIndex.build(f)
+        filename = str(tmpdir.join('ammo.npz'))
+        index.save(filename)
+        loaded = AmmoIndex.load(filename)
+        assert loaded.offsets.tolist() == index.offsets.tolist()
+        assert loaded.sizes.tolist() == index.sizes.tolist()
+        assert loaded.markers() == index.markers()
+
+    @pytest.mark.parametrize('ammo', [b'5 first\nGET\n', b'x\nabc\n'])
+    def test_broken(self, ammo, tmpdir):
+        path = tmpdir.join('ammo.txt')
+        path.write_binary(ammo)
+        with open(str(path), 'rb') as f, pytest.raises(AmmoFileError):
+            AmmoIndex.build(f)
@@ -0,0 +1,74 @@
+import os
+
+import pytest
+
+from yandextank.stepper.format import Stpd, StpdReader
+from yandextank.stepper.module_exceptions import StpdFileError
+
+AMMO = [(0, 'a', 'GET / HTTP/1.0\r\n\r\n'), (10, '', 'x'), (10, 'a', 'y\n')]
+
+
+@pytest.fixture
+def stpd_file(tmpdir):
+    path = tmpdir.join('ammo.stpd')
+    path.write(''.join(Stpd(AMMO)))
+    return str(path)
+
+
+class TestStpd(object):
+    def test_render(self):
+        assert Stpd.render(*zip(*AMMO)) == ''.join(Stpd(AMMO))
+
+    def test_render_empty(self):
+        assert Stpd.render([], [], []) == ''
+
+
+class TestStpdReader(object):
+    def test_iter(self, stpd_file):
+        # memoryview slices on py3, buffer slices on py2
+        assert [(timestamp, bytes(missile), marker)
+                for timestamp, missile, marker in StpdReader(stpd_file)] == [
+                    (timestamp, missile.encode('utf8'), marker)
+                    for timestamp, marker, missile in AMMO]
+
+    def test_iter_empty_missile(self, tmpdir):
+        path = tmpdir.join('ammo.stpd')
+        path.write('0 5 a\n\n1 6\nx\n')
+        assert [(timestamp, bytes(missile), marker)
+                for timestamp, missile, marker in StpdReader(str(path))] == [
+                    (5, b'', 'a'), (6, b'x', '')]
+
+    def test_records(self, stpd_file):
+        stpd = StpdReader(stpd_file)
+        missiles = stpd.mmap()
+        assert [(timestamp, missiles[offset:offset + size], marker)
+                for timestamp, offset, size, marker in stpd.records()] == [
+                    (timestamp, missile.encode('utf8'), marker)
+                    for timestamp, marker, missile in AMMO]
+
+    def test_index(self, stpd_file):
+        stpd = StpdReader(stpd_file)
+        records = list(stpd.records())
+        assert list(stpd.index()) == records
+        assert os.path.exists(stpd_file + '_index.npz')
+        assert list(stpd.index()) == records
+
+    def test_index_outdated(self, stpd_file):
+        StpdReader(stpd_file).index()
+        with open(stpd_file, 'a') as f:
+            f.write('1 20 b\nz\n')
+        os.utime(stpd_file, (0, 0))
+        assert list(StpdReader(stpd_file).index())[-1][::3] == (20, 'b')
+
+    def test_empty(self, tmpdir):
+        path = tmpdir.join('empty.stpd')
+        path.write('')
+        assert list(StpdReader(str(path))) == []
+        assert len(StpdReader(str(path)).index()) == 0
+
+    @pytest.mark.parametrize('stpd', ['5 0 a\nab', '5\nabcde\n', 'x 0\n'])
+    def test_broken(self, stpd, tmpdir):
+        path = tmpdir.join('broken.stpd')
+        path.write(stpd)
+        with pytest.raises(StpdFileError):
+            list(StpdReader(str(path)))
@@ -129,3 +129,22 @@ class TestCreate(object):
     def test_create(self, rps_schedule, check_point, expected):
         # pytest.set_trace()
         assert take(check_point, (create(rps_schedule))) == expected
+
+
+class TestBlocks(object):
+    @pytest.mark.parametrize('load_plan', [
+        Line(3.3, 977.7, 123000),
+        Line(500, 7, 61000),
+        Line(10, 10, 30000),
+        Const(333.3, 37000),
+        Stairway(1.2, 5.7, 1.1, 5000),
+        Composite([Const(0, 1000), Line(0, 10, 20000), Const(10, 10000)]),
+    ])
+    def test_same_as_items(self, load_plan):
+        blocks = list(load_plan.blocks(size=100))
+        assert all(len(block) <= 100 for block in blocks)
+        timestamps = [ts for block in blocks for ts in block.tolist()]
+        assert timestamps == list(load_plan)
+        if isinstance(load_plan, Line):
+            assert timestamps == [
+                load_plan.ts(n) for n in range(len(load_plan))]
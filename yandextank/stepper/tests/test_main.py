@@ -0,0 +1,91 @@
+from itertools import islice
+
+import pytest
+import numpy as np
+
+from yandextank.stepper.main import Stepper, StepperWrapper, _slice_blocks
+from yandextank.stepper.missile import UriStyleGenerator
+
+
+@pytest.mark.parametrize('start, stop', [
+    (0, None), (0, 10), (3, None), (4, 6), (5, 9), (9, 100), (12, None)])
+def test_slice_blocks(start, stop):
+    blocks = [np.arange(0, 4), np.arange(4, 8), np.arange(8, 10)]
+    assert np.concatenate(
+        list(_slice_blocks(blocks, start, stop)) or [[]]
+    ).tolist() == list(range(10))[start:stop]
+
+
+class FakeCore(object):
+    def __init__(self, artifacts_base_dir, options):
+        self.artifacts_base_dir = artifacts_base_dir
+        self.options = options
+
+    def get_option(self, section, option, default=None):
+        return self.options.get(option, default)
+
+    def set_option(self, section, option, value):
+        self.options[option] = value
+
+    def publish(self, section, key, value):
+        pass
+
+
+def make_stpd(tmpdir, processes, **options):
+    """
+    stpd bytes and stepper info of a StepperWrapper run
+    """
+    cache_dir = tmpdir.mkdir('processes%s' % processes)
+    options.update(stepping_processes=str(processes),
+                   cache_dir=str(cache_dir))
+    wrapper = StepperWrapper(FakeCore(str(cache_dir), options), 'phantom')
+    wrapper.read_config()
+    wrapper.prepare_stepper()
+    with open(wrapper.stpd, 'rb') as stpd:
+        return stpd.read(), (wrapper.ammo_count, wrapper.loop_count)
+
+
+class TestStepper(object):
+    @pytest.mark.parametrize('config, count, expected', [
+        ({}, 1, [(0, None)]),
+        ({}, 2, [(0, 60000), (60000, None)]),
+        ({'ammo_limit': 19999}, 4, [(0, 6666), (6666, 13333),
+                                   (13333, None)]),
+        ({'loop_limit': 20000}, 4, [(0, 6666), (6666, 13333),
+                                   (13333, None)]),
+        ({'enum_ammo': True}, 4, [(0, None)]),
+        ({'chosen_cases': ['_']}, 4, [(0, None)]),
+        ({'rps_schedule': ['const(10, 10s)']}, 4, [(0, None)]),
+    ])
+    def test_segments(self, config, count, expected):
+        kwargs = dict(rps_schedule=['const(1000, 120s)'], uris=['/'],
+                      headers=[], autocases=0, loop_limit=-1,
+                      ammo_limit=-1)
+        kwargs.update(config)
+        assert Stepper(None, **kwargs).segments(count) == expected
+
+
+class TestStepperWrapper(object):
+    @pytest.mark.parametrize('limits', [
+        {'loop': '100'},
+        {'loop': '3000'},
+        {'ammo_limit': '20000'},
+        {'loop': '3000', 'ammo_limit': '20000'},
+    ])
+    def test_segments_as_one_process(self, tmpdir, limits):
+        ammo = tmpdir.join('ammo.txt')
+        ammo.write_binary(b''.join(
+            b'%d case%d\n%s\n' % (len(uri), i % 2, uri)
+            for i, uri in enumerate(b'GET /%d' % i for i in range(7))))
+        options = dict(limits, ammofile=str(ammo),
+                       rps_schedule='const(1000, 60s)')
+        single = make_stpd(tmpdir, 1, **dict(options))
+        segmented = make_stpd(tmpdir, 4, **dict(options))
+        assert segmented == single
+
+
+@pytest.mark.parametrize('start', [0, 1, 2, 7])
+def test_uri_iter_from(start):
+    generator = UriStyleGenerator(['/a', '/b', '/c'], [])
+    assert list(islice(generator.iter_from(start), 5)) == list(
+        islice(generator, start, start + 5))